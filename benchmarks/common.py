@@ -0,0 +1,101 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List
+
+
+def add_service_args(parser: argparse.ArgumentParser) -> None:
+    """Connection options for the local Postgres and Redis the benchmarks run against."""
+    parser.add_argument("--db-host", default=os.getenv("BENCH_DB_HOST", "localhost"))
+    parser.add_argument("--db-port", type=int, default=int(os.getenv("BENCH_DB_PORT", "5432")))
+    parser.add_argument("--db-user", default=os.getenv("BENCH_DB_USER", "postgres"))
+    parser.add_argument("--db-password", default=os.getenv("BENCH_DB_PASSWORD", "postgres"))
+    # Tables in this database are truncated between scenarios
+    parser.add_argument("--db-name", default=os.getenv("BENCH_DB_NAME", "modtrack_bench"))
+    parser.add_argument("--api-url", default=os.getenv("BENCH_API_URL", "http://localhost:8000"))
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+
+
+def db_secrets(args) -> dict:
+    """Same shape as the modtrack/database secret."""
+    return {
+        "username": args.db_user,
+        "password": args.db_password,
+        "host": args.db_host,
+        "port": args.db_port,
+        "dbname": args.db_name,
+    }
+
+
+def api_secrets(args) -> dict:
+    return {"api_url": args.api_url, "api_key": "test_key"}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(name: str, elapsed: float, files: int, rows: int, latencies: List[float], **extra) -> Dict:
+    """Standard result record: throughput, per-item latency percentiles and peak RSS."""
+    result = {
+        "scenario": name,
+        "seconds": round(elapsed, 3),
+        "files_per_s": round(files / elapsed, 1) if elapsed > 0 else None,
+        "rows_per_s": round(rows / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    result.update(extra)
+    return result
+
+
+def quiet_logging() -> None:
+    """The monitor logs at INFO per file and per task; keep the report readable."""
+    logging.basicConfig(level=logging.WARNING)
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(logging.WARNING)
+
+
+def _run_quietly(func: Callable, *args) -> Dict:
+    quiet_logging()
+    return func(*args)
+
+
+def run_isolated(func: Callable, *args) -> Dict:
+    """
+    Run a scenario in a fresh process, so its peak RSS is not inflated by
+    whatever ran before it.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_run_quietly, func, *args).result()
+
+
+def report(results: List[Dict], json_path: str = None) -> None:
+    columns = []
+    for result in results:
+        columns.extend(key for key in result if key not in columns)
+
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for result in results:
+        print("  ".join(str(result.get(c, "")).ljust(widths[c]) for c in columns))
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {json_path}", file=sys.stderr)
@@ -0,0 +1,137 @@
+"""
+Dashboard throughput under concurrent requests. The dashboard app runs in
+this process on its asyncpg pool, and every endpoint is requested by
+--concurrency clients at once for --seconds at each level:
+
+    python -m benchmarks.dashboard --seed 200000 --concurrency 1,4,16,64
+
+Handlers that blocked the event loop served one request at a time, whatever
+the concurrency; requests/s should now grow with it until the pool
+(--pool-max) or Postgres is saturated, which the pool columns show. The
+accuracy series are downsampled, so their response size stays put as --seed
+grows. With --seed, tables in --db-name are truncated and refilled first.
+"""
+import argparse
+import asyncio
+import time
+import httpx
+import psycopg2
+from modtrack import rollups
+from modtrack.dashboard import routes
+from modtrack.db import init_db_schema
+from .common import add_service_args, db_secrets, percentile, report
+
+ENDPOINTS = [
+    "/health",
+    "/api/predictions?days=1",
+    "/api/filter-predictions?reservoir_id=reservoir_1",
+    "/api/accuracy-data",
+    "/api/accuracy-data?max_points=100",
+]
+
+
+def _seed(secrets: dict, predictions: int, reservoirs: int) -> None:
+    conn = psycopg2.connect(
+        dbname=secrets["dbname"], user=secrets["username"], password=secrets["password"],
+        host=secrets["host"], port=secrets["port"]
+    )
+    try:
+        init_db_schema(conn)
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE validations, predictions, ingested_files, accuracy_rollups")
+            cur.execute(
+                """
+                INSERT INTO predictions
+                (id, reservoir_id, predicted_level, prediction_timestamp, validation_time, file_name)
+                SELECT uuid_generate_v4(), 'reservoir_' || (i %% %(reservoirs)s + 1), 100 + i %% 250,
+                       now() - (i * INTERVAL '7 days' / %(predictions)s),
+                       now() - (i * INTERVAL '7 days' / %(predictions)s) + INTERVAL '1 hour',
+                       'dashboard_' || (i / 1000) || '.csv'
+                FROM generate_series(1, %(predictions)s) AS i
+                """,
+                {"predictions": predictions, "reservoirs": reservoirs}
+            )
+            cur.execute(
+                """
+                INSERT INTO validations (id, prediction_id, actual_level, difference, validated_at)
+                SELECT uuid_generate_v4(), id, predicted_level + 1, 1, validation_time
+                FROM predictions
+                WHERE validation_time <= now()
+                """
+            )
+        conn.commit()
+        rollups.rebuild(conn)
+    finally:
+        conn.close()
+
+
+async def _load(client: httpx.AsyncClient, path: str, concurrency: int, seconds: float) -> dict:
+    latencies, errors, response_bytes = [], 0, 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal errors, response_bytes
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            response_bytes += len(response.content)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    pool = routes.database.stats()
+    return {
+        "endpoint": path,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "errors": errors,
+        "kb_per_response": round(response_bytes / max(len(latencies), 1) / 1024, 1),
+        "pool_size": pool["size"],
+        "acquire_p99_ms": pool["acquire_wait_p99_ms"],
+        "acquire_timeouts": pool["acquire_timeouts"],
+    }
+
+
+async def _run(args) -> list:
+    database = routes.database
+    database.db_secrets = db_secrets(args)
+    database.max_size = args.pool_max
+    await database.start()
+
+    results = []
+    transport = httpx.ASGITransport(app=routes.router)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://dashboard", timeout=60) as client:
+            for path in args.endpoints:
+                for concurrency in args.concurrency:
+                    results.append(await _load(client, path, concurrency, args.seconds))
+    finally:
+        await database.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_service_args(parser)
+    parser.add_argument("--seed", type=int, default=0, help="Refill the tables with this many predictions")
+    parser.add_argument("--reservoirs", type=int, default=50)
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16, 64])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--pool-max", type=int, default=10)
+    parser.add_argument("--endpoint", dest="endpoints", action="append", help="Path to request (repeatable)")
+    args = parser.parse_args()
+    args.endpoints = args.endpoints or ENDPOINTS
+
+    if args.seed:
+        _seed(db_secrets(args), args.seed, args.reservoirs)
+    report(asyncio.run(_run(args)), args.json_path)
+
+
+if __name__ == "__main__":
+    main()
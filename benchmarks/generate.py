@@ -0,0 +1,118 @@
+"""
+Synthetic prediction files for benchmarking.
+
+    python -m benchmarks.generate /tmp/bench --files 100 --predictions 10000
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+
+def _iso(value: datetime) -> str:
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _predictions(rng: random.Random, count: int, reservoirs: int, timestamp: datetime, spread_hours: float):
+    spread_seconds = int(spread_hours * 3600)
+    for _ in range(count):
+        yield {
+            "reservoir_id": f"reservoir_{rng.randint(1, reservoirs)}",
+            "predicted_level": round(rng.uniform(100, 350), 2),
+            "validation_time": _iso(timestamp + timedelta(seconds=rng.randint(0, spread_seconds))),
+        }
+
+
+def write_json(path: Path, predictions, timestamp: datetime) -> None:
+    """Write the regular prediction file layout without building the whole document in memory."""
+    with open(path, "w") as f:
+        f.write(f'{{"timestamp": "{_iso(timestamp)}", "predictions": [')
+        for i, prediction in enumerate(predictions):
+            f.write((",\n" if i else "\n") + json.dumps(prediction))
+        f.write("\n]}\n")
+
+
+def write_ndjson(path: Path, predictions, timestamp: datetime) -> None:
+    with open(path, "w") as f:
+        f.write(json.dumps({"timestamp": _iso(timestamp)}) + "\n")
+        for prediction in predictions:
+            f.write(json.dumps(prediction) + "\n")
+
+
+def write_parquet(path: Path, predictions, timestamp: datetime) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = list(predictions)
+    table = pa.table({
+        "reservoir_id": [p["reservoir_id"] for p in rows],
+        "predicted_level": [p["predicted_level"] for p in rows],
+        "validation_time": pa.array(
+            [datetime.fromisoformat(p["validation_time"].replace('Z', '+00:00')) for p in rows],
+            pa.timestamp("us", tz="UTC")
+        ),
+    })
+    pq.write_table(table.replace_schema_metadata({"timestamp": _iso(timestamp)}), path)
+
+
+WRITERS = {"json": (".json", write_json), "ndjson": (".ndjson", write_ndjson), "parquet": (".parquet", write_parquet)}
+
+
+def generate_files(
+    directory: Path,
+    files: int,
+    predictions: int,
+    reservoirs: int = 3,
+    spread_hours: float = 24.0,
+    fmt: str = "json",
+    start: datetime = None,
+    seed: int = 0,
+    atomic: bool = False,
+    prefix: str = "prediction",
+) -> List[Path]:
+    """
+    Write 'files' prediction files of 'predictions' rows each into 'directory'.
+    Validation times fall within 'spread_hours' after each file's timestamp.
+    With 'atomic', each file is written under a temporary name and renamed into
+    place, as a well-behaved producer would.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    start = start or datetime.now(timezone.utc).replace(microsecond=0)
+    suffix, writer = WRITERS[fmt]
+
+    paths = []
+    for i in range(files):
+        timestamp = start + timedelta(minutes=5 * i)
+        path = directory / f"{prefix}_{i:06d}{suffix}"
+        target = path.with_name(path.name + ".tmp") if atomic else path
+        writer(target, _predictions(rng, predictions, reservoirs, timestamp, spread_hours), timestamp)
+        if atomic:
+            os.replace(target, path)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--predictions", type=int, default=1000)
+    parser.add_argument("--reservoirs", type=int, default=3)
+    parser.add_argument("--spread-hours", type=float, default=24.0)
+    parser.add_argument("--format", choices=sorted(WRITERS), default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_files(
+        args.directory, args.files, args.predictions, args.reservoirs,
+        args.spread_hours, args.format, seed=args.seed
+    )
+    print(f"Wrote {len(paths)} files to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Ingestion throughput benchmarks, run against a local Postgres and Redis.
+
+    CELERY_BROKER_URL=redis://localhost:6379/0 \\
+        python -m benchmarks.ingest --files 200 --predictions 5000
+
+Scenarios:
+  process_file  serial ModelResultsHandler.process_file calls
+  scan          scan_directory over a backlog, ingested by the worker pool,
+                then the cost of rescanning once nothing is new
+  watchdog      files renamed into a watched directory, through the observer,
+                ingest pipeline and worker pool
+  spool         process_file calls while the database is marked down, so
+                every file goes to the local spool
+  replay        draining such a spool into Postgres with SpoolReplayer
+
+Each scenario runs in its own process and reports files/s, rows/s, p50/p99
+per-file latency and peak RSS. Tables in --db-name are truncated first.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from watchdog.observers import Observer
+from modtrack.ingestion import IngestionPool, IngestPipeline
+from modtrack.monitor import ModelResultsHandler, scan_directory
+from modtrack.scanner import IncrementalScanner
+from modtrack.spool import Spool, SpoolReplayer
+from .common import add_service_args, api_secrets, db_secrets, report, run_isolated, summarize
+from .generate import generate_files
+
+
+def _handler(directory: Path, options: dict) -> ModelResultsHandler:
+    handler = ModelResultsHandler(directory, db_secrets=options["db"], api_secrets=options["api"])
+    with handler.db_connection.cursor() as cur:
+        cur.execute("TRUNCATE validations, predictions, ingested_files, accuracy_rollups")
+    handler.db_connection.commit()
+    return handler
+
+
+def _timed(handler: ModelResultsHandler, latencies: list) -> None:
+    """Record how long each process_file call takes."""
+    process_file = handler.process_file
+
+    def timed_process_file(file_path, conn=None):
+        started = time.perf_counter()
+        try:
+            return process_file(file_path, conn)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    handler.process_file = timed_process_file
+
+
+def scenario_process_file(options: dict) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        paths = generate_files(directory, options["files"], options["predictions"],
+                               options["reservoirs"], options["spread_hours"], options["format"])
+        handler = _handler(directory, options)
+        latencies = []
+        _timed(handler, latencies)
+
+        started = time.perf_counter()
+        for path in paths:
+            handler.process_file(path)
+        elapsed = time.perf_counter() - started
+
+    return summarize("process_file", elapsed, len(paths), len(paths) * options["predictions"], latencies)
+
+
+def scenario_scan(options: dict) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        paths = generate_files(directory, options["files"], options["predictions"],
+                               options["reservoirs"], options["spread_hours"], options["format"])
+        handler = _handler(directory, options)
+        latencies = []
+        _timed(handler, latencies)
+
+        pool = IngestionPool(handler, workers=options["workers"])
+        pool.start()
+        handler.ingestion_pool = pool
+        scanner = IncrementalScanner(directory)
+
+        started = time.perf_counter()
+        scan_directory(directory, handler, scanner)
+        pool.join()
+        elapsed = time.perf_counter() - started
+
+        # Nothing is new now: how long does a periodic scan cost?
+        rescan_started = time.perf_counter()
+        scan_directory(directory, handler)
+        full_rescan = time.perf_counter() - rescan_started
+
+        rescan_started = time.perf_counter()
+        scan_directory(directory, handler, scanner)
+        incremental_rescan = time.perf_counter() - rescan_started
+        pool.stop()
+
+    return summarize(
+        "scan", elapsed, len(paths), len(paths) * options["predictions"], latencies,
+        full_rescan_ms=round(full_rescan * 1000, 2),
+        incremental_rescan_ms=round(incremental_rescan * 1000, 2),
+    )
+
+
+def scenario_watchdog(options: dict, timeout: float = 3600) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        handler = _handler(directory, options)
+        pool = IngestionPool(handler, workers=options["workers"])
+        pool.start()
+        pipeline = IngestPipeline(pool, poll_interval=0.05)
+        pipeline.start()
+        handler.ingestion_pool = pool
+        handler.pipeline = pipeline
+
+        observer = Observer()
+        observer.schedule(handler, str(directory), recursive=False)
+        observer.start()
+
+        started = time.perf_counter()
+        # Renamed into place, so the pipeline doesn't wait for them to settle
+        paths = generate_files(directory, options["files"], options["predictions"],
+                               options["reservoirs"], options["spread_hours"], options["format"],
+                               atomic=True)
+        while pipeline.ingested < len(paths) and time.perf_counter() - started < timeout:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        observer.stop()
+        observer.join()
+        pipeline.stop()
+        pool.stop()
+
+    return summarize("watchdog", elapsed, pipeline.ingested, pipeline.ingested * options["predictions"],
+                     pipeline.latency_samples())
+
+
+def _spool_files(directory: Path, handler: ModelResultsHandler, options: dict, latencies: list) -> tuple:
+    """Spool a freshly generated backlog; returns (spool, files, seconds)."""
+    paths = generate_files(directory, options["files"], options["predictions"],
+                           options["reservoirs"], options["spread_hours"], options["format"])
+    handler.spool = Spool(directory / "spool")
+    handler.spool.mark_db_down()
+    _timed(handler, latencies)
+
+    started = time.perf_counter()
+    for path in paths:
+        handler.process_file(path)
+    elapsed = time.perf_counter() - started
+    handler.spool.close()
+    return handler.spool, len(paths), elapsed
+
+
+def scenario_spool(options: dict) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        handler = _handler(Path(tmp), options)
+        latencies = []
+        spool, files, elapsed = _spool_files(Path(tmp), handler, options, latencies)
+        backlog = spool.backlog_bytes()
+
+    return summarize("spool", elapsed, files, spool.spooled_rows, latencies,
+                     spool_mb=round(backlog / 1024 / 1024, 1))
+
+
+def scenario_replay(options: dict) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        handler = _handler(Path(tmp), options)
+        spool, files, _ = _spool_files(Path(tmp), handler, options, [])
+        replayer = SpoolReplayer(spool, handler.connect_db, batch_rows=options["replay_batch_rows"])
+
+        started = time.perf_counter()
+        inserted = replayer.drain()
+        elapsed = time.perf_counter() - started
+        replayer.stop()
+
+    return summarize("replay", elapsed, replayer.replayed_files, inserted, [],
+                     batch_rows=replayer.batch_rows, segments=replayer.replayed_segments)
+
+
+SCENARIOS = {
+    "process_file": scenario_process_file,
+    "scan": scenario_scan,
+    "watchdog": scenario_watchdog,
+    "spool": scenario_spool,
+    "replay": scenario_replay,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append",
+                        help="Scenario to run (repeatable); default is all")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--predictions", type=int, default=1000)
+    parser.add_argument("--reservoirs", type=int, default=3)
+    parser.add_argument("--spread-hours", type=float, default=24.0)
+    parser.add_argument("--format", choices=["json", "ndjson", "parquet"], default="json")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--replay-batch-rows", type=int, default=50000)
+    add_service_args(parser)
+    args = parser.parse_args()
+
+    options = {
+        "files": args.files,
+        "predictions": args.predictions,
+        "reservoirs": args.reservoirs,
+        "spread_hours": args.spread_hours,
+        "format": args.format,
+        "workers": args.workers,
+        "replay_batch_rows": args.replay_batch_rows,
+        "db": db_secrets(args),
+        "api": api_secrets(args),
+    }
+
+    results = [run_isolated(SCENARIOS[name], options) for name in args.scenario or SCENARIOS]
+    report(results, args.json_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Validation throughput benchmarks, run against a local Postgres and the mock
+water-level API. Give the API some latency, or every scenario just measures
+localhost round trips:
+
+    MOCK_API_LATENCY_MS=50 uvicorn modtrack.mock_api.app:app --port 8000
+    python -m benchmarks.validation --predictions 2000
+
+Scenarios:
+  task   validate_prediction_task called once per prediction, as one prefork
+         worker process runs it
+  async  the asyncio engine validating every prediction with its own
+         water-level request, up to --concurrency in flight
+
+Both run in a single process, so validations/s is per worker process. Tables
+in --db-name are truncated first.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+from modtrack import resources
+from modtrack.async_validation import AsyncValidationEngine
+from modtrack.celery_app import validate_prediction_task
+from modtrack.db import init_db_schema
+from .common import add_service_args, api_secrets, db_secrets, report, run_isolated, summarize
+
+
+def _seed(options: dict) -> list:
+    """Insert 'predictions' due predictions and return (id, reservoir_id, predicted_level) for each."""
+    secrets = options["db"]
+    conn = psycopg2.connect(
+        dbname=secrets["dbname"], user=secrets["username"], password=secrets["password"],
+        host=secrets["host"], port=secrets["port"]
+    )
+    init_db_schema(conn)
+    now = datetime.now(timezone.utc)
+    rows = [
+        (str(uuid.uuid4()), f"reservoir_{i % options['reservoirs'] + 1}", 100 + i % 250, now, now, "bench")
+        for i in range(options["predictions"])
+    ]
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE validations, predictions, ingested_files, accuracy_rollups")
+        execute_values(
+            cur,
+            """
+            INSERT INTO predictions
+            (id, reservoir_id, predicted_level, prediction_timestamp, validation_time, file_name)
+            VALUES %s
+            """,
+            rows
+        )
+    conn.commit()
+    conn.close()
+    return [(prediction_id, reservoir_id, float(level)) for prediction_id, reservoir_id, level, *_ in rows]
+
+
+def scenario_task(options: dict) -> dict:
+    predictions = _seed(options)
+    resources._resources = resources.WorkerResources(options["db"], options["api"])
+
+    latencies = []
+    started = time.perf_counter()
+    for prediction_id, reservoir_id, level in predictions:
+        task_started = time.perf_counter()
+        validate_prediction_task(prediction_id, reservoir_id, level)
+        latencies.append(time.perf_counter() - task_started)
+    elapsed = time.perf_counter() - started
+
+    resources.close_worker_resources()
+    return summarize("task", elapsed, 0, len(predictions), latencies)
+
+
+def scenario_async(options: dict) -> dict:
+    predictions = _seed(options)
+
+    async def run():
+        engine = AsyncValidationEngine(options["db"], options["api"], options["concurrency"])
+        await engine.start()
+        latencies = []
+
+        async def timed(reservoir_id, prediction_id, level):
+            group_started = time.perf_counter()
+            await engine.validate_group(reservoir_id, [(prediction_id, level)])
+            latencies.append(time.perf_counter() - group_started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(r, p, level) for p, r, level in predictions))
+        elapsed = time.perf_counter() - started
+        await engine.close()
+        return elapsed, latencies
+
+    elapsed, latencies = asyncio.run(run())
+    return summarize("async", elapsed, 0, len(predictions), latencies, concurrency=options["concurrency"])
+
+
+SCENARIOS = {
+    "task": scenario_task,
+    "async": scenario_async,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append",
+                        help="Scenario to run (repeatable); default is all")
+    parser.add_argument("--predictions", type=int, default=1000)
+    parser.add_argument("--reservoirs", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    add_service_args(parser)
+    args = parser.parse_args()
+
+    options = {
+        "predictions": args.predictions,
+        "reservoirs": args.reservoirs,
+        "concurrency": args.concurrency,
+        "db": db_secrets(args),
+        "api": api_secrets(args),
+    }
+
+    results = [run_isolated(SCENARIOS[name], options) for name in args.scenario or SCENARIOS]
+    report(results, args.json_path)
+
+
+if __name__ == "__main__":
+    main()
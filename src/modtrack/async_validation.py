@@ -0,0 +1,273 @@
+"""
+Asyncio validation engine.
+
+The Celery tasks in celery_app.py block on one HTTP call at a time, so a
+prefork worker has at most one water-level request in flight per process. The
+engine here runs every request of a task concurrently on one event loop,
+bounded by ASYNC_VALIDATION_CONCURRENCY, and writes validations through an
+asyncpg pool.
+
+It runs inside validate_predictions_async_task. The engine's loop runs on a
+thread of its own, and every task running in the process feeds its groups
+into it, so a dedicated worker with a thread pool keeps the requests of many
+tasks in flight at once:
+
+    python -m modtrack.async_validation
+"""
+import asyncio
+import logging
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import asyncpg
+import httpx
+from .aws_utils import SecretsManager
+from .config import Config
+from .db import INSERT_VALIDATIONS_SQL, VALIDATION_COLUMNS
+from .reading_cache import AsyncReadingCache
+from .upstream import AsyncAdaptiveLimiter, AsyncUpstreamClient, MetricsPublisher
+
+logger = logging.getLogger(__name__)
+
+# (reservoir_id, [(prediction_id, predicted_level), ...])
+ValidationGroup = Tuple[str, Sequence[Sequence]]
+
+# Numbered placeholders for asyncpg
+_INSERT_VALIDATIONS = INSERT_VALIDATIONS_SQL.format(
+    *(f"${n}" for n in range(1, len(VALIDATION_COLUMNS) + 1))
+)
+
+
+class AsyncValidationEngine:
+    """
+    Validates groups of predictions concurrently. Each group shares a
+    reservoir, so its level is fetched once; levels for many groups come from
+    bulk requests of WATER_LEVEL_BATCH_SIZE reservoirs. The number of
+    water-level requests in flight adapts to how the API copes, up to
+    'concurrency'.
+    """
+
+    def __init__(self, db_secrets: dict, api_secrets: dict,
+                 concurrency: int = Config.ASYNC_VALIDATION_CONCURRENCY):
+        self.db_secrets = db_secrets
+        self.api_secrets = api_secrets
+        self.concurrency = concurrency
+        self.pool: Optional[asyncpg.Pool] = None
+        self.http: Optional[httpx.AsyncClient] = None
+        self.api: Optional[AsyncUpstreamClient] = None
+        self.reading_cache: Optional[AsyncReadingCache] = None
+        # Reservoirs the API reported as not found, which retrying won't fix
+        self.unknown_reservoirs = set()
+
+    async def start(self) -> None:
+        self.pool = await asyncpg.create_pool(
+            database=self.db_secrets['dbname'],
+            user=self.db_secrets['username'],
+            password=self.db_secrets['password'],
+            host=self.db_secrets['host'],
+            port=int(self.db_secrets['port']),
+            min_size=1,
+            max_size=Config.ASYNC_DB_POOL_MAX
+        )
+        self.http = httpx.AsyncClient(
+            base_url=self.api_secrets['api_url'],
+            headers={"Authorization": f"Bearer {self.api_secrets['api_key']}"},
+            http2=True,
+            timeout=Config.HTTP_TIMEOUT,
+            # Over HTTP/1.1 every in-flight request needs its own connection
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+                keepalive_expiry=30.0
+            )
+        )
+        self.api = AsyncUpstreamClient(
+            self.http,
+            limiter=AsyncAdaptiveLimiter(maximum=self.concurrency),
+            publisher=MetricsPublisher.from_url()
+        )
+        if Config.READING_CACHE_ENABLED:
+            self.reading_cache = AsyncReadingCache.from_url()
+
+    async def close(self) -> None:
+        if self.reading_cache is not None:
+            await self.reading_cache.close()
+        if self.http is not None:
+            await self.http.aclose()
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def get_water_level(self, reservoir_id: str) -> float:
+        if self.reading_cache is None:
+            return await self._fetch_water_level(reservoir_id)
+        return await self.reading_cache.get_or_fetch(reservoir_id, lambda: self._fetch_water_level(reservoir_id))
+
+    async def _fetch_water_level(self, reservoir_id: str) -> float:
+        response = await self.api.request("GET", f"/water-level/{reservoir_id}")
+        return response.json()["water_level"]
+
+    async def get_water_levels(self, reservoir_ids: List[str]) -> Dict[str, float]:
+        """Levels for many reservoirs; unknown reservoirs and failed requests are left out."""
+        if self.reading_cache is None:
+            return await self._fetch_water_levels(reservoir_ids)
+        return await self.reading_cache.get_many(reservoir_ids, self._fetch_water_levels)
+
+    async def _fetch_water_levels(self, reservoir_ids: List[str]) -> Dict[str, float]:
+        batch_size = Config.WATER_LEVEL_BATCH_SIZE
+        chunks = [reservoir_ids[start:start + batch_size] for start in range(0, len(reservoir_ids), batch_size)]
+        results = await asyncio.gather(*(self._fetch_chunk(chunk) for chunk in chunks), return_exceptions=True)
+
+        levels = {}
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error fetching water levels for {len(chunk)} reservoirs: {result}")
+            else:
+                levels.update(result)
+        return levels
+
+    async def _fetch_chunk(self, reservoir_ids: List[str]) -> Dict[str, float]:
+        response = await self.api.request("POST", "/water-levels", json={"reservoir_ids": reservoir_ids})
+        payload = response.json()
+        self.unknown_reservoirs.update(payload["not_found"])
+        return {r["reservoir_id"]: r["water_level"] for r in payload["readings"]}
+
+    async def validate_group(self, reservoir_id: str, predictions: Sequence[Sequence]) -> int:
+        actual_level = await self.get_water_level(reservoir_id)
+        return await self._insert(self._records(actual_level, predictions))
+
+    async def validate(self, groups: Iterable[ValidationGroup]) -> dict:
+        """
+        Validate all groups, fetching their levels with concurrent bulk
+        requests; a reservoir without a level doesn't stop the others. Those
+        whose request failed, rather than being unknown to the API, are
+        listed under "retry".
+        """
+        groups = list(groups)
+        levels = await self.get_water_levels([reservoir_id for reservoir_id, _ in groups])
+
+        records, failed, retry = [], [], []
+        for reservoir_id, predictions in groups:
+            if reservoir_id not in levels:
+                logger.error(f"No water level for {reservoir_id}; skipping {len(predictions)} predictions")
+                failed.append(reservoir_id)
+                if reservoir_id not in self.unknown_reservoirs:
+                    retry.append(reservoir_id)
+                continue
+            records.extend(self._records(levels[reservoir_id], predictions))
+
+        validated = await self._insert(records) if records else 0
+        return {
+            "status": "success" if not failed else "partial",
+            "validated": validated,
+            "failed": failed,
+            "retry": retry,
+        }
+
+    @staticmethod
+    def _records(actual_level: float, predictions: Sequence[Sequence]) -> List[tuple]:
+        validated_at = datetime.now(timezone.utc)
+        return [
+            (uuid.uuid4(), uuid.UUID(str(prediction_id)), actual_level,
+             abs(actual_level - float(predicted_level)), validated_at)
+            for prediction_id, predicted_level in predictions
+        ]
+
+    async def _insert(self, records: List[tuple]) -> int:
+        """Insert validations, one array per column; predictions already validated are skipped."""
+        columns = [list(column) for column in zip(*records)]
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(_INSERT_VALIDATIONS, *columns)
+        # "INSERT 0 <rows>"
+        return int(status.split()[-1])
+
+
+class _EngineRunner:
+    """
+    An engine and the event loop it lives on, for synchronous callers such as
+    Celery tasks. The loop runs on a thread of its own for the life of the
+    process, so the pool and HTTP connections are reused, and callers on any
+    number of threads can validate on it at the same time.
+    """
+
+    def __init__(self, engine: AsyncValidationEngine = None):
+        if engine is None:
+            secrets = SecretsManager()
+            engine = AsyncValidationEngine(
+                secrets.get_secret(Config.DB_SECRET_NAME),
+                secrets.get_secret(Config.API_SECRET_NAME)
+            )
+        self.engine = engine
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async-validation", daemon=True)
+        self._thread.start()
+        try:
+            self._call(self.engine.start())
+        except BaseException:
+            self._stop_loop()
+            raise
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def run(self, groups: List[ValidationGroup]) -> dict:
+        return self._call(self.engine.validate(groups))
+
+    def _stop_loop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def close(self) -> None:
+        try:
+            self._call(self.engine.close())
+        finally:
+            self._stop_loop()
+
+
+_runner: Optional[_EngineRunner] = None
+_runner_lock = threading.Lock()
+
+
+def _get_runner() -> _EngineRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = _EngineRunner()
+            logger.info(f"Started async validation engine (concurrency={Config.ASYNC_VALIDATION_CONCURRENCY})")
+        return _runner
+
+
+def run_validation(groups: List[ValidationGroup]) -> dict:
+    """
+    Validate groups on this process's engine, created on first use. Calls
+    from several threads run on the engine's loop concurrently.
+    """
+    return _get_runner().run(groups)
+
+
+def close_validation_engine() -> None:
+    global _runner
+    with _runner_lock:
+        if _runner is not None:
+            _runner.close()
+            _runner = None
+
+
+def main():
+    """
+    Run a Celery worker dedicated to the async validation queue. Its threads
+    only wait on the shared event loop, so one process with
+    ASYNC_VALIDATION_TASKS threads keeps that many tasks' requests in flight.
+    """
+    from .celery_app import celery_app
+
+    logging.basicConfig(level=logging.INFO)
+    celery_app.worker_main([
+        "worker", "--pool=threads", f"--concurrency={Config.ASYNC_VALIDATION_TASKS}", "--loglevel=INFO",
+        "--queues", Config.ASYNC_VALIDATION_QUEUE
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,19 @@
 import boto3
 import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
 from .config import Config, Environment
 
+logger = logging.getLogger(__name__)
+
 class AWSClients:
+    # boto3 clients are thread-safe once created, so one per service and
+    # configuration is shared by the whole process
+    _shared: Dict[tuple, object] = {}
+    _lock = threading.Lock()
+
     def __init__(self):
         self.environment = Config.ENV
         
@@ -16,23 +27,122 @@ class AWSClients:
                 'region_name': Config.AWS_REGION
             })
 
+    def _client(self, service: str):
+        key = (service, tuple(sorted(self.boto3_args.items())))
+        client = AWSClients._shared.get(key)
+        if client is None:
+            # Creating clients through the default session is not thread-safe
+            with AWSClients._lock:
+                client = AWSClients._shared.get(key)
+                if client is None:
+                    client = boto3.client(service, **self.boto3_args)
+                    AWSClients._shared[key] = client
+        return client
+
     def get_secrets_client(self):
-        return boto3.client('secretsmanager', **self.boto3_args)
+        return self._client('secretsmanager')
     
     def get_events_client(self):
-        return boto3.client('events', **self.boto3_args)
+        return self._client('events')
+
+class SecretsCache:
+    """
+    Process-wide cache of secret values.
+
+    Entries are served for 'ttl' seconds. A hit within 'refresh_ahead' seconds
+    of expiry triggers a background refresh, so rotated values are picked up
+    without a caller ever waiting on Secrets Manager. Callers that see an
+    authentication failure can force a refresh.
+    """
+
+    def __init__(self, ttl: float, refresh_ahead: float):
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self._entries: Dict[str, tuple] = {}  # name -> (value, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def get(self, name: str, fetch: Callable[[str], dict], force_refresh: bool = False) -> dict:
+        with self._lock:
+            entry = self._entries.get(name)
+            age = time.monotonic() - entry[1] if entry is not None else None
+            hit = age is not None and age < self.ttl and not force_refresh
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if hit:
+            if age >= self.ttl - self.refresh_ahead:
+                self._refresh_in_background(name, fetch)
+            return entry[0]
+
+        value = fetch(name)
+        self._store(name, value)
+        return value
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
+
+    def _store(self, name: str, value: dict) -> None:
+        with self._lock:
+            self._entries[name] = (value, time.monotonic())
+
+    def _refresh_in_background(self, name: str, fetch: Callable[[str], dict]) -> None:
+        with self._lock:
+            if name in self._refreshing:
+                return
+            self._refreshing.add(name)
+
+        def refresh():
+            try:
+                self._store(name, fetch(name))
+                with self._lock:
+                    self.refreshes += 1
+            except Exception as e:
+                # Keep serving the current value until it expires
+                with self._lock:
+                    self.refresh_errors += 1
+                logger.warning(f"Background refresh of secret {name} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(name)
+
+        threading.Thread(target=refresh, name=f"secret-refresh-{name}", daemon=True).start()
+
+secrets_cache = SecretsCache(Config.SECRETS_TTL_SECONDS, Config.SECRETS_REFRESH_AHEAD_SECONDS)
 
 class SecretsManager:
     def __init__(self):
-        self.client = boto3.client(
-            'secretsmanager',
-            endpoint_url='http://localstack:4566',  # Changed from localhost
-            region_name='us-east-1',
-            aws_access_key_id='test',
-            aws_secret_access_key='test'
-        )
-
-    def get_secret(self, secret_name: str) -> dict:
+        self.client = AWSClients().get_secrets_client()
+
+    def get_secret(self, secret_name: str, force_refresh: bool = False) -> dict:
+        """
+        Return a secret from the process-wide cache, fetching it on a miss.
+        Pass force_refresh after an authentication failure, in case the
+        secret was rotated.
+        """
+        return secrets_cache.get(secret_name, self._fetch_secret, force_refresh)
+
+    def _fetch_secret(self, secret_name: str) -> dict:
         try:
             response = self.client.get_secret_value(SecretId=secret_name)
             return json.loads(response['SecretString'])
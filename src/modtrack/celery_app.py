@@ -1,10 +1,13 @@
 # celery_app.py
 import os
 from celery import Celery
-from .aws_utils import SecretsManager
+from celery.utils.time import get_exponential_backoff_interval
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from .async_validation import close_validation_engine, run_validation
 from .config import Config
-import psycopg2
-import httpx
+from .resources import get_worker_resources, close_worker_resources
+from .upstream import UpstreamUnavailable
+from .db import insert_validations
 import uuid
 from datetime import datetime, timezone
 
@@ -15,57 +18,128 @@ celery_app = Celery(
     broker=BROKER_URL,
     include=["src.modtrack.celery_app"]
 )
+celery_app.conf.task_routes = {
+    "modtrack.celery_app.validate_predictions_async_task": {"queue": Config.ASYNC_VALIDATION_QUEUE},
+}
 
-@celery_app.task(name="modtrack.celery_app.validate_prediction_task")
+# Validations that failed only because the API was unavailable are retried
+# later with jittered exponential backoff, instead of being dropped
+UPSTREAM_RETRY = dict(
+    autoretry_for=(UpstreamUnavailable,),
+    retry_backoff=10,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    max_retries=Config.VALIDATION_TASK_RETRIES
+)
+
+@worker_process_init.connect
+def _init_worker_resources(**kwargs):
+    """Set up the pool, HTTP client and secrets once per worker process."""
+    get_worker_resources()
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _close_worker_resources(**kwargs):
+    # worker_shutdown covers the solo pool, which has no child processes
+    close_validation_engine()
+    close_worker_resources()
+
+@celery_app.task(name="modtrack.celery_app.validate_prediction_task", **UPSTREAM_RETRY)
 def validate_prediction_task(prediction_id: str, reservoir_id: str, predicted_level: float):
     """
     A Celery task to perform the validation step.
     This is the 'heavy' or 'concurrent' work we want to offload.
     """
     try:
-        # 1. Connect to DB via secrets
-        secrets = SecretsManager()
-        api_secrets = secrets.get_secret(Config.API_SECRET_NAME)
-        db_secrets = secrets.get_secret(Config.DB_SECRET_NAME)
-
-        conn = psycopg2.connect(
-            dbname=db_secrets['dbname'],
-            user=db_secrets['username'],
-            password=db_secrets['password'],
-            host=db_secrets['host'],
-            port=db_secrets['port']
-        )
-        cur = conn.cursor()
+        resources = get_worker_resources()
 
-        # 2. Call external API
-        api_client = httpx.Client(timeout=10.0)
-        response = api_client.get(
-            f"{api_secrets['api_url']}/water-level/{reservoir_id}",
-            headers={"Authorization": f"Bearer {api_secrets['api_key']}"}
-        )
-        response.raise_for_status()
-        data = response.json()
-        actual_level = data["water_level"]
+        # 1. Call external API
+        actual_level = resources.get_water_level(reservoir_id)
 
-        # 3. Calculate difference and insert validation record
+        # 2. Calculate difference and insert validation record
         difference = abs(actual_level - predicted_level)
-        cur.execute("""
-            INSERT INTO validations
-            (id, prediction_id, actual_level, difference, validated_at)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (
-            str(uuid.uuid4()),
-            prediction_id,
-            actual_level,
-            difference,
-            datetime.now(timezone.utc)
-        ))
-        conn.commit()
-
-        cur.close()
-        conn.close()
+        with resources.connection() as conn:
+            with conn.cursor() as cur:
+                # Skipped if the prediction was validated already, e.g. by a retry
+                inserted = insert_validations(cur, [(
+                    str(uuid.uuid4()),
+                    prediction_id,
+                    actual_level,
+                    difference,
+                    datetime.now(timezone.utc)
+                )])
+            conn.commit()
+
+        if not inserted:
+            return {"status": "duplicate", "difference": difference}
         return {"status": "success", "difference": difference}
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"Error validating prediction: {str(e)}")
         return {"status": "error", "message": str(e)}
+
+@celery_app.task(name="modtrack.celery_app.validate_reservoirs_task", **UPSTREAM_RETRY)
+def validate_reservoirs_task(groups: list):
+    """
+    Validate predictions for many reservoirs. 'groups' is a list of
+    [reservoir_id, [[prediction_id, predicted_level], ...]]; the levels come
+    from bulk requests of up to WATER_LEVEL_BATCH_SIZE reservoirs each, and all
+    validations go in one insert.
+    """
+    try:
+        resources = get_worker_resources()
+
+        levels = resources.get_water_levels([reservoir_id for reservoir_id, _ in groups])
+        validated_at = datetime.now(timezone.utc)
+        rows, missing = [], []
+        for reservoir_id, predictions in groups:
+            if reservoir_id not in levels:
+                missing.append(reservoir_id)
+                continue
+            actual_level = levels[reservoir_id]
+            rows.extend(
+                (str(uuid.uuid4()), prediction_id, actual_level, abs(actual_level - predicted_level), validated_at)
+                for prediction_id, predicted_level in predictions
+            )
+        if missing:
+            print(f"No water level for reservoirs: {', '.join(missing)}")
+
+        validated = 0
+        if rows:
+            with resources.connection() as conn:
+                with conn.cursor() as cur:
+                    validated = insert_validations(cur, rows)
+                conn.commit()
+
+        return {"status": "success" if not missing else "partial", "validated": validated, "missing": missing}
+
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error validating predictions for {len(groups)} reservoirs: {str(e)}")
+        return {"status": "error", "message": str(e)}
+
+@celery_app.task(bind=True, name="modtrack.celery_app.validate_predictions_async_task",
+                 max_retries=Config.VALIDATION_TASK_RETRIES)
+def validate_predictions_async_task(self, groups: list):
+    """
+    Validate predictions for many reservoirs at once on the asyncio engine.
+    'groups' is a list of [reservoir_id, [[prediction_id, predicted_level], ...]];
+    all water levels are requested concurrently. Groups whose level could not
+    be fetched are retried on their own later.
+    """
+    try:
+        result = run_validation(groups)
+    except Exception as e:
+        print(f"Error validating predictions: {str(e)}")
+        return {"status": "error", "message": str(e)}
+
+    if result["retry"] and self.request.retries < self.max_retries:
+        retry = set(result["retry"])
+        raise self.retry(
+            args=[[group for group in groups if group[0] in retry]],
+            countdown=get_exponential_backoff_interval(10, self.request.retries, 600, full_jitter=True)
+        )
+    return result
@@ -15,3 +15,138 @@ class Config:
     # Secrets
     DB_SECRET_NAME = "modtrack/database"
     API_SECRET_NAME = "modtrack/api"
+    # Cached values are refreshed in the background during the last
+    # SECRETS_REFRESH_AHEAD_SECONDS of their TTL
+    SECRETS_TTL_SECONDS = float(os.getenv("SECRETS_TTL_SECONDS", "300"))
+    SECRETS_REFRESH_AHEAD_SECONDS = float(os.getenv("SECRETS_REFRESH_AHEAD_SECONDS", "60"))
+
+    # Ingestion: "copy" streams rows with COPY FROM STDIN into a staging
+    # table, "values" uses batched multi-row INSERTs. Either way rows already
+    # present are skipped and a file is one transaction.
+    INGEST_METHOD = os.getenv("INGEST_METHOD", "copy")
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+
+    # Parallel ingestion: worker threads (one DB connection each) and the size
+    # of the bounded queue in front of them
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+
+    # Periodic scan: "incremental" skips unchanged directories and files below
+    # the per-directory filename cursor, "full" lists everything every time.
+    # Incremental mode still does a full rescan every SCAN_FULL_EVERY scans.
+    SCAN_MODE = os.getenv("SCAN_MODE", "incremental")
+    SCAN_FULL_EVERY = int(os.getenv("SCAN_FULL_EVERY", "60"))
+    # Only file names matching this glob are ordered by the cursor; other
+    # files in a changed directory are listed every time
+    SCAN_CURSOR_PATTERN = os.getenv("SCAN_CURSOR_PATTERN", "prediction_*")
+    # Descend into subdirectories, e.g. date-sharded layouts like 2024/12/26/
+    SCAN_RECURSIVE = os.getenv("SCAN_RECURSIVE", "false").lower() == "true"
+
+    # A file is ingested once its mtime is at least this many seconds old,
+    # unless it was renamed into place
+    INGEST_SETTLE_SECONDS = float(os.getenv("INGEST_SETTLE_SECONDS", "2"))
+
+    # Validation dispatch: predictions are claimed from Postgres once due, up
+    # to DUE_BATCH_SIZE every DUE_POLL_SECONDS (immediately again while there
+    # is a backlog). "batch" sends tasks of up to VALIDATION_BATCH_MAX
+    # predictions across reservoirs, whose levels are fetched with bulk
+    # requests, "single" one task per prediction and "async" the same batches
+    # as "batch", validated concurrently by the asyncio engine
+    VALIDATION_MODE = os.getenv("VALIDATION_MODE", "batch")
+    VALIDATION_BATCH_MAX = int(os.getenv("VALIDATION_BATCH_MAX", "1000"))
+    DUE_POLL_SECONDS = float(os.getenv("DUE_POLL_SECONDS", "5"))
+    DUE_BATCH_SIZE = int(os.getenv("DUE_BATCH_SIZE", "1000"))
+
+    # Stale sweeper: every SWEEP_INTERVAL_SECONDS, walk up to SWEEP_MAX_CHUNKS
+    # chunks of SWEEP_CHUNK_SIZE pending predictions. Those dispatched more
+    # than SWEEP_STALE_SECONDS ago without a validation are re-queued, up to
+    # SWEEP_MAX_ATTEMPTS dispatches in all, then marked failed
+    SWEEP_INTERVAL_SECONDS = int(os.getenv("SWEEP_INTERVAL_SECONDS", "60"))
+    SWEEP_CHUNK_SIZE = int(os.getenv("SWEEP_CHUNK_SIZE", "1000"))
+    SWEEP_MAX_CHUNKS = int(os.getenv("SWEEP_MAX_CHUNKS", "20"))
+    SWEEP_STALE_SECONDS = float(os.getenv("SWEEP_STALE_SECONDS", "3600"))
+    SWEEP_MAX_ATTEMPTS = int(os.getenv("SWEEP_MAX_ATTEMPTS", "3"))
+
+    # Per-worker resources in Celery tasks: Postgres connection pool and the
+    # keep-alive HTTP/2 client for the water-level API
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "4"))
+    DB_HEALTH_CHECK_SECONDS = float(os.getenv("DB_HEALTH_CHECK_SECONDS", "30"))
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+    HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+    # Reservoirs per bulk /water-levels request
+    WATER_LEVEL_BATCH_SIZE = int(os.getenv("WATER_LEVEL_BATCH_SIZE", "100"))
+
+    # Asyncio validation engine: water-level requests in flight per worker
+    # process, tasks the dedicated worker runs at once on the shared loop,
+    # its asyncpg pool size and the Celery queue its tasks go to
+    ASYNC_VALIDATION_CONCURRENCY = int(os.getenv("ASYNC_VALIDATION_CONCURRENCY", "1000"))
+    ASYNC_VALIDATION_TASKS = int(os.getenv("ASYNC_VALIDATION_TASKS", "64"))
+    ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", "10"))
+    ASYNC_VALIDATION_QUEUE = os.getenv("ASYNC_VALIDATION_QUEUE", "async_validation")
+
+    # Shared water-level reading cache in Redis: readings are reused within a
+    # READING_BUCKET_SECONDS bucket for up to READING_CACHE_TTL_SECONDS, and
+    # only one worker fetches a missing reading while the rest wait for it
+    READING_CACHE_ENABLED = os.getenv("READING_CACHE_ENABLED", "true").lower() == "true"
+    READING_CACHE_URL = os.getenv("READING_CACHE_URL", os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"))
+    READING_CACHE_TTL_SECONDS = float(os.getenv("READING_CACHE_TTL_SECONDS", "60"))
+    READING_BUCKET_SECONDS = int(os.getenv("READING_BUCKET_SECONDS", "60"))
+    READING_LOCK_SECONDS = float(os.getenv("READING_LOCK_SECONDS", "10"))
+    READING_WAIT_SECONDS = float(os.getenv("READING_WAIT_SECONDS", "10"))
+
+    # Upstream API client: AIMD concurrency limit per process, retries with
+    # jittered exponential backoff (or Retry-After, up to
+    # UPSTREAM_RETRY_MAX_SECONDS), and a circuit breaker that opens after
+    # UPSTREAM_BREAKER_THRESHOLD consecutive failures
+    UPSTREAM_CONCURRENCY_INITIAL = int(os.getenv("UPSTREAM_CONCURRENCY_INITIAL", "4"))
+    UPSTREAM_CONCURRENCY_MIN = int(os.getenv("UPSTREAM_CONCURRENCY_MIN", "1"))
+    UPSTREAM_CONCURRENCY_MAX = int(os.getenv("UPSTREAM_CONCURRENCY_MAX", "20"))
+    UPSTREAM_RETRY_ATTEMPTS = int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "4"))
+    UPSTREAM_RETRY_BASE_SECONDS = float(os.getenv("UPSTREAM_RETRY_BASE_SECONDS", "0.2"))
+    UPSTREAM_RETRY_MAX_SECONDS = float(os.getenv("UPSTREAM_RETRY_MAX_SECONDS", "30"))
+    UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+    UPSTREAM_BREAKER_RESET_SECONDS = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+    # How often each process publishes its client metrics to Redis
+    UPSTREAM_METRICS_INTERVAL = float(os.getenv("UPSTREAM_METRICS_INTERVAL", "15"))
+    # Celery retries of validations that failed because the API was unavailable
+    VALIDATION_TASK_RETRIES = int(os.getenv("VALIDATION_TASK_RETRIES", "5"))
+
+    # Dashboard: asyncpg pool opened at startup, statement_timeout for its
+    # queries (longer for the accuracy series) and how long a request waits
+    # for a free connection before getting a 503
+    DASHBOARD_DB_POOL_MIN = int(os.getenv("DASHBOARD_DB_POOL_MIN", "2"))
+    DASHBOARD_DB_POOL_MAX = int(os.getenv("DASHBOARD_DB_POOL_MAX", "10"))
+    DASHBOARD_STATEMENT_TIMEOUT_MS = int(os.getenv("DASHBOARD_STATEMENT_TIMEOUT_MS", "5000"))
+    DASHBOARD_SERIES_TIMEOUT_MS = int(os.getenv("DASHBOARD_SERIES_TIMEOUT_MS", "30000"))
+    DASHBOARD_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("DASHBOARD_ACQUIRE_TIMEOUT_SECONDS", "2"))
+    # The table's page count is exact below this many predictions (by the
+    # planner's estimate), estimated above unless an exact count is asked for
+    DASHBOARD_EXACT_COUNT_BELOW = int(os.getenv("DASHBOARD_EXACT_COUNT_BELOW", "100000"))
+    # Points per reservoir the accuracy series are downsampled to by default,
+    # and the most a request can ask for
+    DASHBOARD_SERIES_POINTS = int(os.getenv("DASHBOARD_SERIES_POINTS", "500"))
+    DASHBOARD_SERIES_MAX_POINTS = int(os.getenv("DASHBOARD_SERIES_MAX_POINTS", "5000"))
+
+    # Monthly range partitioning of predictions and validations (see
+    # partitions.py). Every PARTITION_MAINTENANCE_HOURS the monitor creates
+    # partitions PARTITION_PREMAKE_MONTHS ahead and, with
+    # PARTITION_RETENTION_MONTHS > 0, drops those wholly older than that
+    PARTITIONING_ENABLED = os.getenv("PARTITIONING_ENABLED", "false").lower() == "true"
+    PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+    PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))
+    PARTITION_MAINTENANCE_HOURS = float(os.getenv("PARTITION_MAINTENANCE_HOURS", "6"))
+
+    # Local spool that ingestion writes to while Postgres is unreachable (see
+    # spool.py). After a database error, files go straight to the spool for
+    # SPOOL_RETRY_SECONDS; the replayer checks every SPOOL_POLL_SECONDS and
+    # inserts up to SPOOL_REPLAY_BATCH_ROWS rows per transaction
+    SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() == "true"
+    # Must be on persistent storage: spooled files already count as handled
+    SPOOL_DIR = os.getenv("SPOOL_DIR", "/data/spool")
+    SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+    SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "true").lower() == "true"
+    SPOOL_RETRY_SECONDS = float(os.getenv("SPOOL_RETRY_SECONDS", "30"))
+    SPOOL_POLL_SECONDS = float(os.getenv("SPOOL_POLL_SECONDS", "5"))
+    SPOOL_REPLAY_BATCH_ROWS = int(os.getenv("SPOOL_REPLAY_BATCH_ROWS", "50000"))
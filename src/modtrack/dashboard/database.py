@@ -0,0 +1,194 @@
+"""
+Async Postgres access for the dashboard.
+
+Handlers borrow connections from one asyncpg pool per process instead of
+opening a psycopg2 connection per request, so a slow query only holds its
+own connection and never blocks the event loop. The pool is opened at
+startup (main.py's lifespan); if the database is down then, it is opened on
+first use instead.
+
+Every connection runs with statement_timeout set to
+DASHBOARD_STATEMENT_TIMEOUT_MS, and a request can ask for a different limit
+for its own statements. asyncpg prepares each query once per connection and
+reuses the prepared statement from its cache afterwards. A request that
+can't get a connection within DASHBOARD_ACQUIRE_TIMEOUT_SECONDS fails with
+DatabaseBusy rather than queueing indefinitely; stats() shows how saturated
+the pool is.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncpg
+from ..aws_utils import SecretsManager
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseBusy(Exception):
+    """No pooled connection became free within the acquire timeout."""
+
+
+class DashboardDatabase:
+    # Acquire waits kept for the latency percentiles
+    WAIT_SAMPLES = 1000
+
+    def __init__(self, db_secrets: dict = None, min_size: int = None, max_size: int = None,
+                 statement_timeout_ms: int = None, acquire_timeout: float = None):
+        # Secrets can be passed in directly (e.g. by the benchmarks)
+        self.db_secrets = db_secrets
+        self.min_size = Config.DASHBOARD_DB_POOL_MIN if min_size is None else min_size
+        self.max_size = max_size or Config.DASHBOARD_DB_POOL_MAX
+        self.statement_timeout_ms = statement_timeout_ms or Config.DASHBOARD_STATEMENT_TIMEOUT_MS
+        self.acquire_timeout = acquire_timeout or Config.DASHBOARD_ACQUIRE_TIMEOUT_SECONDS
+
+        self.pool: Optional[asyncpg.Pool] = None
+        self._start_lock = asyncio.Lock()
+
+        self.waiting = 0
+        self.acquired = 0
+        self.acquire_timeouts = 0
+        self.statement_timeouts = 0
+        self.acquire_wait_seconds = 0.0
+        self._waits = deque(maxlen=self.WAIT_SAMPLES)
+
+    async def _password(self) -> str:
+        # Read per new connection, so a rotated password is picked up
+        return self.db_secrets['password']
+
+    async def _load_secrets(self, force_refresh: bool = False) -> None:
+        # boto3 blocks; the secrets cache usually answers without a call
+        self.db_secrets = await asyncio.to_thread(
+            SecretsManager().get_secret, Config.DB_SECRET_NAME, force_refresh=force_refresh
+        )
+
+    async def _create_pool(self) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            database=self.db_secrets['dbname'],
+            user=self.db_secrets['username'],
+            password=self._password,
+            host=self.db_secrets['host'],
+            port=int(self.db_secrets['port']),
+            min_size=self.min_size,
+            max_size=self.max_size,
+            server_settings={
+                "application_name": "modtrack-dashboard",
+                "statement_timeout": str(self.statement_timeout_ms),
+            }
+        )
+
+    async def start(self) -> None:
+        async with self._start_lock:
+            if self.pool is not None:
+                return
+            if self.db_secrets is None:
+                await self._load_secrets()
+            try:
+                self.pool = await self._create_pool()
+            except asyncpg.InvalidAuthorizationSpecificationError:
+                # The password may have been rotated; fetch it again and retry once
+                logger.warning("Database credentials rejected; refreshing the secret")
+                await self._load_secrets(force_refresh=True)
+                self.pool = await self._create_pool()
+            logger.info(f"Dashboard database pool opened ({self.min_size}-{self.max_size} connections)")
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self, timeout_ms: int = None):
+        """
+        Borrow a pooled connection. With 'timeout_ms', the statements run in
+        a transaction with that statement_timeout instead of the default.
+        """
+        if self.pool is None:
+            await self.start()
+
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.acquire_timeouts += 1
+            raise DatabaseBusy(f"No database connection free within {self.acquire_timeout}s")
+        except asyncpg.InvalidAuthorizationSpecificationError:
+            # A new connection was refused; the secret has been rotated
+            logger.warning("Database credentials rejected; refreshing the secret")
+            await self._load_secrets(force_refresh=True)
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.acquired += 1
+        self.acquire_wait_seconds += waited
+        self._waits.append(waited)
+
+        try:
+            if timeout_ms is None:
+                yield conn
+            else:
+                async with conn.transaction(readonly=True):
+                    await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+                    yield conn
+        except asyncpg.QueryCanceledError:
+            self.statement_timeouts += 1
+            raise
+        finally:
+            await self.pool.release(conn)
+
+    async def fetch(self, query: str, *args, timeout_ms: int = None) -> List[dict]:
+        async with self.connection(timeout_ms) as conn:
+            return [dict(row) for row in await conn.fetch(query, *args)]
+
+    async def fetchrow(self, query: str, *args, timeout_ms: int = None) -> Optional[dict]:
+        async with self.connection(timeout_ms) as conn:
+            row = await conn.fetchrow(query, *args)
+        return dict(row) if row is not None else None
+
+    async def fetchval(self, query: str, *args, timeout_ms: int = None):
+        async with self.connection(timeout_ms) as conn:
+            return await conn.fetchval(query, *args)
+
+    def stats(self) -> dict:
+        size = self.pool.get_size() if self.pool is not None else 0
+        idle = self.pool.get_idle_size() if self.pool is not None else 0
+        waits = sorted(self._waits)
+        return {
+            "open": self.pool is not None,
+            "size": size,
+            "max_size": self.max_size,
+            "idle": idle,
+            "in_use": size - idle,
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "acquire_timeouts": self.acquire_timeouts,
+            "statement_timeouts": self.statement_timeouts,
+            "acquire_wait_seconds": round(self.acquire_wait_seconds, 6),
+            "acquire_wait_p50_ms": round(waits[len(waits) // 2] * 1000, 3) if waits else None,
+            "acquire_wait_p99_ms": (
+                round(waits[min(int(len(waits) * 0.99), len(waits) - 1)] * 1000, 3) if waits else None
+            ),
+        }
+
+    def render_prometheus(self) -> str:
+        """Pool saturation in Prometheus text format."""
+        stats = self.stats()
+        lines = []
+        for field, kind in (
+            ("size", "gauge"), ("max_size", "gauge"), ("idle", "gauge"), ("in_use", "gauge"),
+            ("waiting", "gauge"), ("acquired", "counter"), ("acquire_timeouts", "counter"),
+            ("statement_timeouts", "counter"), ("acquire_wait_seconds", "counter"),
+        ):
+            metric = "modtrack_dashboard_db_" + field + ("_total" if kind == "counter" else "")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric} {stats[field]}")
+        return "\n".join(lines) + "\n"
+
+
+# The process-wide pool the dashboard's handlers use
+database = DashboardDatabase()
@@ -1,48 +1,170 @@
 from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from ..aws_utils import SecretsManager
+from typing import Optional, Tuple
+from urllib.parse import urlencode
+from ..aws_utils import secrets_cache
+from ..config import Config
+from ..rollups import OVERALL_STATS_SQL, RESERVOIR_STATS_SQL, summarize
+from ..upstream import read_published_metrics, render_prometheus
+from .database import DatabaseBusy, database
+import asyncio
+import asyncpg
+import base64
+import json
+import logging
+import redis
+import uuid
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the database pool at startup; if the database is down, the first request opens it."""
+    try:
+        await database.start()
+    except Exception as e:
+        logger.warning(f"Dashboard database pool not opened at startup: {e}")
+    try:
+        yield
+    finally:
+        await database.close()
 
-router = FastAPI()
+# Runs when the dashboard is served on its own; main.py runs it for the mounted app
+router = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="src/modtrack/dashboard/templates")
 router.mount("/static", StaticFiles(directory="src/modtrack/dashboard/static"), name="static")
 
-def get_db_connection():
-    secrets = SecretsManager()
-    db_secrets = secrets.get_secret("modtrack/database")
-    return psycopg2.connect(
-        dbname=db_secrets['dbname'],
-        user=db_secrets['username'],
-        password=db_secrets['password'],
-        host=db_secrets['host'],
-        port=db_secrets['port'],
-        cursor_factory=RealDictCursor
-    )
+@router.exception_handler(DatabaseBusy)
+async def database_busy(request: Request, exc: DatabaseBusy):
+    return JSONResponse({"error": "Database busy, try again"}, status_code=503, headers={"Retry-After": "1"})
+
+@router.exception_handler(asyncpg.QueryCanceledError)
+async def query_timed_out(request: Request, exc: asyncpg.QueryCanceledError):
+    return JSONResponse({"error": "Query timed out"}, status_code=503)
+
+# Handlers re-raise these rather than reporting a generic failure, so the
+# client gets the 503 above and knows to retry
+OVERLOAD_ERRORS = (DatabaseBusy, asyncpg.QueryCanceledError)
+
+# Row estimate of predictions from the planner's statistics, kept current by
+# autovacuum's ANALYZE. Only leaf tables hold rows: a partitioned parent's own
+# reltuples would count them twice. A table never analyzed has reltuples -1.
+ESTIMATED_PREDICTIONS_SQL = """
+    SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint
+    FROM pg_class c
+    WHERE (c.oid = 'predictions'::regclass
+           OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'predictions'::regclass))
+      AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhparent = c.oid)
+"""
+
+PAGE_SQL = """
+    SELECT
+        p.id,
+        p.reservoir_id,
+        p.predicted_level,
+        p.prediction_timestamp,
+        p.validation_time,
+        v.actual_level,
+        v.difference,
+        v.validated_at
+    FROM predictions p
+    LEFT JOIN validations v ON p.id = v.prediction_id
+    {where}
+    ORDER BY p.prediction_timestamp {order}, p.id {order}
+    LIMIT $1
+"""
+
+def _encode_cursor(direction: str, record) -> str:
+    """Opaque page token: which way to page ('next' or 'prev') and from which row."""
+    payload = json.dumps([direction, record["prediction_timestamp"].isoformat(), str(record["id"])])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_cursor(token: str) -> Optional[Tuple[str, datetime, uuid.UUID]]:
+    """(direction, prediction_timestamp, id), or None for a malformed token."""
+    try:
+        direction, timestamp, prediction_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if direction not in ("next", "prev"):
+            return None
+        return direction, datetime.fromisoformat(timestamp), uuid.UUID(prediction_id)
+    except (ValueError, TypeError):
+        return None
+
+def _page_url(cursor: Optional[str], page: int, limit: int, exact_count: bool) -> str:
+    params = {"page": page, "limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    if exact_count:
+        params["exact_count"] = "true"
+    return "?" + urlencode(params)
 
 @router.get("/", response_class=HTMLResponse)
-async def home(request: Request, page: int = 1, limit: int = 20):
-    conn = get_db_connection()
-    cur = conn.cursor()
+async def home(request: Request, cursor: str = None, page: int = 1, limit: int = 20, exact_count: bool = False):
+    """
+    Dashboard page. The table pages by keyset on (prediction_timestamp, id)
+    through 'cursor' tokens, so every page costs the same however deep it
+    is; 'page' is only the number shown. The page count comes from the
+    planner's row estimate unless the table is small or 'exact_count' is set.
+    """
     try:
-        #
-        # All-time stats
-        #
-        cur.execute("""
-            SELECT
-                COUNT(*) as total_predictions,
-                ROUND(AVG(v.difference)::numeric, 2) as avg_difference,
-                ROUND(MAX(v.difference)::numeric, 2) as max_difference,
-                ROUND(MIN(v.difference)::numeric, 2) as min_difference,
-                COUNT(v.id) as validated_count
-            FROM predictions p
-            LEFT JOIN validations v ON p.id = v.prediction_id
-        """)
-        stats = cur.fetchone()
-        
+        async with database.connection() as conn:
+            #
+            # All-time stats, from the rollups rather than the full tables
+            #
+            stats = summarize(dict(await conn.fetchrow(OVERALL_STATS_SQL)))
+
+            #
+            # All-time reservoir stats
+            #
+            reservoir_stats = [summarize(dict(row)) for row in await conn.fetch(RESERVOIR_STATS_SQL)]
+
+            #
+            # Pagination: Retrieve records after (or before) the cursor's row,
+            # plus one to tell whether there is a page beyond
+            #
+            limit = max(limit, 1)
+            position = _decode_cursor(cursor) if cursor else None
+            if position is None:
+                direction, page = "next", 1
+                records = await conn.fetch(PAGE_SQL.format(where="", order="DESC"), limit + 1)
+            else:
+                direction, timestamp, prediction_id = position
+                page = max(page, 1)
+                if direction == "next":
+                    query = PAGE_SQL.format(where="WHERE (p.prediction_timestamp, p.id) < ($2, $3)", order="DESC")
+                else:
+                    query = PAGE_SQL.format(where="WHERE (p.prediction_timestamp, p.id) > ($2, $3)", order="ASC")
+                records = await conn.fetch(query, limit + 1, timestamp, prediction_id)
+
+            more = len(records) > limit
+            records = [dict(record) for record in records[:limit]]
+            if direction == "prev":
+                records.reverse()
+                if not more:
+                    # Back at the newest predictions
+                    page = 1
+
+            estimated = await conn.fetchval(ESTIMATED_PREDICTIONS_SQL)
+
+        has_prev = bool(records) and position is not None and (direction == "next" or more)
+        has_next = bool(records) and (direction == "prev" or more)
+        prev_url = _page_url(_encode_cursor("prev", records[0]), page - 1, limit, exact_count) if has_prev else None
+        next_url = _page_url(_encode_cursor("next", records[-1]), page + 1, limit, exact_count) if has_next else None
+
+        # Counting every row scans the whole table; only done when asked to,
+        # when the table is small enough for it to be cheap, or when there
+        # are no statistics to estimate from yet
+        total_exact = exact_count or estimated <= 0 or estimated < Config.DASHBOARD_EXACT_COUNT_BELOW
+        if total_exact:
+            total_predictions = await database.fetchval(
+                "SELECT COUNT(*) FROM predictions", timeout_ms=Config.DASHBOARD_SERIES_TIMEOUT_MS
+            )
+        else:
+            total_predictions = estimated
+
         # success rate
         if stats['total_predictions'] > 0:
             stats['success_rate'] = round(
@@ -51,54 +173,8 @@ async def home(request: Request, page: int = 1, limit: int = 20):
         else:
             stats['success_rate'] = 0
 
-        #
-        # All-time reservoir stats
-        #
-        cur.execute("""
-            SELECT
-                p.reservoir_id,
-                COUNT(*) as prediction_count,
-                ROUND(AVG(v.difference)::numeric, 2) as avg_difference
-            FROM predictions p
-            LEFT JOIN validations v ON p.id = v.prediction_id
-            GROUP BY p.reservoir_id
-            ORDER BY p.reservoir_id
-        """)
-        reservoir_stats = cur.fetchall()
-
-        #
-        # Pagination: Retrieve records
-        #
-        # 1) total count
-        cur.execute("SELECT COUNT(*) as total FROM predictions")
-        row = cur.fetchone()
-        total_predictions = row["total"]
-
-        # 2) limit/offset logic
-        page = max(page, 1)
-        limit = max(limit, 1)
-        offset = (page - 1) * limit
-
-        query = f"""
-            SELECT
-                p.id,
-                p.reservoir_id,
-                p.predicted_level,
-                p.prediction_timestamp,
-                p.validation_time,
-                v.actual_level,
-                v.difference,
-                v.validated_at
-            FROM predictions p
-            LEFT JOIN validations v ON p.id = v.prediction_id
-            ORDER BY p.prediction_timestamp DESC
-            LIMIT {limit} OFFSET {offset}
-        """
-        cur.execute(query)
-        records = cur.fetchall()
-
-        # 3) total pages
-        total_pages = (total_predictions + limit - 1) // limit
+        # total pages, at least up to the one shown if the estimate is low
+        total_pages = max((total_predictions + limit - 1) // limit, page)
 
         return templates.TemplateResponse(
             "index.html",
@@ -112,18 +188,21 @@ async def home(request: Request, page: int = 1, limit: int = 20):
                 "page": page,
                 "limit": limit,
                 "total_pages": total_pages,
-                "total_predictions": total_predictions
+                "total_predictions": total_predictions,
+                "total_exact": total_exact,
+                "prev_url": prev_url,
+                "next_url": next_url,
+                "exact_count_url": None if total_exact else _page_url(cursor, page, limit, True)
             }
         )
-    except Exception as e:
-        print(f"Error: {e}")
+    except OVERLOAD_ERRORS:
+        raise
+    except Exception:
+        logger.exception("Failed to load the dashboard")
         return templates.TemplateResponse(
             "error.html",
             {"request": request, "error_message": "Failed to load data"}
         )
-    finally:
-        cur.close()
-        conn.close()
 
 @router.get("/api/predictions", response_class=HTMLResponse)
 async def get_predictions(
@@ -132,9 +211,6 @@ async def get_predictions(
     days: int = 1
 ):
     """API endpoint for filtered prediction data"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     try:
         query = """
             SELECT 
@@ -146,27 +222,23 @@ async def get_predictions(
                 v.difference
             FROM predictions p
             LEFT JOIN validations v ON p.id = v.prediction_id
-            WHERE p.prediction_timestamp >= NOW() - INTERVAL '%s days'
+            WHERE p.prediction_timestamp >= NOW() - make_interval(days => $1)
         """
         params = [days]
 
         if reservoir_id:
-            query += " AND p.reservoir_id = %s"
             params.append(reservoir_id)
+            query += f" AND p.reservoir_id = ${len(params)}"
 
         query += " ORDER BY p.prediction_timestamp DESC"
-        
-        cur.execute(query, params)
-        predictions = cur.fetchall()
 
-        return predictions
+        return await database.fetch(query, *params)
 
-    except Exception as e:
-        print(f"Error accessing database: {e}")
+    except OVERLOAD_ERRORS:
+        raise
+    except Exception:
+        logger.exception("Failed to load prediction data")
         return {"error": "Failed to load prediction data"}
-    finally:
-        cur.close()
-        conn.close()
 
 @router.get("/api/predictions/{prediction_id}")
 async def get_prediction_detail(prediction_id: str):
@@ -174,34 +246,32 @@ async def get_prediction_detail(prediction_id: str):
     Return JSON for a single prediction, including e.g. file_name, difference over time, 
     or anything else you'd like to show in the modal.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
     try:
-        # Example query to get a single record with extra fields
-        cur.execute("""
-            SELECT
-                p.id,
-                p.reservoir_id,
-                p.predicted_level,
-                p.file_name,
-                p.prediction_timestamp,
-                p.validation_time,
-                v.actual_level,
-                v.difference,
-                v.validated_at
-            FROM predictions p
-            LEFT JOIN validations v ON p.id = v.prediction_id
-            WHERE p.id::text = %s
-        """, [prediction_id])
-
-        record = cur.fetchone()
-        if not record:
-            return {"error": f"Prediction {prediction_id} not found"}
-
-        return record
-    finally:
-        cur.close()
-        conn.close()
+        prediction_uuid = uuid.UUID(prediction_id)
+    except ValueError:
+        return {"error": f"Prediction {prediction_id} not found"}
+
+    # Example query to get a single record with extra fields
+    record = await database.fetchrow("""
+        SELECT
+            p.id,
+            p.reservoir_id,
+            p.predicted_level,
+            p.file_name,
+            p.prediction_timestamp,
+            p.validation_time,
+            v.actual_level,
+            v.difference,
+            v.validated_at
+        FROM predictions p
+        LEFT JOIN validations v ON p.id = v.prediction_id
+        WHERE p.id = $1
+    """, prediction_uuid)
+
+    if not record:
+        return {"error": f"Prediction {prediction_id} not found"}
+
+    return record
 
 @router.get("/api/filter-predictions")
 async def filter_predictions(
@@ -209,8 +279,6 @@ async def filter_predictions(
     start_date: str = None,
     end_date: str = None
 ):
-    conn = get_db_connection()
-    cur = conn.cursor()
     try:
         query = """
             SELECT
@@ -228,123 +296,146 @@ async def filter_predictions(
         params = []
 
         if reservoir_id:
-            query += " AND p.reservoir_id = %s"
             params.append(reservoir_id)
+            query += f" AND p.reservoir_id = ${len(params)}"
 
         if start_date:
-            query += " AND p.prediction_timestamp >= %s"
+            # Dates arrive as text; Postgres parses them as it did before
             params.append(start_date)
+            query += f" AND p.prediction_timestamp >= ${len(params)}::text::timestamptz"
 
         if end_date:
             # Make it inclusive to the entire end date
-            query += " AND p.prediction_timestamp < (%s::date + INTERVAL '1 day')"
             params.append(end_date)
+            query += f" AND p.prediction_timestamp < (${len(params)}::text::date + INTERVAL '1 day')"
 
         query += " ORDER BY p.prediction_timestamp DESC"
 
-        cur.execute(query, params)
-        rows = cur.fetchall()
-
-        return rows  # List[dict], thanks to RealDictCursor in get_db_connection
-    except Exception as e:
-        print("Filter Error:", e)
+        return await database.fetch(query, *params)
+    except OVERLOAD_ERRORS:
+        raise
+    except Exception:
+        logger.exception("Failed to filter predictions")
         return []
-    finally:
-        cur.close()
-        conn.close()
+
+# One point per reservoir and time bucket. The buckets split the series'
+# time span into $1 equal widths (or $2 seconds each, if wider), so a series
+# has at most $1 points however much history there is; each point is the
+# mean time and the mean, min and max deviation of its validations.
+ACCURACY_SERIES_SQL = """
+    WITH filtered AS (
+        SELECT
+            p.reservoir_id,
+            extract(epoch FROM v.validated_at)::float8 AS at,
+            v.actual_level - p.predicted_level AS deviation
+        FROM predictions p
+        JOIN validations v ON p.id = v.prediction_id
+        WHERE {where}
+    ),
+    span AS (
+        SELECT
+            min(at) AS first_at,
+            GREATEST((max(at) - min(at)) / $1::int, $2::float8, 1e-6) AS width
+        FROM filtered
+    )
+    SELECT
+        f.reservoir_id,
+        to_timestamp(avg(f.at)) AS bucket_at,
+        avg(f.deviation) AS deviation,
+        min(f.deviation) AS min_deviation,
+        max(f.deviation) AS max_deviation,
+        count(*) AS validations
+    FROM filtered f CROSS JOIN span s
+    GROUP BY f.reservoir_id, LEAST(floor((f.at - s.first_at) / s.width), $1::int - 1)
+    ORDER BY f.reservoir_id, bucket_at
+"""
+
+async def _accuracy_series(max_points: int, bucket_seconds: Optional[float], conditions: list, params: list) -> dict:
+    """
+    Downsampled deviation series by reservoir. 'conditions' use placeholders
+    numbered from $3 for 'params'.
+    """
+    max_points = min(max(max_points, 1), Config.DASHBOARD_SERIES_MAX_POINTS)
+    query = ACCURACY_SERIES_SQL.format(where=" AND ".join(conditions) or "TRUE")
+    rows = await database.fetch(
+        query, max_points, bucket_seconds, *params, timeout_ms=Config.DASHBOARD_SERIES_TIMEOUT_MS
+    )
+
+    # Group by reservoir; 'deviations' are the bucket means the chart plots
+    reservoirs = {}
+    for row in rows:
+        series = reservoirs.setdefault(row["reservoir_id"], {
+            "timestamps": [], "deviations": [], "min_deviations": [], "max_deviations": [], "counts": []
+        })
+        series["timestamps"].append(row["bucket_at"].isoformat())
+        # The band and the line at the same precision
+        series["deviations"].append(round(float(row["deviation"]), 3))
+        series["min_deviations"].append(round(float(row["min_deviation"]), 3))
+        series["max_deviations"].append(round(float(row["max_deviation"]), 3))
+        series["counts"].append(row["validations"])
+
+    return reservoirs
 
 @router.get("/api/filter-accuracy-data")
 async def filter_accuracy_data(
     reservoir_id: str = None,
     start_date: str = None,
-    end_date: str = None
+    end_date: str = None,
+    max_points: int = Config.DASHBOARD_SERIES_POINTS,
+    bucket_seconds: float = None
 ):
     """
     Return the same structure as /api/accuracy-data, but filtered.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        base_query = """
-            SELECT
-                p.reservoir_id,
-                v.validated_at as timestamp,
-                v.actual_level - p.predicted_level as deviation
-            FROM predictions p
-            JOIN validations v ON p.id = v.prediction_id
-            WHERE 1=1
-        """
-        params = []
-        if reservoir_id:
-            base_query += " AND p.reservoir_id = %s"
-            params.append(reservoir_id)
-        if start_date:
-            base_query += " AND p.prediction_timestamp >= %s"
-            params.append(start_date)
-        if end_date:
-            base_query += " AND p.prediction_timestamp < (%s::date + INTERVAL '1 day')"
-            params.append(end_date)
-
-        base_query += " ORDER BY v.validated_at ASC"
-
-        cur.execute(base_query, params)
-        rows = cur.fetchall()
-
-        # Group them just like in get_accuracy_data():
-        reservoirs = {}
-        for row in rows:
-            rid = row["reservoir_id"]
-            if rid not in reservoirs:
-                reservoirs[rid] = {"timestamps": [], "deviations": []}
-            reservoirs[rid]["timestamps"].append(row["timestamp"].isoformat())
-            reservoirs[rid]["deviations"].append(float(row["deviation"]))
-
-        return reservoirs
-    finally:
-        cur.close()
-        conn.close()
+    conditions, params = [], []
+    if reservoir_id:
+        params.append(reservoir_id)
+        conditions.append(f"p.reservoir_id = ${len(params) + 2}")
+    if start_date:
+        params.append(start_date)
+        conditions.append(f"p.prediction_timestamp >= ${len(params) + 2}::text::timestamptz")
+    if end_date:
+        params.append(end_date)
+        conditions.append(f"p.prediction_timestamp < (${len(params) + 2}::text::date + INTERVAL '1 day')")
+
+    return await _accuracy_series(max_points, bucket_seconds, conditions, params)
 
 @router.get("/api/accuracy-data")
-async def get_accuracy_data():
-    """API endpoint for prediction accuracy time-series data"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    try:
-        cur.execute("""
-            SELECT
-                p.reservoir_id,
-                v.validated_at as timestamp,
-                v.actual_level - p.predicted_level as deviation
-            FROM predictions p
-            JOIN validations v ON p.id = v.prediction_id
-            ORDER BY v.validated_at ASC
-        """)
-        data = cur.fetchall()
-
-        # Group by reservoir
-        reservoirs = {}
-        for row in data:
-            reservoir_id = row["reservoir_id"]
-            if reservoir_id not in reservoirs:
-                reservoirs[reservoir_id] = {
-                    "timestamps": [],
-                    "deviations": []
-                }
-            reservoirs[reservoir_id]["timestamps"].append(row["timestamp"].isoformat())
-            reservoirs[reservoir_id]["deviations"].append(float(row["deviation"]))
-
-        return reservoirs
-    finally:
-        cur.close()
-        conn.close()
+async def get_accuracy_data(max_points: int = Config.DASHBOARD_SERIES_POINTS, bucket_seconds: float = None):
+    """
+    API endpoint for prediction accuracy time-series data, downsampled in
+    the database to at most 'max_points' per reservoir (buckets at least
+    'bucket_seconds' wide, if given), with each bucket's min and max.
+    """
+    return await _accuracy_series(max_points, bucket_seconds, [], [])
 
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
-        conn = get_db_connection()
-        conn.close()
-        return {"status": "healthy", "database": "connected"}
+        await database.fetchrow("SELECT 1")
+        return {
+            "status": "healthy", "database": "connected",
+            "database_pool": database.stats(), "secrets_cache": secrets_cache.stats()
+        }
     except Exception as e:
-        return {"status": "unhealthy", "database": str(e)}
+        return {
+            "status": "unhealthy", "database": str(e),
+            "database_pool": database.stats(), "secrets_cache": secrets_cache.stats()
+        }
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Upstream API client metrics published by each worker process, and this
+    process's dashboard database pool, in Prometheus format.
+    """
+    def read_upstream():
+        client = redis.Redis.from_url(Config.READING_CACHE_URL)
+        try:
+            return render_prometheus(read_published_metrics(client))
+        finally:
+            client.close()
+
+    # Redis is read in a thread, off the event loop
+    return await asyncio.to_thread(read_upstream) + database.render_prometheus()
@@ -1,39 +1,175 @@
 import psycopg2
+from psycopg2.extras import execute_values
+import csv
+import io
 import logging
-from typing import Optional
+import uuid
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterable, List, Union
+from .migrations import migrate
+from .readers import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+def is_auth_failure(error: Exception) -> bool:
+    """Whether a connection attempt was rejected for bad credentials, e.g. after a rotation."""
+    return isinstance(error, psycopg2.OperationalError) and "authentication failed" in str(error)
+
 def init_db_schema(conn: psycopg2.extensions.connection) -> None:
-    """Initialize database schema if it doesn't exist"""
-    with conn.cursor() as cur:
-        # Create predictions table
-
-        cur.execute("CREATE EXTENSION IF NOT EXISTS \"uuid-ossp\";")
-        
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS predictions (
-                id UUID PRIMARY KEY,
-                reservoir_id VARCHAR(50) NOT NULL,
-                predicted_level DECIMAL(10,2) NOT NULL,
-                prediction_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
-                validation_time TIMESTAMP WITH TIME ZONE NOT NULL,
-                file_name VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            )
+    """Bring the database schema up to date by applying pending migrations"""
+    migrate(conn)
+    logger.info("Database schema initialized successfully")
+
+PREDICTION_COLUMNS = (
+    "id", "reservoir_id", "predicted_level", "prediction_timestamp",
+    "validation_time", "file_name"
+)
+
+# Namespace for deterministic prediction ids (uuid5)
+PREDICTION_NAMESPACE = uuid.UUID("6f0f8f36-7d0e-5c4e-9a55-2b1d3c1e9a7d")
+
+def prediction_id_for(file_name: str, reservoir_id: str, validation_time: Union[datetime, str]) -> str:
+    """
+    Deterministic id of a prediction: the same file, reservoir and validation
+    time always give the same id, so ingesting a file again inserts nothing
+    new. Validation times are normalized to UTC with microseconds, so a
+    datetime and the reader's timestamp string for the same instant agree.
+    """
+    if isinstance(validation_time, str):
+        validation_time = parse_timestamp(validation_time)
+    if validation_time.tzinfo is None:
+        validation_time = validation_time.replace(tzinfo=timezone.utc)
+    instant = validation_time.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return str(uuid.uuid5(PREDICTION_NAMESPACE, f"{file_name}\x1f{reservoir_id}\x1f{instant}"))
+
+def insert_predictions(
+    cur: psycopg2.extensions.cursor,
+    rows: Iterable[tuple],
+    method: str = "copy",
+    batch_size: int = 5000
+) -> int:
+    """
+    Bulk insert prediction rows (ordered as PREDICTION_COLUMNS) in batches,
+    skipping rows whose id is already there. Returns the number of rows
+    actually inserted. Does not commit, so the caller controls the
+    transaction boundary.
+    """
+    columns = ", ".join(PREDICTION_COLUMNS)
+    rows = iter(rows)
+    inserted = 0
+
+    if method == "copy":
+        # COPY can't skip conflicts, so it goes into a staging table first
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS predictions_staging
+            ON COMMIT DELETE ROWS
+            AS SELECT {columns} FROM predictions WITH NO DATA
         """)
-        
-        # Create validations table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS validations (
-                id UUID PRIMARY KEY,
-                prediction_id UUID REFERENCES predictions(id),
-                actual_level DECIMAL(10,2) NOT NULL,
-                difference DECIMAL(10,2) NOT NULL,
-                validated_at TIMESTAMP WITH TIME ZONE NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (prediction_id) REFERENCES predictions(id)
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        if method == "copy":
+            buf = io.StringIO()
+            csv.writer(buf).writerows(batch)
+            buf.seek(0)
+            cur.copy_expert(
+                f"COPY predictions_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buf
             )
-        """)
-        conn.commit()
-        logger.info("Database schema initialized successfully")
\ No newline at end of file
+            cur.execute(f"""
+                INSERT INTO predictions ({columns})
+                SELECT {columns} FROM predictions_staging
+                ON CONFLICT DO NOTHING
+            """)
+            inserted += cur.rowcount
+            cur.execute("TRUNCATE predictions_staging")
+        elif method == "values":
+            execute_values(
+                cur,
+                f"INSERT INTO predictions ({columns}) VALUES %s ON CONFLICT DO NOTHING",
+                batch,
+                page_size=batch_size
+            )
+            inserted += cur.rowcount
+        else:
+            raise ValueError(f"Unknown ingest method: {method}")
+
+    return inserted
+
+def claim_due_predictions(cur: psycopg2.extensions.cursor, limit: int) -> List[tuple]:
+    """
+    Mark up to 'limit' due, undispatched and unvalidated predictions as
+    dispatched, oldest first, and return them as (id, reservoir_id,
+    predicted_level, validation_time). Rows locked by a concurrent claim are
+    skipped rather than waited on. Does not commit: the claim only sticks if
+    the caller commits after dispatching.
+    """
+    cur.execute(
+        """
+        WITH due AS (
+            SELECT p.id
+            FROM predictions p
+            WHERE p.dispatched_at IS NULL
+              AND p.validation_time <= now()
+              AND NOT EXISTS (SELECT 1 FROM validations v WHERE v.prediction_id = p.id)
+            ORDER BY p.validation_time
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE predictions p SET dispatched_at = now()
+        FROM due
+        WHERE p.id = due.id
+        RETURNING p.id, p.reservoir_id, p.predicted_level, p.validation_time
+        """,
+        (limit,)
+    )
+    return cur.fetchall()
+
+VALIDATION_COLUMNS = ("id", "prediction_id", "actual_level", "difference", "validated_at")
+
+# Inserts validations given as one array per column, at most one per
+# prediction: each prediction is locked (in id order, so concurrent batches
+# can't deadlock) and marked validated in the same statement, and those
+# already validated are skipped. Placeholders are filled in per driver.
+INSERT_VALIDATIONS_SQL = """
+    WITH new AS (
+        SELECT DISTINCT ON (prediction_id) *
+        FROM unnest({}::uuid[], {}::uuid[], {}::float8[], {}::float8[], {}::timestamptz[])
+             AS v (id, prediction_id, actual_level, difference, validated_at)
+        ORDER BY prediction_id
+    ),
+    locked AS (
+        SELECT p.id
+        FROM predictions p JOIN new ON new.prediction_id = p.id
+        WHERE p.validation_status <> 'validated'
+        ORDER BY p.id
+        FOR UPDATE OF p
+    ),
+    claimed AS (
+        UPDATE predictions p SET validation_status = 'validated'
+        FROM locked
+        WHERE p.id = locked.id
+        RETURNING p.id
+    )
+    INSERT INTO validations (id, prediction_id, actual_level, difference, validated_at)
+    SELECT new.id, new.prediction_id, new.actual_level, new.difference, new.validated_at
+    FROM new JOIN claimed ON claimed.id = new.prediction_id
+    ON CONFLICT DO NOTHING
+"""
+
+def insert_validations(cur: psycopg2.extensions.cursor, rows: Iterable[tuple]) -> int:
+    """
+    Insert validation rows (ordered as VALIDATION_COLUMNS), skipping
+    predictions that already have one, so a retried or duplicated task
+    writes nothing twice. Returns the number inserted. Does not commit.
+    """
+    columns = [list(column) for column in zip(*rows)]
+    if not columns:
+        return 0
+    columns[0] = [str(value) for value in columns[0]]
+    columns[1] = [str(value) for value in columns[1]]
+    cur.execute(INSERT_VALIDATIONS_SQL.format(*["%s"] * len(VALIDATION_COLUMNS)), columns)
+    return cur.rowcount
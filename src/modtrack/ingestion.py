@@ -0,0 +1,253 @@
+import logging
+import os
+import queue
+import statistics
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, Optional
+import psycopg2
+from .config import Config
+
+
+class IngestionPool:
+    """
+    Bounded pool of worker threads that ingest files in parallel.
+
+    Each worker owns its own database connection and ingests one file per
+    transaction. The queue is bounded, so producers (the watchdog observer and
+    the periodic scan) block on submit() once the workers fall behind, instead of
+    piling up an unbounded backlog in memory.
+    """
+
+    def __init__(self, handler, workers: int = None, queue_size: int = None,
+                 on_done: Optional[Callable[[Path], None]] = None):
+        self.handler = handler
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers or Config.INGEST_WORKERS
+        self.on_done = on_done
+
+        self._queue = queue.Queue(maxsize=queue_size or Config.INGEST_QUEUE_SIZE)
+        # Paths that are queued or being ingested, so a file seen by both the
+        # observer and the scanner is only ingested once
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"Started ingestion pool with {self.workers} workers")
+
+    def submit(self, file_path: Path, block: bool = True) -> bool:
+        """Queue a file for ingestion. Returns False if it is already queued."""
+        with self._lock:
+            if file_path in self._pending:
+                return False
+            self._pending.add(file_path)
+
+        try:
+            self._queue.put(file_path, block=block)
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(file_path)
+            return False
+        return True
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def join(self):
+        """Block until every queued file has been ingested."""
+        self._queue.join()
+
+    def stop(self):
+        """Let the workers finish their queued files, then shut them down."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self):
+        conn = None
+        while True:
+            file_path = self._queue.get()
+            if file_path is None:
+                self._queue.task_done()
+                break
+
+            try:
+                spool = self.handler.spool
+                if spool is not None and spool.db_down():
+                    # Don't wait on connection timeouts while the database is known to be down
+                    self.handler.spool_file(file_path)
+                    continue
+                if conn is None or conn.closed:
+                    try:
+                        conn = self.handler.connect_db()
+                    except psycopg2.OperationalError as e:
+                        if spool is None:
+                            raise
+                        self.logger.warning(f"Database unavailable, spooling {file_path.name}: {e}")
+                        spool.mark_db_down()
+                        self.handler.spool_file(file_path)
+                        continue
+                self.handler.process_file(file_path, conn)
+            except Exception as e:
+                self.logger.error(f"Error ingesting file {file_path.name}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(file_path)
+                self._queue.task_done()
+                if self.on_done is not None:
+                    self.on_done(file_path)
+
+        if conn is not None:
+            conn.close()
+
+
+class _Watch:
+    __slots__ = ("first_seen", "ready", "submitted")
+
+    def __init__(self, first_seen: float, ready: bool):
+        self.first_seen = first_seen
+        self.ready = ready
+        self.submitted = False
+
+
+class IngestPipeline:
+    """
+    Single entry point for files reported by the watchdog observer and by the
+    periodic scan.
+
+    Reports for the same path are merged into one entry, and a file is only
+    handed to the IngestionPool once it has stopped changing: its mtime must be
+    at least 'settle_seconds' old. Files renamed into place are complete by
+    definition and skip the wait. Temporary names (dotfiles, *.tmp, *.part)
+    are ignored so writers can use write-then-rename.
+    """
+
+    TEMP_SUFFIXES = ('.tmp', '.part', '.partial', '~')
+
+    def __init__(self, pool: IngestionPool, settle_seconds: float = None, poll_interval: float = 0.5):
+        self.pool = pool
+        self.pool.on_done = self._done
+        self.settle_seconds = Config.INGEST_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._watching: Dict[Path, _Watch] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Seconds from the first report of a file to the end of its ingestion
+        self._latencies = deque(maxlen=1000)
+        self.ingested = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ingest-pipeline", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @classmethod
+    def is_temporary(cls, file_path: Path) -> bool:
+        return file_path.name.startswith('.') or file_path.name.endswith(cls.TEMP_SUFFIXES)
+
+    def notify(self, file_path: Path, ready: bool = False) -> None:
+        """
+        Report a file that may need ingesting. 'ready' marks a file that is
+        known to be complete, e.g. the destination of an atomic rename.
+        """
+        if self.is_temporary(file_path):
+            return
+        with self._lock:
+            watch = self._watching.get(file_path)
+            if watch is None:
+                self._watching[file_path] = _Watch(time.monotonic(), ready)
+            else:
+                watch.ready = watch.ready or ready
+                # Changed again while queued: look at it again once it settles
+                watch.submitted = False
+
+    def discard(self, file_path: Path) -> None:
+        """Stop tracking a file that was deleted or moved away."""
+        with self._lock:
+            self._watching.pop(file_path, None)
+
+    def depth(self) -> int:
+        """Files waiting to settle or queued for ingestion."""
+        with self._lock:
+            return len(self._watching)
+
+    def latency_samples(self) -> list:
+        """Recent first-report-to-ingested latencies, in seconds."""
+        return list(self._latencies)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "queue_depth": self.depth(),
+            "pool_queue_depth": self.pool.queue_depth(),
+            "ingested": self.ingested,
+            "latency_p50": statistics.median(latencies) if latencies else None,
+            "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else None,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._submit_settled()
+            except Exception as e:
+                self.logger.error(f"Error in ingest pipeline: {e}")
+
+    def _submit_settled(self):
+        now = time.time()
+        ready = []
+        with self._lock:
+            for file_path, watch in list(self._watching.items()):
+                if watch.submitted:
+                    continue
+                if not watch.ready:
+                    try:
+                        mtime = os.stat(file_path).st_mtime
+                    except FileNotFoundError:
+                        del self._watching[file_path]
+                        continue
+                    if now - mtime < self.settle_seconds:
+                        continue
+                # Marked before submitting: a fast worker may finish the file
+                # before submit() even returns
+                watch.submitted = True
+                ready.append((file_path, watch))
+
+        # Submit outside the lock: the pool blocks when full, and the observer
+        # must still be able to report events meanwhile
+        for file_path, watch in ready:
+            submitted = False
+            try:
+                submitted = self.pool.submit(file_path)
+            finally:
+                if not submitted:
+                    # Try again on the next pass
+                    with self._lock:
+                        if self._watching.get(file_path) is watch:
+                            watch.submitted = False
+
+    def _done(self, file_path: Path) -> None:
+        with self._lock:
+            watch = self._watching.get(file_path)
+            # Reported again during ingestion: keep it for another pass
+            if watch is None or not watch.submitted:
+                return
+            del self._watching[file_path]
+        self._latencies.append(time.monotonic() - watch.first_seen)
+        self.ingested += 1
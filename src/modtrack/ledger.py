@@ -0,0 +1,146 @@
+import csv
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import List, Tuple
+import psycopg2
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# (file_name, file_size, file_mtime_ns)
+FileKey = Tuple[str, int, int]
+
+
+def file_key(file_path: Path, stat: os.stat_result = None) -> FileKey:
+    """Identify a file by name, size and modification time."""
+    stat = stat or file_path.stat()
+    return (file_path.name, stat.st_size, stat.st_mtime_ns)
+
+
+def content_hash(file_path: Path) -> str:
+    """SHA-256 of the file contents, read in blocks."""
+    with open(file_path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def claim_file(cur: psycopg2.extensions.cursor, key: FileKey, digest: str) -> bool:
+    """
+    Record a file as ingested inside the caller's transaction.
+
+    Returns False if the file is already in the ledger, either under the same
+    key or with identical contents. The row only becomes visible when the
+    caller commits, and a concurrent claim of the same key blocks until then,
+    so two monitors can never both ingest a file.
+    """
+    file_name = key[0]
+    cur.execute(
+        """
+        SELECT 1 FROM ingested_files
+        WHERE file_name = %s AND content_hash = %s AND status = 'ingested'
+        """,
+        (file_name, digest)
+    )
+    status = 'duplicate' if cur.fetchone() else 'ingested'
+
+    cur.execute(
+        """
+        INSERT INTO ingested_files (file_name, file_size, file_mtime_ns, content_hash, status)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT DO NOTHING
+        RETURNING file_name
+        """,
+        (*key, digest, status)
+    )
+    return cur.fetchone() is not None and status == 'ingested'
+
+
+def record_failed_file(conn: psycopg2.extensions.connection, key: FileKey, digest: str, error: str) -> None:
+    """Record a file that could not be parsed, so it is not retried until it changes."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO ingested_files (file_name, file_size, file_mtime_ns, content_hash, status, error)
+            VALUES (%s, %s, %s, %s, 'failed', %s)
+            ON CONFLICT DO NOTHING
+            """,
+            (*key, digest, error[:1000])
+        )
+    conn.commit()
+
+
+def filter_unprocessed(conn: psycopg2.extensions.connection, keys: List[FileKey]) -> List[FileKey]:
+    """Return the keys that have no ledger entry, checking them in one query."""
+    if not keys:
+        return []
+
+    names, sizes, mtimes = zip(*keys)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT f.file_name, f.file_size, f.file_mtime_ns
+            FROM unnest(%s::text[], %s::bigint[], %s::bigint[])
+                AS f(file_name, file_size, file_mtime_ns)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM ingested_files i
+                WHERE i.file_name = f.file_name
+                  AND i.file_size = f.file_size
+                  AND i.file_mtime_ns = f.file_mtime_ns
+            )
+            """,
+            (list(names), list(sizes), list(mtimes))
+        )
+        unprocessed = [tuple(row) for row in cur.fetchall()]
+    conn.commit()
+    return unprocessed
+
+
+def import_processed_csv(conn: psycopg2.extensions.connection, csv_path: Path, batch_size: int = 1000) -> int:
+    """
+    One-off import of the legacy processed_files.csv into an empty ledger.
+    Files listed in the CSV that no longer exist are skipped.
+    """
+    if not csv_path.exists():
+        return 0
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM ingested_files)")
+        if cur.fetchone()[0]:
+            conn.rollback()
+            return 0
+
+    imported = 0
+
+    def flush(rows):
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                INSERT INTO ingested_files (file_name, file_size, file_mtime_ns, content_hash, status)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                """,
+                rows
+            )
+
+    with csv_path.open(newline='') as csvfile:
+        rows = []
+        for row in csv.reader(csvfile):
+            if not row:
+                continue
+            file_path = csv_path.parent / row[0]
+            if not file_path.is_file():
+                continue
+            rows.append((*file_key(file_path), content_hash(file_path), 'ingested'))
+            if len(rows) >= batch_size:
+                flush(rows)
+                imported += len(rows)
+                rows = []
+        if rows:
+            flush(rows)
+            imported += len(rows)
+
+    conn.commit()
+    logger.info(f"Imported {imported} processed files from {csv_path} into the ingestion ledger")
+    return imported
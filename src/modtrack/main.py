@@ -2,17 +2,24 @@
 # TODO: Prepare for production
 
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .monitor import start_monitoring
 from .local_secrets import setup_local_secrets
 from .config import Config, Environment
 from .mock_api.app import app as mock_api
-from .dashboard.routes import router as dashboard
+from .dashboard.routes import router as dashboard, lifespan as dashboard_lifespan
 import uvicorn
 import threading
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mounted apps' lifespans don't run, so the dashboard's is run from here
+    async with dashboard_lifespan(dashboard):
+        yield
+
 # Create the main FastAPI application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Mount both applications
 app.mount("/api", mock_api)
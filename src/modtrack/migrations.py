@@ -0,0 +1,428 @@
+"""
+Versioned schema migrations.
+
+Each migration has a version and a list of steps, applied in version order.
+The versions applied so far are recorded in schema_version, so a database
+only runs what it hasn't seen yet:
+
+    python -m modtrack.migrations            # apply pending migrations
+    python -m modtrack.migrations --status   # list applied and pending ones
+
+Steps are either SQL, run and committed one at a time, or an Index, built
+with CREATE INDEX CONCURRENTLY so ingestion and validation keep writing
+while it builds (on a partitioned table, one partition at a time; see
+partitions.py). A migration interrupted part way is simply run again, so
+every step must be idempotent (IF NOT EXISTS and the like).
+
+Migrations are serialized with an advisory lock, so several monitors
+starting at once don't race each other.
+"""
+import argparse
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Union
+import psycopg2
+from .config import Config
+from .rollups import REBUILD_SQL
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_lock, held while migrating
+MIGRATION_LOCK_KEY = 72_417_001
+
+
+@dataclass
+class Index:
+    """An index built concurrently, without blocking writes to its table."""
+    name: str
+    table: str
+    columns: str
+    where: Optional[str] = None
+    unique: bool = False
+
+    def sql(self, table: str = None, name: str = None, concurrently: bool = True) -> str:
+        """The CREATE INDEX statement, optionally on another table (a partition) or under another name."""
+        options = "CONCURRENTLY " if concurrently else ""
+        kind = "UNIQUE INDEX" if self.unique else "INDEX"
+        statement = (
+            f"CREATE {kind} {options}IF NOT EXISTS {name or self.name} "
+            f"ON {table or self.table} ({self.columns})"
+        )
+        if self.where:
+            statement += f" WHERE {self.where}"
+        return statement
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    steps: List[Union[str, Index]] = field(default_factory=list)
+
+
+MIGRATIONS: Sequence[Migration] = (
+    Migration(1, "baseline", [
+        'CREATE EXTENSION IF NOT EXISTS "uuid-ossp"',
+        """
+        CREATE TABLE IF NOT EXISTS predictions (
+            id UUID PRIMARY KEY,
+            reservoir_id VARCHAR(50) NOT NULL,
+            predicted_level DECIMAL(10,2) NOT NULL,
+            prediction_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            validation_time TIMESTAMP WITH TIME ZONE NOT NULL,
+            file_name VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS validations (
+            id UUID PRIMARY KEY,
+            prediction_id UUID REFERENCES predictions(id),
+            actual_level DECIMAL(10,2) NOT NULL,
+            difference DECIMAL(10,2) NOT NULL,
+            validated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (prediction_id) REFERENCES predictions(id)
+        )
+        """,
+        # Ingestion ledger: one row per file version seen by the monitor
+        """
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            file_name VARCHAR(255) NOT NULL,
+            file_size BIGINT NOT NULL,
+            file_mtime_ns BIGINT NOT NULL,
+            content_hash CHAR(64) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            error TEXT,
+            ingested_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (file_name, file_size, file_mtime_ns)
+        )
+        """,
+        Index("ingested_files_content_hash_idx", "ingested_files", "file_name, content_hash"),
+    ]),
+
+    # Due-time scheduling: a prediction is dispatched for validation once its
+    # validation_time has passed. The partial index only holds rows still
+    # waiting, so polling stays cheap however large the table grows.
+    Migration(2, "due_dispatch", [
+        "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS dispatched_at TIMESTAMP WITH TIME ZONE",
+        Index("predictions_due_idx", "predictions", "validation_time", where="dispatched_at IS NULL"),
+        # Every validation lookup and every dashboard join goes through this
+        Index("validations_prediction_id_idx", "validations", "prediction_id"),
+        # Rows validated before dispatched_at existed (via Celery countdowns)
+        """
+        UPDATE predictions p SET dispatched_at = v.validated_at
+        FROM validations v
+        WHERE v.prediction_id = p.id AND p.dispatched_at IS NULL
+        """,
+        # Only used by the read-back that dispatch replaced
+        "DROP INDEX IF EXISTS predictions_file_name_idx",
+    ]),
+
+    # Validation outcome, recorded by the stale sweeper: 'pending' until a
+    # validation exists ('validated') or dispatch was given up on ('failed').
+    # Its partial index only holds rows still to be swept.
+    Migration(3, "validation_status", [
+        """
+        ALTER TABLE predictions
+        ADD COLUMN IF NOT EXISTS validation_status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        ADD COLUMN IF NOT EXISTS validation_attempts INTEGER NOT NULL DEFAULT 0
+        """,
+        Index("predictions_unvalidated_idx", "predictions", "validation_time, id",
+              where="validation_status = 'pending'"),
+    ]),
+
+    # What the dashboard sorts and filters on: newest predictions first,
+    # optionally for one reservoir, and validations in time order
+    Migration(4, "dashboard_indexes", [
+        Index("predictions_timestamp_idx", "predictions", "prediction_timestamp DESC, id"),
+        Index("predictions_reservoir_timestamp_idx", "predictions", "reservoir_id, prediction_timestamp DESC"),
+        Index("validations_validated_at_idx", "validations", "validated_at"),
+    ]),
+
+    # Per reservoir and day accuracy totals, kept current by statement-level
+    # triggers that add each inserted batch (see rollups.py)
+    Migration(5, "accuracy_rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS accuracy_rollups (
+            reservoir_id VARCHAR(50) NOT NULL,
+            bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+            prediction_count BIGINT NOT NULL DEFAULT 0,
+            validated_count BIGINT NOT NULL DEFAULT 0,
+            difference_sum NUMERIC NOT NULL DEFAULT 0,
+            difference_min NUMERIC,
+            difference_max NUMERIC,
+            difference_sumsq NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (reservoir_id, bucket_start)
+        )
+        """,
+        # Buckets are upserted in key order, so concurrent batches touching
+        # the same buckets wait on each other instead of deadlocking
+        """
+        CREATE OR REPLACE FUNCTION rollup_new_predictions() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO accuracy_rollups (reservoir_id, bucket_start, prediction_count)
+            SELECT reservoir_id,
+                   date_trunc('day', prediction_timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+                   COUNT(*)
+            FROM new_rows
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            ON CONFLICT (reservoir_id, bucket_start) DO UPDATE
+            SET prediction_count = accuracy_rollups.prediction_count + EXCLUDED.prediction_count;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION rollup_new_validations() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO accuracy_rollups
+                (reservoir_id, bucket_start, validated_count,
+                 difference_sum, difference_min, difference_max, difference_sumsq)
+            SELECT p.reservoir_id,
+                   date_trunc('day', p.prediction_timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+                   COUNT(*), SUM(v.difference), MIN(v.difference), MAX(v.difference),
+                   SUM(v.difference * v.difference)
+            FROM new_rows v
+            JOIN predictions p ON p.id = v.prediction_id
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            ON CONFLICT (reservoir_id, bucket_start) DO UPDATE
+            SET validated_count = accuracy_rollups.validated_count + EXCLUDED.validated_count,
+                difference_sum = accuracy_rollups.difference_sum + EXCLUDED.difference_sum,
+                difference_min = LEAST(accuracy_rollups.difference_min, EXCLUDED.difference_min),
+                difference_max = GREATEST(accuracy_rollups.difference_max, EXCLUDED.difference_max),
+                difference_sumsq = accuracy_rollups.difference_sumsq + EXCLUDED.difference_sumsq;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        DROP TRIGGER IF EXISTS predictions_rollup ON predictions;
+        CREATE TRIGGER predictions_rollup
+        AFTER INSERT ON predictions REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION rollup_new_predictions()
+        """,
+        """
+        DROP TRIGGER IF EXISTS validations_rollup ON validations;
+        CREATE TRIGGER validations_rollup
+        AFTER INSERT ON validations REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION rollup_new_validations()
+        """,
+        # Backfill from the rows already there
+        REBUILD_SQL,
+    ]),
+
+    # At most one validation per prediction. Predictions that already have
+    # one are marked validated, which is what inserts check (see
+    # db.insert_validations); later duplicates are removed, the unique index
+    # backs this up, and the rollups are recomputed without the duplicates.
+    Migration(6, "unique_validations", [
+        """
+        UPDATE predictions p SET validation_status = 'validated'
+        WHERE p.validation_status <> 'validated'
+          AND EXISTS (SELECT 1 FROM validations v WHERE v.prediction_id = p.id)
+        """,
+        """
+        DELETE FROM validations v USING validations w
+        WHERE w.prediction_id = v.prediction_id
+          AND (w.validated_at, w.id) < (v.validated_at, v.id)
+        """,
+        Index("validations_prediction_id_key", "validations", "prediction_id", unique=True),
+        REBUILD_SQL,
+    ]),
+
+    # Keyset pagination of the dashboard's table orders by
+    # (prediction_timestamp DESC, id DESC) and seeks past a row with a row
+    # comparison, which a backward scan of this index serves directly
+    Migration(7, "keyset_pagination", [
+        Index("predictions_timestamp_id_idx", "predictions", "prediction_timestamp, id"),
+        "DROP INDEX IF EXISTS predictions_timestamp_idx",
+    ]),
+)
+
+
+def _ensure_version_table(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+
+def applied_versions(conn) -> List[int]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_version ORDER BY version")
+        return [row[0] for row in cur.fetchall()]
+
+
+def is_partitioned(cur, table: str) -> bool:
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def partitions_of(cur, table: str) -> List[str]:
+    cur.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+        """,
+        (table,)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _drop_if_invalid(cur, name: str) -> None:
+    # A concurrent build that failed leaves an invalid index behind, which
+    # IF NOT EXISTS would then skip; drop it so it is built again
+    cur.execute(
+        """
+        SELECT NOT i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)
+        """,
+        (name,)
+    )
+    row = cur.fetchone()
+    if row and row[0]:
+        logger.warning(f"Dropping invalid index {name} left by an interrupted build")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _build_index(conn, index: Index) -> None:
+    with conn.cursor() as cur:
+        if not is_partitioned(cur, index.table):
+            _drop_if_invalid(cur, index.name)
+            cur.execute(index.sql())
+            return
+
+        if index.unique:
+            # Unique indexes on a partitioned table must include the partition column
+            logger.warning(f"Skipping unique index {index.name}: {index.table} is partitioned")
+            return
+
+        # A partitioned table can't be indexed concurrently. Index each
+        # partition concurrently instead and attach it to an index made ON
+        # ONLY the parent, which turns valid once every partition has one.
+        cur.execute(index.sql(table=f"ONLY {index.table}", concurrently=False))
+        for partition in partitions_of(cur, index.table):
+            # Partitions created since the parent index existed got theirs automatically
+            cur.execute(
+                """
+                SELECT 1
+                FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+                WHERE i.inhparent = to_regclass(%s) AND x.indrelid = to_regclass(%s)
+                """,
+                (index.name, partition)
+            )
+            if cur.fetchone():
+                continue
+            name = f"{partition}_{index.name}"[:63]
+            _drop_if_invalid(cur, name)
+            cur.execute(index.sql(table=partition, name=name))
+            cur.execute(f"ALTER INDEX {index.name} ATTACH PARTITION {name}")
+
+
+def _apply(conn, migration: Migration) -> None:
+    for step in migration.steps:
+        if isinstance(step, Index):
+            # CONCURRENTLY can't run inside a transaction block
+            conn.autocommit = True
+            try:
+                _build_index(conn, step)
+            finally:
+                conn.autocommit = False
+        else:
+            with conn.cursor() as cur:
+                cur.execute(step)
+            conn.commit()
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+            (migration.version, migration.name)
+        )
+    conn.commit()
+
+
+def migrate(conn: psycopg2.extensions.connection, target: int = None) -> List[int]:
+    """
+    Apply pending migrations up to 'target' (default: all) in version order.
+    Returns the versions applied.
+    """
+    # Start outside any transaction the caller left open, so the autocommit
+    # switch for concurrent index builds is allowed
+    conn.commit()
+    previous_autocommit = conn.autocommit
+    conn.autocommit = False
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    conn.commit()
+    try:
+        _ensure_version_table(conn)
+        conn.commit()
+        done = set(applied_versions(conn))
+        conn.commit()
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in done or (target is not None and migration.version > target):
+                continue
+            logger.info(f"Applying migration {migration.version} ({migration.name})")
+            try:
+                _apply(conn, migration)
+            except psycopg2.Error:
+                logger.error(f"Migration {migration.version} ({migration.name}) failed")
+                raise
+            applied.append(migration.version)
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        conn.autocommit = previous_autocommit
+
+    if applied:
+        logger.info(f"Applied migrations {applied}")
+    return applied
+
+
+def main():
+    from .aws_utils import SecretsManager
+
+    parser = argparse.ArgumentParser(description="Apply modtrack schema migrations")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations and exit")
+    parser.add_argument("--target", type=int, help="Stop after this version")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    secrets = SecretsManager().get_secret(Config.DB_SECRET_NAME)
+    conn = psycopg2.connect(
+        dbname=secrets['dbname'],
+        user=secrets['username'],
+        password=secrets['password'],
+        host=secrets['host'],
+        port=secrets['port']
+    )
+    try:
+        if args.status:
+            _ensure_version_table(conn)
+            done = set(applied_versions(conn))
+            conn.commit()
+            for migration in MIGRATIONS:
+                state = "applied" if migration.version in done else "pending"
+                print(f"{migration.version:>4}  {migration.name:<24} {state}")
+        else:
+            migrate(conn, args.target)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from pydantic import BaseModel
 from datetime import datetime
+from typing import List
+import asyncio
+import os
 import random
 import logging
 
 app = FastAPI()
 
+# Simulated upstream latency, e.g. for benchmarking validation throughput
+LATENCY_SECONDS = float(os.getenv("MOCK_API_LATENCY_MS", "0")) / 1000
+
 # Mock data store
 RESERVOIRS = {
     "reservoir_1": {"min": 100, "max": 150, "name": "Blue Lake"},
@@ -30,6 +37,39 @@ async def get_water_level(reservoir_id: str):
     if reservoir_id not in RESERVOIRS:
         raise HTTPException(status_code=404, detail=f"Reservoir {reservoir_id} not found")
     
+    if LATENCY_SECONDS:
+        await asyncio.sleep(LATENCY_SECONDS)
+
+    return _reading(reservoir_id)
+
+class WaterLevelsRequest(BaseModel):
+    reservoir_ids: List[str]
+
+# Upper bound on the reservoirs a single bulk request may ask for
+MAX_BULK_IDS = 500
+
+@app.get("/water-levels")
+async def get_water_levels(ids: str = Query(..., description="Comma-separated reservoir IDs")):
+    return await _water_levels([i for i in ids.split(",") if i])
+
+@app.post("/water-levels")
+async def post_water_levels(request: WaterLevelsRequest):
+    return await _water_levels(request.reservoir_ids)
+
+async def _water_levels(reservoir_ids: List[str]):
+    """Readings for many reservoirs in one round trip; unknown IDs are listed, not fatal."""
+    if len(reservoir_ids) > MAX_BULK_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_IDS} reservoirs per request")
+
+    if LATENCY_SECONDS:
+        await asyncio.sleep(LATENCY_SECONDS)
+
+    return {
+        "readings": [_reading(r) for r in dict.fromkeys(reservoir_ids) if r in RESERVOIRS],
+        "not_found": [r for r in dict.fromkeys(reservoir_ids) if r not in RESERVOIRS]
+    }
+
+def _reading(reservoir_id: str) -> dict:
     reservoir = RESERVOIRS[reservoir_id]
     level = random.uniform(reservoir["min"], reservoir["max"])
     
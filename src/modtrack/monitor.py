@@ -1,3 +1,4 @@
+import hashlib
 import time
 from pathlib import Path
 from watchdog.observers import Observer
@@ -5,32 +6,53 @@ from watchdog.events import FileSystemEventHandler
 import logging
 from datetime import datetime, timezone, timedelta
 import schedule
-import csv
 from .aws_utils import SecretsManager, EventBridge
 from .config import Config
-from .db import init_db_schema
-from .celery_app import validate_prediction_task
+from .db import init_db_schema, insert_predictions, insert_validations, is_auth_failure, prediction_id_for
+from .readers import iter_prediction_chunks
+from .ingestion import IngestionPool, IngestPipeline
+from .scanner import IncrementalScanner
+from .ledger import claim_file, content_hash, file_key, filter_unprocessed, import_processed_csv, record_failed_file
+from .scheduling import DueValidationScheduler
+from .sweeper import StaleSweeper
+from .partitions import PartitionMaintainer
+from .spool import Spool, SpoolReplayer
+from .upstream import UpstreamClient
 import psycopg2
-from typing import Optional
+from typing import List, Optional
 import os
 import json
 import httpx
 import uuid
+from itertools import repeat
 
 class ModelResultsHandler(FileSystemEventHandler):
+    # Legacy processed-files list, imported into the ingestion ledger on first start
     PROCESSED_FILES_CSV = 'processed_files.csv'
 
-    def __init__(self, target_directory: Path):
+    def __init__(self, target_directory: Path, db_secrets: Optional[dict] = None,
+                 api_secrets: Optional[dict] = None):
         # Initialize logger first
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
 
         self.target_directory = target_directory
-        self.processed_files = set()
 
         # Path to the .csv file
         self.processed_files_path = self.target_directory / self.PROCESSED_FILES_CSV
 
+        # Set by start_monitoring; without them files are ingested inline
+        self.ingestion_pool = None
+        self.pipeline = None
+        # Where files go while the database is unreachable, if set
+        self.spool: Optional[Spool] = None
+
+        # Secrets can be passed in directly (e.g. by the benchmarks);
+        # otherwise they are fetched from Secrets Manager
+        self.db_secrets = db_secrets
+        self.api_secrets = api_secrets
+        self._secrets_from_manager = db_secrets is None
+
         # Initialize with retries
         self.db_connection = None
         self.api_client = None
@@ -39,20 +61,21 @@ class ModelResultsHandler(FileSystemEventHandler):
         # Try to initialize connections with retries
         self._initialize_with_retries()
 
-        # Load processed files from the CSV
-        self._load_processed_files()
-
         # Initialize database schema
         init_db_schema(self.db_connection)
 
+        # Carry over files recorded by older versions
+        import_processed_csv(self.db_connection, self.processed_files_path)
+
     def _initialize_with_retries(self, max_retries=5, delay=2):
         """Initialize connections with retries."""
         for attempt in range(max_retries):
             try:
                 # Initialize AWS services and get secrets first
-                secrets = SecretsManager()
-                self.db_secrets = secrets.get_secret(Config.DB_SECRET_NAME)
-                self.api_secrets = secrets.get_secret(Config.API_SECRET_NAME)
+                if self.db_secrets is None or self.api_secrets is None:
+                    secrets = SecretsManager()
+                    self.db_secrets = self.db_secrets or secrets.get_secret(Config.DB_SECRET_NAME)
+                    self.api_secrets = self.api_secrets or secrets.get_secret(Config.API_SECRET_NAME)
 
                 # Initialize connections using secrets
                 self.db_connection = self.init_db_connection(self.db_secrets)
@@ -72,122 +95,176 @@ class ModelResultsHandler(FileSystemEventHandler):
                     self.logger.error("Failed to initialize after all retries")
                     raise
 
-    def _load_processed_files(self):
-        """Load processed files from the CSV into the in-memory set."""
-        if not self.processed_files_path.exists():
-            # If the CSV doesn't exist, create it
-            self.processed_files_path.touch()
-            self.logger.info(f"Created new processed files tracking CSV at {self.processed_files_path}")
-            return
-
-        try:
-            with self.processed_files_path.open(mode='r', newline='') as csvfile:
-                reader = csv.reader(csvfile)
-                self.processed_files = {row[0] for row in reader if row}
-            self.logger.info(f"Loaded {len(self.processed_files)} processed files from CSV.")
-        except Exception as e:
-            self.logger.error(f"Failed to load processed files from CSV: {e}")
-            raise
-
-    def mark_file_as_processed(self, file_name: str):
-        """Append the processed file to the CSV and update the in-memory set."""
-        try:
-            with self.processed_files_path.open(mode='a', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow([file_name])
-            self.processed_files.add(file_name)
-            self.logger.debug(f"Marked file as processed in CSV: {file_name}")
-        except Exception as e:
-            self.logger.error(f"Failed to mark file as processed in CSV: {e}")
-            raise
+    def filter_unprocessed(self, file_paths: List[Path]) -> List[Path]:
+        """Drop the files that the ingestion ledger already has."""
+        by_key = {}
+        for file_path in file_paths:
+            try:
+                by_key[file_key(file_path)] = file_path
+            except FileNotFoundError:
+                continue
+        return [by_key[key] for key in filter_unprocessed(self.db_connection, list(by_key))]
 
     def on_created(self, event):
         """Handler for new file creation events."""
         if event.is_directory:
             return
 
+        # Whether the file is new is decided by the ledger claim on the worker,
+        # so the observer thread never touches the database
         file_path = Path(event.src_path)
-        file_name = file_path.name
+        self.logger.info(f"New file detected: {file_path.name}")
+        self.enqueue_file(file_path)
 
-        if file_name not in self.processed_files:
-            self.logger.info(f"New file detected: {file_name}")
-            try:
-                self.process_file(file_path)
-                self.mark_file_as_processed(file_name)
-            except Exception as e:
-                self.logger.error(f"Error processing file {file_name}: {e}")
+    def on_modified(self, event):
+        """A file still being written; the pipeline waits for it to settle."""
+        if event.is_directory:
+            return
+        self.enqueue_file(Path(event.src_path))
 
-    def process_file(self, file_path: Path) -> None:
+    def on_moved(self, event):
+        """A rename into the directory hands over a complete file."""
+        if event.is_directory:
+            return
+        if self.pipeline is not None:
+            self.pipeline.discard(Path(event.src_path))
+        self.enqueue_file(Path(event.dest_path), ready=True)
+
+    def on_deleted(self, event):
+        if not event.is_directory and self.pipeline is not None:
+            self.pipeline.discard(Path(event.src_path))
+
+    def enqueue_file(self, file_path: Path, ready: bool = False) -> None:
+        """Hand a file to the ingest pipeline or pool, or ingest it inline if there is neither."""
+        if self.pipeline is not None:
+            self.pipeline.notify(file_path, ready=ready)
+            return
+        if self.ingestion_pool is not None:
+            self.ingestion_pool.submit(file_path)
+            return
+
+        try:
+            self.process_file(file_path)
+        except Exception as e:
+            self.logger.error(f"Error processing file {file_path.name}: {e}")
+
+    def process_file(self, file_path: Path, conn=None) -> None:
         """
-        Parses the JSON file of predictions, inserts them into the DB,
-        and enqueues Celery tasks to validate at 'validation_time'.
+        Streams the prediction file in chunks, using the reader registered for
+        its extension, and bulk inserts them into the DB in a single transaction
+        together with its ingestion ledger entry. The DueValidationScheduler
+        dispatches each prediction for validation once its 'validation_time'
+        has passed.
         """
+        if self.spool is not None and self.spool.db_down():
+            self.spool_file(file_path)
+            return
+
         self.logger.info(f"Processing new file: {file_path.name}")
+        conn = conn or self.db_connection
+        batch_size = Config.INGEST_BATCH_SIZE
+        key = file_key(file_path)
+        # Hashed as the reader goes, rather than in a pass of its own
+        digest = hashlib.sha256()
 
         try:
-            with open(file_path) as f:
-                data = json.load(f)
-
-            for prediction in data["predictions"]:
-                prediction_id = str(uuid.uuid4())
-                reservoir_id = prediction["reservoir_id"]
-                predicted_level = prediction["predicted_level"]
+            started = time.perf_counter()
+            inserted = 0
+
+            # Insert the whole file in one transaction, so a failure part-way
+            # through leaves none of its rows behind. Only one chunk is held
+            # in memory at a time.
+            with conn.cursor() as cur:
+                for chunk in iter_prediction_chunks(file_path, batch_size, digest):
+                    rows = self._chunk_rows(chunk, file_path.name)
+                    inserted += insert_predictions(cur, rows, Config.INGEST_METHOD, batch_size)
+
+                # The ledger entry commits or rolls back with the rows. It is
+                # claimed last, once the digest is complete; a concurrent
+                # writer's rows and claim wait on ours until we commit.
+                if not claim_file(cur, key, digest.hexdigest()):
+                    # Keep only the ledger entry, so the file isn't read again
+                    conn.rollback()
+                    claim_file(cur, key, digest.hexdigest())
+                    conn.commit()
+                    self.logger.info(f"Skipping {file_path.name}: already ingested")
+                    return
+            conn.commit()
+
+            elapsed = time.perf_counter() - started
+            self.logger.info(
+                f"Inserted {inserted} predictions from {file_path.name} in {elapsed:.3f}s "
+                f"({inserted / elapsed if elapsed > 0 else 0:.0f} rows/s, method={Config.INGEST_METHOD})"
+            )
 
-                # Convert timestamps from ISO 8601
-                prediction_timestamp = datetime.fromisoformat(
-                    data["timestamp"].replace('Z', '+00:00')
-                )
-                validation_time = datetime.fromisoformat(
-                    prediction["validation_time"].replace('Z', '+00:00')
-                )
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            self._rollback(conn)
+            if self.spool is None:
+                self.logger.error(f"Database error processing file {file_path}: {str(e)}")
+                return
+            # The database is unreachable: keep the rows locally until it's back
+            self.logger.warning(f"Database unavailable, spooling {file_path.name}: {e}")
+            self.spool.mark_db_down()
+            self.spool_file(file_path)
+        except psycopg2.Error as e:
+            # The database rejected the file's rows (bad data, a constraint)
+            self._rollback(conn)
+            self.logger.error(f"Database error processing file {file_path}: {str(e)}")
+            self._record_failed(conn, file_path, key, str(e))
+        except Exception as e:
+            self._rollback(conn)
+            self.logger.error(f"Error processing file {file_path}: {str(e)}")
+            self._record_failed(conn, file_path, key, str(e))
 
-                # 1) Insert into DB so we have a record of this prediction
-                with self.db_connection.cursor() as cur:
-                    cur.execute(
-                        """
-                        INSERT INTO predictions
-                        (id, reservoir_id, predicted_level, prediction_timestamp,
-                        validation_time, file_name)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        """,
-                        (
-                            prediction_id,
-                            reservoir_id,
-                            predicted_level,
-                            prediction_timestamp,
-                            validation_time,
-                            file_path.name
-                        )
-                    )
-                    self.db_connection.commit()
-
-                # 2) Compute how many seconds from now until 'validation_time'.
-                #    If it's already in the past, run immediately.
-                now_utc = datetime.now(timezone.utc)
-                diff_seconds = (validation_time - now_utc).total_seconds()
-
-                if diff_seconds <= 0:
-                    # The validation time has passed (or is now),
-                    # so let's enqueue the task to run immediately.
-                    validate_prediction_task.delay(prediction_id, reservoir_id, predicted_level)
-                    self.logger.info(
-                        f"Validation time is already past. Running validation now for {reservoir_id}."
-                    )
-                else:
-                    # The validation time is in the future, so schedule it for that time.
-                    # 'countdown' is how many seconds from now Celery should wait.
-                    validate_prediction_task.apply_async(
-                        args=[prediction_id, reservoir_id, predicted_level],
-                        countdown=diff_seconds
-                    )
-                    self.logger.info(
-                        f"Scheduled validation task for reservoir {reservoir_id} in {diff_seconds:.1f} seconds "
-                        f"(at {validation_time.isoformat()})."
-                    )
+    def _record_failed(self, conn, file_path: Path, key, error: str) -> None:
+        """Remember a bad file in the ledger, so it isn't retried until it changes."""
+        try:
+            # The reader stopped part-way, so the digest is taken afresh
+            record_failed_file(conn, key, content_hash(file_path), error)
+        except (OSError, psycopg2.Error) as e:
+            self._rollback(conn)
+            self.logger.error(f"Failed to record {file_path.name} in the ledger: {e}")
+
+    @staticmethod
+    def _chunk_rows(chunk, file_name: str):
+        """A chunk's rows, ordered as PREDICTION_COLUMNS."""
+        # Ids derive from the file and prediction, so rows already inserted
+        # by an earlier, interrupted run are skipped
+        return zip(
+            map(prediction_id_for, repeat(file_name), chunk.reservoir_ids, chunk.validation_times),
+            chunk.reservoir_ids,
+            chunk.predicted_levels,
+            repeat(chunk.prediction_timestamp),
+            chunk.validation_times,
+            repeat(file_name)
+        )
+
+    def spool_file(self, file_path: Path) -> None:
+        """
+        Write a file's predictions to the local spool; the SpoolReplayer
+        inserts them, and records the file in the ledger, once the database
+        is back. A file that can't be read is left for the next scan.
+        """
+        try:
+            started = time.perf_counter()
+            digest = hashlib.sha256()
+            chunks = (
+                list(self._chunk_rows(chunk, file_path.name))
+                for chunk in iter_prediction_chunks(file_path, Config.INGEST_BATCH_SIZE, digest)
+            )
+            spooled = self.spool.append_file(file_path.name, file_key(file_path), digest, chunks)
+            self.logger.info(
+                f"Spooled {spooled} predictions from {file_path.name} in {time.perf_counter() - started:.3f}s"
+            )
+        except Exception as e:
+            self.logger.error(f"Error spooling file {file_path}: {e}")
 
+    def _rollback(self, conn):
+        """Roll back the current transaction, ignoring errors on a dead connection."""
+        try:
+            conn.rollback()
         except Exception as e:
-            self.logger.error(f"Error processing file {file_path}: {str(e)}")
-            return
+            self.logger.warning(f"Rollback failed: {e}")
 
     def validate_prediction(self, prediction_id: str, reservoir_id: str, predicted_level: float) -> None:
         """
@@ -209,19 +286,9 @@ class ModelResultsHandler(FileSystemEventHandler):
 
             # Store validation result
             with self.db_connection.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO validations
-                    (id, prediction_id, actual_level, difference, validated_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """,
-                    (
-                        str(uuid.uuid4()),
-                        prediction_id,
-                        actual_level,
-                        difference,
-                        datetime.now(timezone.utc)
-                    )
+                insert_validations(
+                    cur,
+                    [(uuid.uuid4(), prediction_id, actual_level, difference, datetime.now(timezone.utc))]
                 )
                 self.db_connection.commit()
 
@@ -246,35 +313,6 @@ class ModelResultsHandler(FileSystemEventHandler):
             )
             self.logger.info(f"Scheduled validation for prediction {pred['id']} at {iso_timestamp}")
 
-    def cleanup_stale_predictions(self):
-        """Clean up predictions that are stuck in pending state."""
-        try:
-            with self.db_connection.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO validations (id, prediction_id, actual_level, difference, validated_at)
-                    SELECT
-                        uuid_generate_v4(),
-                        p.id,
-                        0,  -- placeholder actual_level
-                        0,  -- placeholder difference
-                        NOW()
-                    FROM predictions p
-                    LEFT JOIN validations v ON p.id = v.prediction_id
-                    WHERE
-                        v.id IS NULL
-                        AND p.validation_time < NOW() - INTERVAL '5 minutes'
-                    RETURNING prediction_id;
-                    """
-                )
-                stale_count = cur.rowcount
-                if stale_count > 0:
-                    self.logger.info(f"Marked {stale_count} stale predictions as failed")
-
-                self.db_connection.commit()
-        except Exception as e:
-            self.logger.error(f"Error cleaning up stale predictions: {e}")
-
     def init_db_connection(self, secrets_dict=None):
         """Initialize database connection."""
         if secrets_dict is None:
@@ -301,6 +339,20 @@ class ModelResultsHandler(FileSystemEventHandler):
             self.logger.error(f"Failed to connect to database: {e}")
             raise
 
+    def connect_db(self):
+        """
+        Open a new connection with the current DB secrets. If they are rejected
+        and came from Secrets Manager, fetch them again (they may have been
+        rotated) and retry once.
+        """
+        try:
+            return self.init_db_connection(self.db_secrets)
+        except psycopg2.OperationalError as e:
+            if not (self._secrets_from_manager and is_auth_failure(e)):
+                raise
+            self.db_secrets = SecretsManager().get_secret(Config.DB_SECRET_NAME, force_refresh=True)
+            return self.init_db_connection(self.db_secrets)
+
     def init_api_client(self, api_secrets):
         """Initialize API client using secrets."""
         try:
@@ -315,6 +367,8 @@ class APIClient:
         self.url = url
         self.headers = {'Authorization': f'Bearer {api_key}'}
         self.client = httpx.Client(timeout=10.0)  # Add timeout
+        # Retries, adaptive concurrency and circuit breaking
+        self.upstream = UpstreamClient(self.client)
         
         # Test connection on init
         try:
@@ -326,41 +380,81 @@ class APIClient:
 
     def get_water_level(self, reservoir_id: str) -> dict:
         try:
-            response = self.client.get(
+            response = self.upstream.request(
+                "GET",
                 f"{self.url}/water-level/{reservoir_id}",
                 headers=self.headers
             )
-            response.raise_for_status()
             return response.json()
         except Exception as e:
             print(f"Error getting water level: {e}")
             raise
 
+    def get_water_levels(self, reservoir_ids: List[str]) -> dict:
+        """Readings for many reservoirs by ID, WATER_LEVEL_BATCH_SIZE per request."""
+        readings = {}
+        batch_size = Config.WATER_LEVEL_BATCH_SIZE
+        try:
+            for start in range(0, len(reservoir_ids), batch_size):
+                response = self.upstream.request(
+                    "POST",
+                    f"{self.url}/water-levels",
+                    json={"reservoir_ids": reservoir_ids[start:start + batch_size]},
+                    headers=self.headers
+                )
+                readings.update({r["reservoir_id"]: r for r in response.json()["readings"]})
+            return readings
+        except Exception as e:
+            print(f"Error getting water levels: {e}")
+            raise
+
 class ScanScheduler:
-    def __init__(self, directory: Path, handler: ModelResultsHandler, interval_minutes: int = 1):
+    def __init__(self, directory: Path, handler: ModelResultsHandler, interval_minutes: int = 1,
+                 scanner: Optional[IncrementalScanner] = None,
+                 due_scheduler: Optional[DueValidationScheduler] = None,
+                 sweeper: Optional[StaleSweeper] = None,
+                 partitions: Optional[PartitionMaintainer] = None,
+                 replayer: Optional[SpoolReplayer] = None):
         self.directory = directory
         self.handler = handler
         self.interval = interval_minutes
+        self.scanner = scanner
+        self.due_scheduler = due_scheduler
+        self.sweeper = sweeper
+        self.partitions = partitions
+        self.replayer = replayer
         
         # Schedule regular scans
         self.scan_job = schedule.every(self.interval).minutes.do(self.scan_and_log)
         
-        # Schedule cleanup every 5 minutes
-        self.cleanup_job = schedule.every(5).minutes.do(self.cleanup_stale_predictions)
+        # Re-queue predictions whose validation never arrived, a bounded
+        # chunk at a time
+        if self.sweeper is not None:
+            self.sweep_job = schedule.every(Config.SWEEP_INTERVAL_SECONDS).seconds.do(self.sweeper.run)
+
+        # Keep monthly partitions ahead of the data and drop expired ones
+        if self.partitions is not None:
+            self.partition_job = schedule.every(
+                int(Config.PARTITION_MAINTENANCE_HOURS * 3600)
+            ).seconds.do(self.partitions.run)
 
         # Calculate the initial next_run_time
         self.next_run_time = datetime.now(timezone.utc) + timedelta(minutes=self.interval)
         self.log_next_run(initial=True)
 
-    def cleanup_stale_predictions(self):
-        """Run the cleanup for stale predictions"""
-        self.handler.cleanup_stale_predictions()
-
     def scan_and_log(self):
         """Perform the scan and log the next scheduled run."""
         try:
-            scan_directory(self.directory, self.handler)
+            scan_directory(self.directory, self.handler, self.scanner)
             self.handler.logger.info("Scan completed successfully.")
+            if self.handler.pipeline is not None:
+                self.handler.logger.info(f"Ingest pipeline: {self.handler.pipeline.stats()}")
+            if self.due_scheduler is not None:
+                self.handler.logger.info(f"Due validations: {self.due_scheduler.stats()}")
+            if self.sweeper is not None:
+                self.handler.logger.info(f"Stale sweeper: {self.sweeper.stats()}")
+            if self.replayer is not None:
+                self.handler.logger.info(f"Spool: {self.replayer.stats()}")
         except Exception as e:
             self.handler.logger.error(f"Error during scan: {e}")
         
@@ -376,19 +470,17 @@ class ScanScheduler:
         else:
             self.handler.logger.info(f"Scheduled next scan: {run_time_str}")
 
-def scan_directory(directory: Path, handler: ModelResultsHandler):
+def scan_directory(directory: Path, handler: ModelResultsHandler,
+                   scanner: Optional[IncrementalScanner] = None):
     """Scan the directory for any files that haven't been processed yet"""
     handler.logger.info("Scanning...")
-    for file_path in directory.glob('*'):
-        if file_path.is_file():
-            file_name = file_path.name
-            if file_name not in handler.processed_files:
-                handler.logger.info(f"New file found: {file_name}")
-                try:
-                    handler.process_file(file_path)
-                    handler.mark_file_as_processed(file_name)
-                except Exception as e:
-                    handler.logger.error(f"Error processing file {file_name}: {e}")
+    if scanner is not None:
+        candidates = scanner.candidates()
+    else:
+        candidates = [file_path for file_path in directory.glob('*') if file_path.is_file()]
+    for file_path in handler.filter_unprocessed(candidates):
+        handler.logger.info(f"New file found: {file_path.name}")
+        handler.enqueue_file(file_path)
 
 def start_monitoring(directory_path: str):
     target_dir = Path(directory_path)
@@ -396,17 +488,55 @@ def start_monitoring(directory_path: str):
         raise ValueError(f"Directory does not exist: {directory_path}")
 
     handler = ModelResultsHandler(target_dir)
+
+    # While the database is unreachable, ingestion writes to a local spool
+    # that the replayer drains once it is back
+    replayer = None
+    if Config.SPOOL_ENABLED:
+        handler.spool = Spool()
+        replayer = SpoolReplayer(handler.spool, handler.connect_db)
+        replayer.start()
+
+    # Ingest on a bounded worker pool, so the observer and the scanner only
+    # enqueue paths and never wait on the database or the broker themselves.
+    # Both report into one pipeline that merges duplicate reports and waits
+    # for files to finish being written.
+    ingestion_pool = IngestionPool(handler)
+    ingestion_pool.start()
+    pipeline = IngestPipeline(ingestion_pool)
+    pipeline.start()
+    handler.ingestion_pool = ingestion_pool
+    handler.pipeline = pipeline
+
+    # Validations are dispatched from the database as they fall due
+    due_scheduler = DueValidationScheduler(handler.connect_db)
+    due_scheduler.start()
+    sweeper = StaleSweeper(handler.connect_db)
+    partitions = None
+    if Config.PARTITIONING_ENABLED:
+        partitions = PartitionMaintainer(handler.connect_db)
+        partitions.run()
+
+    scanner = None
+    if Config.SCAN_MODE == "incremental":
+        scanner = IncrementalScanner(
+            target_dir, recursive=Config.SCAN_RECURSIVE, full_scan_every=Config.SCAN_FULL_EVERY,
+            cursor_pattern=Config.SCAN_CURSOR_PATTERN
+        )
+
     observer = Observer()
-    observer.schedule(handler, str(target_dir), recursive=False)
+    observer.schedule(handler, str(target_dir), recursive=Config.SCAN_RECURSIVE)
     observer.start()
 
     try:
-        # Run first scan immediately
-        scan_directory(target_dir, handler)
+        # Run first scan immediately (always a full one)
+        scan_directory(target_dir, handler, scanner)
         handler.logger.info("Initial scan completed.")
 
         # Initialize the scheduler
-        _ = ScanScheduler(target_dir, handler, interval_minutes=1)
+        _ = ScanScheduler(target_dir, handler, interval_minutes=1, scanner=scanner,
+                          due_scheduler=due_scheduler, sweeper=sweeper, partitions=partitions,
+                          replayer=replayer)
 
         # Main loop to run scheduled jobs
         while True:
@@ -419,3 +549,10 @@ def start_monitoring(directory_path: str):
         handler.logger.error(f"An error occurred: {e}")
         observer.stop()
     observer.join()
+    due_scheduler.stop()
+    sweeper.close()
+    pipeline.stop()
+    ingestion_pool.stop()
+    if replayer is not None:
+        replayer.stop()
+        handler.spool.close()
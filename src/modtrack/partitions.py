@@ -0,0 +1,276 @@
+"""
+Monthly range partitioning of predictions (by prediction_timestamp) and
+validations (by validated_at).
+
+Partitioning is optional (PARTITIONING_ENABLED). Existing tables are
+converted once, in a quiet period: the data is copied into the new tables
+within one transaction that locks both tables out until it finishes.
+
+    python -m modtrack.partitions convert
+    python -m modtrack.partitions maintain
+
+Afterwards the monitor keeps partitions PARTITION_PREMAKE_MONTHS months
+ahead, and drops whole partitions past PARTITION_RETENTION_MONTHS instead of
+deleting old rows. Each table also gets a default partition, so rows outside
+every monthly range (e.g. a file of old predictions) are still accepted.
+
+A partitioned table's primary key must include its partition column, so the
+keys become (id, prediction_timestamp) and (id, validated_at), and
+validations no longer has a foreign key to predictions or a unique index on
+prediction_id. One validation per prediction is still enforced when they are
+inserted (see db.insert_validations).
+"""
+import argparse
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import psycopg2
+from .config import Config
+from .migrations import is_partitioned, migrate, partitions_of
+from .rollups import refresh_partition_buckets, stage_partition_buckets
+
+logger = logging.getLogger(__name__)
+
+# Partitioned table -> its partition column
+PARTITIONED_TABLES = {
+    "predictions": "prediction_timestamp",
+    "validations": "validated_at",
+}
+
+_MONTH_PARTITION = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _month_start(at: datetime) -> date:
+    at = at.astimezone(timezone.utc)
+    return date(at.year, at.month, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def _partition_month(name: str) -> Optional[date]:
+    match = _MONTH_PARTITION.search(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _create_partition(cur, table: str, month: date, parent: str = None) -> bool:
+    """Create the month's partition if missing; returns whether it was created."""
+    name = partition_name(table, month)
+    cur.execute("SELECT to_regclass(%s) IS NULL", (name,))
+    if not cur.fetchone()[0]:
+        return False
+    cur.execute(
+        f"""
+        CREATE TABLE {name} PARTITION OF {parent or table}
+        FOR VALUES FROM (%s) TO (%s)
+        """,
+        (f"{month.isoformat()} 00:00+00", f"{_add_months(month, 1).isoformat()} 00:00+00")
+    )
+    return True
+
+
+def convert(conn: psycopg2.extensions.connection, premake_months: int = None) -> List[str]:
+    """
+    Convert predictions and validations to monthly partitioned tables, with
+    partitions for every month that has rows up to 'premake_months' ahead.
+    Tables already partitioned are left alone. Returns the tables converted.
+    """
+    premake_months = Config.PARTITION_PREMAKE_MONTHS if premake_months is None else premake_months
+    migrate(conn)
+
+    converted = []
+    with conn.cursor() as cur:
+        # Both at once, so the foreign key between them can be dropped
+        cur.execute("LOCK TABLE validations, predictions IN ACCESS EXCLUSIVE MODE")
+        pending = [t for t in PARTITIONED_TABLES if not is_partitioned(cur, t)]
+        # Index and trigger definitions to recreate on the new tables, bar
+        # the primary keys. Unique indexes can't carry over: on a partitioned
+        # table they'd have to include the partition column.
+        definitions = {}
+        for table in pending:
+            cur.execute(
+                """
+                SELECT pg_get_indexdef(i.indexrelid), i.indisunique, c.relname
+                FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = to_regclass(%s) AND NOT i.indisprimary
+                """,
+                (table,)
+            )
+            definitions[table] = []
+            for definition, unique, name in cur.fetchall():
+                if unique:
+                    logger.warning(f"Dropping unique index {name}, which a partitioned {table} can't have")
+                else:
+                    definitions[table].append(definition)
+            cur.execute(
+                "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal",
+                (table,)
+            )
+            definitions[table] += [row[0] for row in cur.fetchall()]
+
+        last = _add_months(_month_start(datetime.now(timezone.utc)), premake_months)
+        for table in pending:
+            column = PARTITIONED_TABLES[table]
+            new = f"{table}_partitioned"
+            cur.execute(f"CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE ({column})")
+            cur.execute(f"ALTER TABLE {new} ADD CONSTRAINT {table}_pkey_new PRIMARY KEY (id, {column})")
+            cur.execute(f"CREATE TABLE {table}_default PARTITION OF {new} DEFAULT")
+
+            cur.execute(f"SELECT min({column}) FROM {table}")
+            oldest = cur.fetchone()[0]
+            month = _month_start(oldest) if oldest else _month_start(datetime.now(timezone.utc))
+            while month <= last:
+                _create_partition(cur, table, month, parent=new)
+                month = _add_months(month, 1)
+
+            # The new table has no triggers yet, so the rollups don't count these again
+            cur.execute(f"INSERT INTO {new} SELECT * FROM {table}")
+            logger.info(f"Copied {cur.rowcount} rows into partitioned {table}")
+
+        # validations first: its foreign key depends on predictions
+        for table in sorted(pending, key=lambda t: t != "validations"):
+            cur.execute(f"DROP TABLE {table}")
+        for table in pending:
+            cur.execute(f"ALTER TABLE {table}_partitioned RENAME TO {table}")
+            cur.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {table}_pkey_new TO {table}_pkey")
+            for definition in definitions[table]:
+                # Same name and table as before, now on the partitioned parent
+                cur.execute(definition)
+            converted.append(table)
+    conn.commit()
+
+    if converted:
+        logger.info(f"Converted {', '.join(converted)} to monthly partitions")
+    return converted
+
+
+class PartitionMaintainer:
+    """
+    Creates upcoming monthly partitions and drops expired ones. Runs
+    periodically from the monitor; tables that aren't partitioned are skipped.
+    """
+
+    # Don't queue behind long queries for the parent's lock; try again next run
+    LOCK_TIMEOUT = "5s"
+
+    def __init__(self, connect: Callable, premake_months: int = None, retention_months: int = None):
+        self.connect = connect
+        self.premake_months = Config.PARTITION_PREMAKE_MONTHS if premake_months is None else premake_months
+        self.retention_months = (
+            Config.PARTITION_RETENTION_MONTHS if retention_months is None else retention_months
+        )
+        self.totals = {"created": 0, "dropped": 0}
+
+    def run(self) -> Dict[str, List[str]]:
+        """Returns the partitions created and dropped in this run."""
+        changes = {"created": [], "dropped": []}
+        conn = None
+        try:
+            conn = self.connect()
+            for table in PARTITIONED_TABLES:
+                with conn.cursor() as cur:
+                    partitioned = is_partitioned(cur, table)
+                conn.commit()
+                if not partitioned:
+                    logger.warning(f"{table} is not partitioned; run 'python -m modtrack.partitions convert'")
+                    continue
+                self._maintain(conn, table, changes)
+        except psycopg2.Error as e:
+            logger.error(f"Database error maintaining partitions: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+        for name, partitions in changes.items():
+            self.totals[name] += len(partitions)
+        if changes["created"] or changes["dropped"]:
+            logger.info(f"Partitions created: {changes['created']}, dropped: {changes['dropped']}")
+        return changes
+
+    def _maintain(self, conn, table: str, changes: dict) -> None:
+        this_month = _month_start(datetime.now(timezone.utc))
+        for offset in range(self.premake_months + 1):
+            month = _add_months(this_month, offset)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"SET LOCAL lock_timeout = '{self.LOCK_TIMEOUT}'")
+                    if _create_partition(cur, table, month):
+                        changes["created"].append(partition_name(table, month))
+                conn.commit()
+            except psycopg2.Error as e:
+                # Most likely the default partition already holds rows for
+                # this month, which have to be moved out by hand first
+                conn.rollback()
+                logger.error(f"Could not create {partition_name(table, month)}: {e}")
+
+        if self.retention_months <= 0:
+            return
+        cutoff = _add_months(this_month, -self.retention_months)
+        for name, month in self._monthly_partitions(conn, table):
+            # Only partitions whose whole range is past retention
+            if _add_months(month, 1) > cutoff:
+                continue
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"SET LOCAL lock_timeout = '{self.LOCK_TIMEOUT}'")
+                    # Triggers don't see dropped rows; take them out of the
+                    # rollups in the same transaction
+                    stage_partition_buckets(cur, table, name)
+                    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                    cur.execute(f"DROP TABLE {name}")
+                    refresh_partition_buckets(cur)
+                conn.commit()
+                changes["dropped"].append(name)
+            except psycopg2.Error as e:
+                conn.rollback()
+                logger.error(f"Could not drop {name}: {e}")
+
+    @staticmethod
+    def _monthly_partitions(conn, table: str) -> List[Tuple[str, date]]:
+        with conn.cursor() as cur:
+            names = partitions_of(cur, table)
+        conn.commit()
+        partitions = [(name, _partition_month(name)) for name in names]
+        return [(name, month) for name, month in partitions if month is not None]
+
+    def stats(self) -> dict:
+        return dict(self.totals)
+
+
+def main():
+    from .aws_utils import SecretsManager
+
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of predictions and validations")
+    parser.add_argument("command", choices=["convert", "maintain"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    secrets = SecretsManager().get_secret(Config.DB_SECRET_NAME)
+
+    def connect():
+        return psycopg2.connect(
+            dbname=secrets['dbname'],
+            user=secrets['username'],
+            password=secrets['password'],
+            host=secrets['host'],
+            port=secrets['port']
+        )
+
+    if args.command == "convert":
+        conn = connect()
+        try:
+            convert(conn)
+        finally:
+            conn.close()
+    PartitionMaintainer(connect).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import hashlib
+import io
+import json
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, TextIO
+
+# How much of the file is pulled into memory at a time
+READ_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+# What can follow the part of a number already decoded, e.g. ".5" after "2"
+_NUMBER_CHARS = "0123456789.eE+-"
+# Everything up to the next bracket that opens or closes a nesting level:
+# plain text, whole strings, and whole objects without brackets inside
+_STRING = r'"(?:[^"\\]++|\\.)*+"'
+_SKIP_RUN = re.compile(
+    rf'(?:[^"\[\]{{}}]++|{_STRING}|\{{(?:[^"\[\]{{}}]++|{_STRING})*+\}})*+'
+)
+_decoder = json.JSONDecoder()
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp, accepting a trailing 'Z' for UTC."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+@dataclass
+class PredictionChunk:
+    """
+    A bounded slice of a prediction file, stored column by column. Columns are
+    lists for the JSON readers and NumPy arrays for the columnar ones.
+    """
+    prediction_timestamp: datetime
+    reservoir_ids: list = field(default_factory=list)
+    predicted_levels: list = field(default_factory=list)
+    validation_times: list = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.reservoir_ids)
+
+    def append(self, prediction: dict) -> None:
+        self.reservoir_ids.append(prediction["reservoir_id"])
+        self.predicted_levels.append(prediction["predicted_level"])
+        self.validation_times.append(parse_timestamp(prediction["validation_time"]))
+
+
+class _JSONStream:
+    """
+    Decodes JSON values one at a time from a text stream, keeping only a small
+    window of the file in memory instead of the whole document.
+    """
+
+    def __init__(self, f: TextIO, read_size: int = READ_SIZE):
+        self._f = f
+        self._read_size = read_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        data = self._f.read(self._read_size)
+        if not data:
+            self._eof = True
+            return False
+        # Drop what has already been consumed so the window stays small
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Malformed prediction file: expected {char!r}, found {found!r}")
+        self._pos += 1
+
+    def value(self):
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self._buf, self._pos)
+                # A number ending at, or just before, the edge of the window
+                # may be cut off
+                cut_off = end == len(self._buf) or (
+                    isinstance(obj, (int, float)) and self._buf[end] in _NUMBER_CHARS
+                )
+                if not cut_off or self._eof:
+                    self._pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def skip_value(self) -> None:
+        """
+        Consume the next value without decoding it. Arrays and objects are
+        skipped by matching brackets outside strings, which is much cheaper
+        than building every item.
+        """
+        if self.peek() not in ('[', '{'):
+            self.value()
+            return
+        depth = 0
+        while True:
+            self._pos = _SKIP_RUN.match(self._buf, self._pos).end()
+            char = self._buf[self._pos:self._pos + 1]
+            if char in ('', '"'):
+                # The end of the window, or a string cut off by it
+                if not self._fill():
+                    raise ValueError("Malformed prediction file: unexpected end of file")
+                continue
+            self._pos += 1
+            if char in ('[', '{'):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def object_keys(self) -> Iterator[str]:
+        """Yield the keys of an object; the caller must consume each value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.expect('}')
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.expect(',')
+                continue
+            self.expect('}')
+            return
+
+    def array_items(self) -> Iterator:
+        """Yield the decoded items of an array one at a time."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.expect(']')
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.expect(',')
+                continue
+            self.expect(']')
+            return
+
+
+class _HashingReader(io.RawIOBase):
+    """A binary file that feeds every byte read through it into a hash."""
+
+    def __init__(self, f: BinaryIO, digest):
+        self._f = f
+        self._digest = digest
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._f.readinto(b)
+        if n:
+            self._digest.update(memoryview(b)[:n])
+        return n
+
+    def close(self) -> None:
+        self._f.close()
+        super().close()
+
+
+@contextmanager
+def _open_text(path: Path, digest=None) -> Iterator[TextIO]:
+    """
+    Open a file as text. With 'digest', its contents are fed into the hash as
+    they are read, including anything left after what the caller parsed.
+    """
+    if digest is None:
+        with open(path) as f:
+            yield f
+        return
+
+    with io.TextIOWrapper(io.BufferedReader(_HashingReader(open(path, 'rb'), digest))) as f:
+        yield f
+        f.buffer.read()
+
+
+def _hash_file(path: Path, digest) -> None:
+    """Feed a whole file into 'digest', for readers that don't read it in order."""
+    with open(path, 'rb') as f:
+        hashlib.file_digest(f, lambda: digest)
+
+
+def _read_file_timestamp(path: Path) -> datetime:
+    """Find the top-level 'timestamp', skipping over everything before it."""
+    with open(path) as f:
+        stream = _JSONStream(f)
+        for key in stream.object_keys():
+            if key == "timestamp":
+                return parse_timestamp(stream.value())
+            stream.skip_value()
+    raise KeyError("timestamp")
+
+
+def iter_json_chunks(path: Path, chunk_size: int, digest=None) -> Iterator[PredictionChunk]:
+    """
+    Yield the predictions in a JSON prediction file in chunks of at most
+    'chunk_size' rows. Memory use depends on the chunk size, not the file size.
+    The file is read once when "timestamp" comes before "predictions", as the
+    models write it; otherwise it is first scanned for the timestamp, skipping
+    over the predictions without decoding them.
+    """
+    prediction_timestamp = None
+    found_predictions = False
+
+    with _open_text(path, digest) as f:
+        stream = _JSONStream(f)
+        for key in stream.object_keys():
+            if key == "timestamp":
+                prediction_timestamp = parse_timestamp(stream.value())
+                continue
+            if key != "predictions":
+                stream.skip_value()
+                continue
+
+            found_predictions = True
+            if prediction_timestamp is None:
+                prediction_timestamp = _read_file_timestamp(path)
+            chunk = PredictionChunk(prediction_timestamp)
+            for prediction in stream.array_items():
+                chunk.append(prediction)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = PredictionChunk(prediction_timestamp)
+            if chunk:
+                yield chunk
+
+    if not found_predictions:
+        raise KeyError("predictions")
+
+
+def iter_ndjson_chunks(path: Path, chunk_size: int, digest=None) -> Iterator[PredictionChunk]:
+    """
+    Yield predictions from a line-delimited JSON file. Each line is either a
+    prediction, optionally carrying its own "timestamp", or a header line with
+    only a "timestamp" that applies to the predictions after it.
+    """
+    prediction_timestamp = None
+    chunk = None
+
+    with _open_text(path, digest) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+
+            timestamp = prediction_timestamp
+            if "timestamp" in record:
+                timestamp = parse_timestamp(record["timestamp"])
+            if "reservoir_id" not in record:
+                prediction_timestamp = timestamp
+                continue
+            if timestamp is None:
+                raise ValueError(f"{path.name}:{line_number}: prediction without a timestamp")
+
+            # A chunk shares one prediction timestamp
+            if chunk is not None and (len(chunk) >= chunk_size or chunk.prediction_timestamp != timestamp):
+                yield chunk
+                chunk = None
+            if chunk is None:
+                chunk = PredictionChunk(timestamp)
+            chunk.append(record)
+
+    if chunk:
+        yield chunk
+
+
+def _arrow_chunks(schema, batches: Iterable, chunk_size: int) -> Iterator[PredictionChunk]:
+    """
+    Turn Arrow record batches into chunks without going through Python objects
+    per row. The prediction timestamp comes from a "timestamp" entry in the
+    schema metadata, or else from a "timestamp" column.
+    """
+    import numpy as np
+
+    metadata = schema.metadata or {}
+    file_timestamp = None
+    if b"timestamp" in metadata:
+        file_timestamp = parse_timestamp(metadata[b"timestamp"].decode())
+    elif "timestamp" not in schema.names:
+        raise KeyError("timestamp")
+
+    def to_utc_strings(column):
+        # Render as ISO 8601 with an explicit UTC offset, vectorised
+        values = column.to_numpy(zero_copy_only=False).astype("datetime64[us]")
+        return np.datetime_as_string(values, unit="us", timezone="UTC")
+
+    for batch in batches:
+        for offset in range(0, batch.num_rows, chunk_size):
+            part = batch.slice(offset, chunk_size)
+            reservoir_ids = part.column("reservoir_id").to_numpy(zero_copy_only=False)
+            predicted_levels = part.column("predicted_level").to_numpy(zero_copy_only=False).astype("float64")
+            validation_times = to_utc_strings(part.column("validation_time"))
+
+            if file_timestamp is not None:
+                yield PredictionChunk(file_timestamp, reservoir_ids, predicted_levels, validation_times)
+                continue
+
+            # Split the slice on its distinct prediction timestamps
+            timestamps = part.column("timestamp").to_numpy(zero_copy_only=False).astype("datetime64[us]")
+            for value in np.unique(timestamps):
+                mask = timestamps == value
+                yield PredictionChunk(
+                    parse_timestamp(np.datetime_as_string(value, unit="us", timezone="UTC")),
+                    reservoir_ids[mask],
+                    predicted_levels[mask],
+                    validation_times[mask]
+                )
+
+
+def iter_parquet_chunks(path: Path, chunk_size: int, digest=None) -> Iterator[PredictionChunk]:
+    """Yield predictions from a Parquet file, one record batch at a time."""
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    schema = parquet_file.schema_arrow
+    columns = ["reservoir_id", "predicted_level", "validation_time"]
+    if "timestamp" in schema.names:
+        columns.append("timestamp")
+    yield from _arrow_chunks(schema, parquet_file.iter_batches(batch_size=chunk_size, columns=columns), chunk_size)
+    if digest is not None:
+        _hash_file(path, digest)
+
+
+def iter_arrow_chunks(path: Path, chunk_size: int, digest=None) -> Iterator[PredictionChunk]:
+    """Yield predictions from an Arrow IPC (Feather v2) file."""
+    import pyarrow as pa
+
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        yield from _arrow_chunks(reader.schema, batches, chunk_size)
+    if digest is not None:
+        _hash_file(path, digest)
+
+
+# A reader takes the path, the chunk size and an optional hashlib object to
+# feed the file's contents into
+ChunkReader = Callable[..., Iterator[PredictionChunk]]
+
+# Readers by file extension. The Arrow-based ones need the optional pyarrow
+# dependency, which is only imported when such a file shows up. pyarrow reads
+# at random offsets, so they hash the file afterwards, from the page cache.
+READERS: Dict[str, ChunkReader] = {
+    ".json": iter_json_chunks,
+    ".txt": iter_json_chunks,
+    ".ndjson": iter_ndjson_chunks,
+    ".jsonl": iter_ndjson_chunks,
+    ".parquet": iter_parquet_chunks,
+    ".arrow": iter_arrow_chunks,
+    ".feather": iter_arrow_chunks,
+}
+
+
+def register_reader(suffix: str, reader: ChunkReader) -> None:
+    """Add or replace the reader used for files with the given extension."""
+    READERS[suffix.lower()] = reader
+
+
+def iter_prediction_chunks(path: Path, chunk_size: int, digest=None) -> Iterator[PredictionChunk]:
+    """
+    Yield the predictions in a file in chunks of at most 'chunk_size' rows,
+    using the reader registered for its extension. Unknown extensions are read
+    as JSON. With 'digest', the file's contents are fed into that hashlib
+    object as well; it is complete once the chunks are exhausted.
+    """
+    reader = READERS.get(path.suffix.lower(), iter_json_chunks)
+    if digest is None:
+        return reader(path, chunk_size)
+    return reader(path, chunk_size, digest=digest)
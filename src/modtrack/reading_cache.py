@@ -0,0 +1,357 @@
+"""
+Shared cache of water-level readings.
+
+Many predictions for the same reservoir fall due together, and every worker
+would otherwise request the same reading. Readings are cached in Redis under
+the reservoir and a time bucket of READING_BUCKET_SECONDS, so all validations
+within a bucket share one reading. On a miss only one caller, whichever
+takes the bucket's lock, fetches from the API; concurrent callers on any
+worker wait for its result instead of sending their own request.
+
+Bulk lookups (get_many) read all cached readings with one MGET, take the
+locks of the missing ones in one pipeline and fetch those with one bulk call.
+Readings whose lock another caller holds are waited for, as in get_or_fetch.
+
+If Redis is unavailable the reading is fetched directly.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+import redis
+import redis.asyncio
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if it is still ours; it may have expired and been taken
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class ReadingCache:
+    KEY_PREFIX = "modtrack:reading"
+    POLL_INTERVAL = 0.02
+
+    def __init__(self, client: redis.Redis, ttl: float = None, bucket_seconds: int = None,
+                 lock_seconds: float = None, wait_seconds: float = None):
+        self.client = client
+        self.ttl = Config.READING_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.bucket_seconds = bucket_seconds or Config.READING_BUCKET_SECONDS
+        # How long a fetch may hold the lock, and how long others wait for it
+        self.lock_seconds = lock_seconds or Config.READING_LOCK_SECONDS
+        self.wait_seconds = Config.READING_WAIT_SECONDS if wait_seconds is None else wait_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str = None, **kwargs) -> "ReadingCache":
+        return cls(redis.Redis.from_url(url or Config.READING_CACHE_URL), **kwargs)
+
+    def key(self, reservoir_id: str, at: float = None) -> str:
+        bucket = int((time.time() if at is None else at) // self.bucket_seconds)
+        return f"{self.KEY_PREFIX}:{reservoir_id}:{bucket}"
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "errors": self.errors}
+
+    def get_or_fetch(self, reservoir_id: str, fetch: Callable[[], float]) -> float:
+        """Return the reservoir's reading for the current bucket, fetching it at most once."""
+        key = self.key(reservoir_id)
+        try:
+            return self._get_or_fetch(key, fetch)
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Reading cache unavailable, fetching {reservoir_id} directly: {e}")
+            return fetch()
+
+    def _get_or_fetch(self, key: str, fetch: Callable[[], float]) -> float:
+        lock_key = f"{key}:lock"
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+
+        while True:
+            value = self.client.get(key)
+            if value is not None:
+                if waited:
+                    self.coalesced += 1
+                else:
+                    self.hits += 1
+                return float(value)
+
+            token = uuid.uuid4().hex
+            if self.client.set(lock_key, token, nx=True, px=int(self.lock_seconds * 1000)):
+                self.misses += 1
+                try:
+                    value = fetch()
+                    self.client.set(key, value, px=int(self.ttl * 1000))
+                    return value
+                finally:
+                    self._release(lock_key, token)
+
+            # Someone else is fetching; if they take too long, fetch ourselves
+            if time.monotonic() >= deadline:
+                self.misses += 1
+                return fetch()
+            waited = True
+            time.sleep(self.POLL_INTERVAL)
+
+    def get_many(self, reservoir_ids: Iterable[str],
+                 fetch_many: Callable[[List[str]], Dict[str, float]]) -> Dict[str, float]:
+        """Readings for many reservoirs; fetch_many is only called with ones no one else is fetching."""
+        reservoir_ids = list(dict.fromkeys(reservoir_ids))
+        levels = {}
+        try:
+            self._get_many(reservoir_ids, fetch_many, levels)
+        except redis.RedisError as e:
+            self.errors += 1
+            rest = [r for r in reservoir_ids if r not in levels]
+            logger.warning(f"Reading cache unavailable, fetching {len(rest)} readings directly: {e}")
+            if rest:
+                levels.update(fetch_many(rest))
+        return levels
+
+    def _get_many(self, reservoir_ids: List[str], fetch_many: Callable[[List[str]], Dict[str, float]],
+                  levels: Dict[str, float]) -> None:
+        pending = dict(zip(reservoir_ids, self._keys(reservoir_ids)))
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+
+        while pending:
+            self._found(pending, self.client.mget(list(pending.values())), waited, levels)
+            if not pending:
+                return
+
+            token = uuid.uuid4().hex
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in pending.values():
+                    pipe.set(f"{key}:lock", token, nx=True, px=int(self.lock_seconds * 1000))
+                taken = pipe.execute()
+            ours = self._take(pending, taken)
+            if ours:
+                self.misses += len(ours)
+                try:
+                    fetched = fetch_many(list(ours))
+                    levels.update(fetched)
+                    self._store(ours, fetched)
+                finally:
+                    self._release_many(ours, token)
+
+            # Others are fetching the rest; if they take too long, fetch ourselves
+            if pending and time.monotonic() >= deadline:
+                self.misses += len(pending)
+                levels.update(fetch_many(list(pending)))
+                return
+            if pending:
+                waited = True
+                time.sleep(self.POLL_INTERVAL)
+
+    def _store(self, keys: Dict[str, str], fetched: Dict[str, float]) -> None:
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for reservoir_id, level in fetched.items():
+                    if reservoir_id in keys:
+                        pipe.set(keys[reservoir_id], level, px=int(self.ttl * 1000))
+                pipe.execute()
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Failed to cache {len(fetched)} readings: {e}")
+
+    def _release_many(self, keys: Dict[str, str], token: str) -> None:
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in keys.values():
+                    pipe.eval(_RELEASE_SCRIPT, 1, f"{key}:lock", token)
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to release {len(keys)} reading locks: {e}")
+
+    def _keys(self, reservoir_ids: List[str]) -> List[str]:
+        # One timestamp for all, so a batch never straddles two buckets
+        now = time.time()
+        return [self.key(reservoir_id, now) for reservoir_id in reservoir_ids]
+
+    def _found(self, pending: Dict[str, str], values: list, waited: bool, levels: Dict[str, float]) -> None:
+        """Move the readings that were in the cache from 'pending' to 'levels'."""
+        for reservoir_id, value in zip(list(pending), values):
+            if value is not None:
+                levels[reservoir_id] = float(value)
+                del pending[reservoir_id]
+                if waited:
+                    self.coalesced += 1
+                else:
+                    self.hits += 1
+
+    @staticmethod
+    def _take(pending: Dict[str, str], taken: list) -> Dict[str, str]:
+        """Remove and return the pending readings whose lock was taken."""
+        ours = {r: key for (r, key), got in zip(pending.items(), taken) if got}
+        for reservoir_id in ours:
+            del pending[reservoir_id]
+        return ours
+
+    def _release(self, lock_key: str, token: str) -> None:
+        try:
+            self.client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+        except redis.RedisError as e:
+            # The reading is already stored; the lock just expires on its own
+            logger.warning(f"Failed to release {lock_key}: {e}")
+
+
+class AsyncReadingCache(ReadingCache):
+    """ReadingCache for the asyncio engine, on redis.asyncio."""
+
+    def __init__(self, client: redis.asyncio.Redis, **kwargs):
+        super().__init__(client, **kwargs)
+        # Coroutines on this loop that want a key already being fetched here
+        # wait on the same future rather than polling Redis
+        self._inflight = {}
+
+    @classmethod
+    def from_url(cls, url: str = None, **kwargs) -> "AsyncReadingCache":
+        return cls(redis.asyncio.Redis.from_url(url or Config.READING_CACHE_URL), **kwargs)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def get_or_fetch(self, reservoir_id: str, fetch: Callable[[], Awaitable[float]]) -> float:
+        key = self.key(reservoir_id)
+        inflight: Optional[asyncio.Future] = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            try:
+                value = await self._get_or_fetch(key, fetch)
+            except redis.RedisError as e:
+                self.errors += 1
+                logger.warning(f"Reading cache unavailable, fetching {reservoir_id} directly: {e}")
+                value = await fetch()
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Don't warn about an exception nobody else retrieved
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[float]]) -> float:
+        lock_key = f"{key}:lock"
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+
+        while True:
+            value = await self.client.get(key)
+            if value is not None:
+                if waited:
+                    self.coalesced += 1
+                else:
+                    self.hits += 1
+                return float(value)
+
+            token = uuid.uuid4().hex
+            if await self.client.set(lock_key, token, nx=True, px=int(self.lock_seconds * 1000)):
+                self.misses += 1
+                try:
+                    value = await fetch()
+                    await self.client.set(key, value, px=int(self.ttl * 1000))
+                    return value
+                finally:
+                    await self._release(lock_key, token)
+
+            if time.monotonic() >= deadline:
+                self.misses += 1
+                return await fetch()
+            waited = True
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def _release(self, lock_key: str, token: str) -> None:
+        try:
+            await self.client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to release {lock_key}: {e}")
+
+    async def get_many(self, reservoir_ids: Iterable[str],
+                       fetch_many: Callable[[List[str]], Awaitable[Dict[str, float]]]) -> Dict[str, float]:
+        reservoir_ids = list(dict.fromkeys(reservoir_ids))
+        levels = {}
+        try:
+            await self._get_many(reservoir_ids, fetch_many, levels)
+        except redis.RedisError as e:
+            self.errors += 1
+            rest = [r for r in reservoir_ids if r not in levels]
+            logger.warning(f"Reading cache unavailable, fetching {len(rest)} readings directly: {e}")
+            if rest:
+                levels.update(await fetch_many(rest))
+        return levels
+
+    async def _get_many(self, reservoir_ids: List[str],
+                        fetch_many: Callable[[List[str]], Awaitable[Dict[str, float]]],
+                        levels: Dict[str, float]) -> None:
+        pending = dict(zip(reservoir_ids, self._keys(reservoir_ids)))
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+
+        while pending:
+            self._found(pending, await self.client.mget(list(pending.values())), waited, levels)
+            if not pending:
+                return
+
+            token = uuid.uuid4().hex
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key in pending.values():
+                    pipe.set(f"{key}:lock", token, nx=True, px=int(self.lock_seconds * 1000))
+                taken = await pipe.execute()
+            ours = self._take(pending, taken)
+            if ours:
+                self.misses += len(ours)
+                try:
+                    fetched = await fetch_many(list(ours))
+                    levels.update(fetched)
+                    await self._store(ours, fetched)
+                finally:
+                    await self._release_many(ours, token)
+
+            if pending and time.monotonic() >= deadline:
+                self.misses += len(pending)
+                levels.update(await fetch_many(list(pending)))
+                return
+            if pending:
+                waited = True
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def _store(self, keys: Dict[str, str], fetched: Dict[str, float]) -> None:
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for reservoir_id, level in fetched.items():
+                    if reservoir_id in keys:
+                        pipe.set(keys[reservoir_id], level, px=int(self.ttl * 1000))
+                await pipe.execute()
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Failed to cache {len(fetched)} readings: {e}")
+
+    async def _release_many(self, keys: Dict[str, str], token: str) -> None:
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key in keys.values():
+                    pipe.eval(_RELEASE_SCRIPT, 1, f"{key}:lock", token)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to release {len(keys)} reading locks: {e}")
@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import httpx
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from .aws_utils import SecretsManager
+from .config import Config
+from .db import is_auth_failure
+from .reading_cache import ReadingCache
+from .upstream import MetricsPublisher, UpstreamClient
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerResources:
+    """
+    Connections and clients that live as long as a worker process: the
+    secrets, a Postgres connection pool and one keep-alive HTTP client for the
+    water-level API. Tasks borrow from these instead of setting up their own.
+    """
+
+    def __init__(self, db_secrets: Optional[dict] = None, api_secrets: Optional[dict] = None):
+        # Secrets can be passed in directly (e.g. by the benchmarks)
+        self.secrets = SecretsManager()
+        self.db_secrets = db_secrets or self.secrets.get_secret(Config.DB_SECRET_NAME)
+        self.api_secrets = api_secrets or self.secrets.get_secret(Config.API_SECRET_NAME)
+
+        self.db_pool = self._open_pool()
+        # When each pooled connection was last known to be alive
+        self._last_checked = {}
+        self._pool_lock = threading.Lock()
+
+        self.http = httpx.Client(
+            base_url=self.api_secrets['api_url'],
+            headers={"Authorization": f"Bearer {self.api_secrets['api_key']}"},
+            http2=True,
+            timeout=Config.HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=Config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=30.0
+            )
+        )
+        # Retries, adaptive concurrency and circuit breaking for the API
+        self.api = UpstreamClient(self.http, publisher=MetricsPublisher.from_url())
+        self.reading_cache = ReadingCache.from_url() if Config.READING_CACHE_ENABLED else None
+
+    def _open_pool(self) -> ThreadedConnectionPool:
+        def open_pool():
+            return ThreadedConnectionPool(
+                Config.DB_POOL_MIN,
+                Config.DB_POOL_MAX,
+                dbname=self.db_secrets['dbname'],
+                user=self.db_secrets['username'],
+                password=self.db_secrets['password'],
+                host=self.db_secrets['host'],
+                port=self.db_secrets['port']
+            )
+
+        try:
+            return open_pool()
+        except psycopg2.OperationalError as e:
+            if not is_auth_failure(e):
+                raise
+            self._refresh_db_secrets()
+            return open_pool()
+
+    def _refresh_db_secrets(self) -> None:
+        logger.warning("Database credentials rejected; refreshing the secret")
+        self.db_secrets = self.secrets.get_secret(Config.DB_SECRET_NAME, force_refresh=True)
+
+    def _getconn(self):
+        """Take a connection from the pool, rebuilding it if the password was rotated."""
+        pool = self.db_pool
+        try:
+            return pool, pool.getconn()
+        except psycopg2.OperationalError as e:
+            if not is_auth_failure(e):
+                raise
+            with self._pool_lock:
+                if self.db_pool is pool:
+                    self._refresh_db_secrets()
+                    self.db_pool = self._open_pool()
+                    # Connections still checked out go back to the old pool
+                    # and are closed there
+                    pool.closeall()
+            pool = self.db_pool
+            return pool, pool.getconn()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection. Connections idle for longer than
+        DB_HEALTH_CHECK_SECONDS are pinged first and replaced if dead. The
+        transaction is rolled back if the caller raises without committing.
+        """
+        pool, conn = self._checkout()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn.closed or pool.closed:
+                self._last_checked.pop(id(conn), None)
+            else:
+                self._last_checked[id(conn)] = time.monotonic()
+            if pool.closed:
+                conn.close()
+            else:
+                pool.putconn(conn, close=bool(conn.closed))
+
+    def _checkout(self):
+        pool, conn = self._getconn()
+        last_checked = self._last_checked.get(id(conn), 0)
+        if time.monotonic() - last_checked < Config.DB_HEALTH_CHECK_SECONDS and not conn.closed:
+            return pool, conn
+
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connection already closed")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return pool, conn
+        except psycopg2.Error as e:
+            logger.warning(f"Replacing dead pooled connection: {e}")
+            self._last_checked.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            return self._getconn()
+
+    def get_water_level(self, reservoir_id: str) -> float:
+        if self.reading_cache is None:
+            return self._fetch_water_level(reservoir_id)
+        return self.reading_cache.get_or_fetch(reservoir_id, lambda: self._fetch_water_level(reservoir_id))
+
+    def _fetch_water_level(self, reservoir_id: str) -> float:
+        response = self.api.request("GET", f"/water-level/{reservoir_id}")
+        return response.json()["water_level"]
+
+    def get_water_levels(self, reservoir_ids: List[str]) -> Dict[str, float]:
+        """Levels for many reservoirs; unknown reservoirs are left out."""
+        if self.reading_cache is None:
+            return self._fetch_water_levels(reservoir_ids)
+        return self.reading_cache.get_many(reservoir_ids, self._fetch_water_levels)
+
+    def _fetch_water_levels(self, reservoir_ids: List[str]) -> Dict[str, float]:
+        levels = {}
+        batch_size = Config.WATER_LEVEL_BATCH_SIZE
+        for start in range(0, len(reservoir_ids), batch_size):
+            response = self.api.request(
+                "POST", "/water-levels", json={"reservoir_ids": reservoir_ids[start:start + batch_size]}
+            )
+            levels.update({r["reservoir_id"]: r["water_level"] for r in response.json()["readings"]})
+        return levels
+
+    def close(self):
+        self.http.close()
+        self.db_pool.closeall()
+        if self.reading_cache is not None:
+            self.reading_cache.client.close()
+
+
+_resources: Optional[WorkerResources] = None
+_resources_lock = threading.Lock()
+
+
+def get_worker_resources() -> WorkerResources:
+    """The resources of the current process, created on first use."""
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                _resources = WorkerResources()
+                logger.info("Initialized worker resources")
+    return _resources
+
+
+def close_worker_resources() -> None:
+    global _resources
+    with _resources_lock:
+        if _resources is not None:
+            _resources.close()
+            _resources = None
+            logger.info("Closed worker resources")
@@ -0,0 +1,173 @@
+"""
+Accuracy rollups for the dashboard.
+
+accuracy_rollups holds, per reservoir and UTC day of prediction_timestamp,
+the number of predictions and of validations, and the sum, min, max and sum
+of squares of their differences. Statement-level triggers on predictions and
+validations (installed by migration 5) add each inserted batch to its
+buckets, so the dashboard's all-time stats read a few rows per reservoir
+and day instead of joining the full tables.
+
+Deletes are not tracked. Partitions dropped for retention don't fire
+triggers either, so partition maintenance recomputes the buckets a dropped
+partition's rows were counted in (see refresh_partition_buckets). To
+recompute every bucket from the tables as they are:
+
+    python -m modtrack.rollups rebuild
+"""
+import argparse
+import logging
+import psycopg2
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+_BUCKET = "date_trunc('day', p.prediction_timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+
+# Totals of the buckets the rows matching {where} fall in
+_BUCKETS_INSERT = f"""
+    INSERT INTO accuracy_rollups
+        (reservoir_id, bucket_start, prediction_count, validated_count,
+         difference_sum, difference_min, difference_max, difference_sumsq)
+    SELECT
+        p.reservoir_id,
+        {_BUCKET},
+        COUNT(DISTINCT p.id),
+        COUNT(v.prediction_id),
+        COALESCE(SUM(v.difference), 0),
+        MIN(v.difference),
+        MAX(v.difference),
+        COALESCE(SUM(v.difference * v.difference), 0)
+    FROM predictions p
+    LEFT JOIN validations v ON v.prediction_id = p.id
+    {{where}}
+    GROUP BY 1, 2;
+"""
+
+# Recomputes every bucket; TRUNCATE's lock holds back concurrent trigger
+# updates until the new totals are committed, so none are lost or counted twice
+REBUILD_SQL = "TRUNCATE accuracy_rollups;" + _BUCKETS_INSERT.format(where="")
+
+# Buckets the rows of a predictions or validations partition are counted in
+_PARTITION_BUCKETS = {
+    "predictions": f"SELECT DISTINCT p.reservoir_id, {_BUCKET} AS bucket_start FROM {{partition}} p",
+    "validations": (
+        f"SELECT DISTINCT p.reservoir_id, {_BUCKET} AS bucket_start "
+        f"FROM {{partition}} v JOIN predictions p ON p.id = v.prediction_id"
+    ),
+}
+
+
+def rebuild(conn: psycopg2.extensions.connection) -> int:
+    """Recompute all rollups from predictions and validations; returns the number of buckets."""
+    with conn.cursor() as cur:
+        cur.execute(REBUILD_SQL)
+        cur.execute("SELECT COUNT(*) FROM accuracy_rollups")
+        buckets = cur.fetchone()[0]
+    conn.commit()
+    logger.info(f"Rebuilt {buckets} accuracy rollup buckets")
+    return buckets
+
+
+OVERALL_STATS_SQL = """
+    SELECT
+        COALESCE(SUM(prediction_count), 0)::bigint AS total_predictions,
+        COALESCE(SUM(validated_count), 0)::bigint AS validated_count,
+        SUM(difference_sum) AS difference_sum,
+        SUM(difference_sumsq) AS difference_sumsq,
+        MAX(difference_max) AS max_difference,
+        MIN(difference_min) AS min_difference
+    FROM accuracy_rollups
+"""
+
+RESERVOIR_STATS_SQL = """
+    SELECT
+        reservoir_id,
+        SUM(prediction_count)::bigint AS prediction_count,
+        SUM(validated_count)::bigint AS validated_count,
+        SUM(difference_sum) AS difference_sum,
+        SUM(difference_sumsq) AS difference_sumsq,
+        MAX(difference_max) AS max_difference,
+        MIN(difference_min) AS min_difference
+    FROM accuracy_rollups
+    GROUP BY reservoir_id
+    ORDER BY reservoir_id
+"""
+
+
+def stage_partition_buckets(cur, table: str, partition: str) -> None:
+    """
+    Note the buckets a partition of 'table' contributes to, before it is
+    dropped; refresh_partition_buckets() recomputes them afterwards, in the
+    same transaction.
+    """
+    cur.execute(
+        "CREATE TEMP TABLE rollup_refresh ON COMMIT DROP AS "
+        + _PARTITION_BUCKETS[table].format(partition=partition)
+    )
+
+
+def refresh_partition_buckets(cur) -> int:
+    """Recompute the staged buckets from the remaining rows; returns how many were staged."""
+    # Like TRUNCATE in a rebuild: holds back trigger updates until commit
+    cur.execute("LOCK TABLE accuracy_rollups IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute(
+        """
+        DELETE FROM accuracy_rollups r USING rollup_refresh s
+        WHERE r.reservoir_id = s.reservoir_id AND r.bucket_start = s.bucket_start
+        """
+    )
+    cur.execute(_BUCKETS_INSERT.format(where=f"""
+        WHERE (p.reservoir_id, {_BUCKET}) IN (SELECT reservoir_id, bucket_start FROM rollup_refresh)
+          -- Lets the scan use the timestamp index and skip other partitions
+          AND p.prediction_timestamp >= (SELECT MIN(bucket_start) FROM rollup_refresh)
+          AND p.prediction_timestamp < (SELECT MAX(bucket_start) FROM rollup_refresh) + INTERVAL '1 day'
+    """))
+    cur.execute("SELECT COUNT(*) FROM rollup_refresh")
+    staged = cur.fetchone()[0]
+    cur.execute("DROP TABLE rollup_refresh")
+    return staged
+
+
+def summarize(row: dict) -> dict:
+    """Add mean and standard deviation of the differences, from their sums."""
+    count = row["validated_count"]
+    if count:
+        mean = float(row["difference_sum"]) / count
+        variance = max(float(row["difference_sumsq"]) / count - mean * mean, 0.0)
+        row["avg_difference"] = round(mean, 2)
+        row["stddev_difference"] = round(variance ** 0.5, 2)
+    else:
+        row["avg_difference"] = None
+        row["stddev_difference"] = None
+    for key in ("max_difference", "min_difference"):
+        if row[key] is not None:
+            row[key] = round(float(row[key]), 2)
+    del row["difference_sum"], row["difference_sumsq"]
+    return row
+
+
+def main():
+    from .aws_utils import SecretsManager
+
+    parser = argparse.ArgumentParser(description="Maintain the dashboard's accuracy rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    secrets = SecretsManager().get_secret(Config.DB_SECRET_NAME)
+    conn = psycopg2.connect(
+        dbname=secrets['dbname'],
+        user=secrets['username'],
+        password=secrets['password'],
+        host=secrets['host'],
+        port=secrets['port']
+    )
+    try:
+        rebuild(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import fnmatch
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class IncrementalScanner:
+    """
+    Finds candidate files for the periodic scan without re-examining the whole
+    directory tree every time.
+
+    For every directory it remembers the directory's mtime and a cursor: the
+    highest name matching 'cursor_pattern' seen so far. A directory whose
+    mtime hasn't changed is skipped entirely, and in a changed directory only
+    matching names sorting after the cursor are returned, so prediction files
+    need to be named in increasing order (e.g. prediction_001, prediction_002
+    or timestamped names). Other files in a changed directory (e.g.
+    results.txt) are always returned and never move the cursor, so a name
+    sorting after every prediction file can't hide the ones that follow.
+
+    Anything the cursor could miss, such as a late file with a lower name or a
+    file rewritten in place, is picked up by the watchdog observer or by the
+    full rescan that runs every 'full_scan_every' scans.
+    """
+
+    def __init__(self, root: Path, recursive: bool = False, full_scan_every: int = 60,
+                 cursor_pattern: str = "prediction_*"):
+        self.root = root
+        self.recursive = recursive
+        self.cursor_pattern = cursor_pattern
+        self.full_scan_every = max(full_scan_every, 1)
+        self.logger = logging.getLogger(__name__)
+
+        self._scans = 0
+        self._dir_mtimes: Dict[str, int] = {}
+        self._cursors: Dict[str, Optional[str]] = {}
+        self._subdirs: Dict[str, List[str]] = {}
+
+    def candidates(self) -> List[Path]:
+        """Return the files that are new since the previous scan."""
+        full = self._scans % self.full_scan_every == 0
+        self._scans += 1
+
+        found = []
+        self._scan(str(self.root), full, found)
+        if full:
+            self.logger.info(f"Full scan found {len(found)} files")
+        return found
+
+    def _scan(self, directory: str, full: bool, found: List[Path]) -> None:
+        # Stat before listing: a file created after this point bumps the mtime
+        # again, so the next scan will look at the directory
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            self._forget(directory)
+            return
+
+        if not full and self._dir_mtimes.get(directory) == mtime:
+            # Unchanged, but files may still have landed in its subdirectories
+            for subdir in self._subdirs.get(directory, []):
+                self._scan(subdir, full, found)
+            return
+
+        cursor = None if full else self._cursors.get(directory)
+        newest = cursor
+        subdirs = []
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive:
+                        subdirs.append(entry.path)
+                    continue
+                ordered = fnmatch.fnmatchcase(entry.name, self.cursor_pattern)
+                if ordered and cursor is not None and entry.name <= cursor:
+                    continue
+                if entry.is_file():
+                    found.append(Path(entry.path))
+                    if ordered and (newest is None or entry.name > newest):
+                        newest = entry.name
+
+        self._dir_mtimes[directory] = mtime
+        self._cursors[directory] = newest
+        self._subdirs[directory] = sorted(subdirs)
+
+        for subdir in self._subdirs[directory]:
+            self._scan(subdir, full, found)
+
+    def _forget(self, directory: str) -> None:
+        self._dir_mtimes.pop(directory, None)
+        self._cursors.pop(directory, None)
+        for subdir in self._subdirs.pop(directory, []):
+            self._forget(subdir)
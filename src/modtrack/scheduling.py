@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Iterator, List
+import psycopg2
+from .celery_app import validate_prediction_task, validate_predictions_async_task, validate_reservoirs_task
+from .config import Config
+from .db import claim_due_predictions
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch_validations(rows: List[tuple], mode: str = None) -> int:
+    """
+    Enqueue validation tasks for due (id, reservoir_id, predicted_level,
+    validation_time) rows, shaped by VALIDATION_MODE. Returns the number of
+    tasks sent.
+    """
+    mode = mode or Config.VALIDATION_MODE
+    if mode == "single":
+        for prediction_id, reservoir_id, predicted_level, _ in rows:
+            validate_prediction_task.delay(str(prediction_id), reservoir_id, float(predicted_level))
+        return len(rows)
+
+    by_reservoir = defaultdict(list)
+    for prediction_id, reservoir_id, predicted_level, _ in rows:
+        by_reservoir[reservoir_id].append([str(prediction_id), float(predicted_level)])
+
+    if mode == "batch":
+        task = validate_reservoirs_task
+    elif mode == "async":
+        task = validate_predictions_async_task
+    else:
+        raise ValueError(f"Unknown validation mode: {mode}")
+
+    sent = 0
+    for groups in _pack(by_reservoir, Config.VALIDATION_BATCH_MAX):
+        task.delay(groups)
+        sent += 1
+    return sent
+
+
+def _pack(by_reservoir: dict, batch_max: int) -> Iterator[list]:
+    """
+    Pack per-reservoir prediction lists into [[reservoir_id, predictions], ...]
+    groups of at most 'batch_max' predictions in total, so one task covers
+    many reservoirs and their levels can be fetched in bulk.
+    """
+    groups, size = [], 0
+    for reservoir_id, predictions in by_reservoir.items():
+        for start in range(0, len(predictions), batch_max):
+            chunk = predictions[start:start + batch_max]
+            if size + len(chunk) > batch_max and groups:
+                yield groups
+                groups, size = [], 0
+            groups.append([reservoir_id, chunk])
+            size += len(chunk)
+    if groups:
+        yield groups
+
+
+class DueValidationScheduler:
+    """
+    Polls Postgres for predictions whose validation_time has passed and
+    dispatches them to Celery as they fall due, instead of parking countdown
+    tasks in the workers. Rows are claimed in batches with FOR UPDATE SKIP
+    LOCKED, so several monitors can run side by side, and memory stays bounded
+    by 'batch_size' however many predictions are pending.
+    """
+
+    def __init__(self, connect: Callable, batch_size: int = None, poll_interval: float = None):
+        self.connect = connect
+        self.batch_size = batch_size or Config.DUE_BATCH_SIZE
+        self.poll_interval = Config.DUE_POLL_SECONDS if poll_interval is None else poll_interval
+
+        self._conn = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.dispatched = 0
+        self.tasks_sent = 0
+        # Seconds between validation_time and dispatch for the last claimed row
+        self.last_lag = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="due-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._conn is not None:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "dispatched": self.dispatched,
+            "tasks_sent": self.tasks_sent,
+            "last_lag_s": round(self.last_lag, 1) if self.last_lag is not None else None,
+        }
+
+    def run_once(self) -> int:
+        """Claim and dispatch one batch; returns the number of predictions claimed."""
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connect()
+        conn = self._conn
+
+        try:
+            with conn.cursor() as cur:
+                rows = claim_due_predictions(cur, self.batch_size)
+            if rows:
+                # Commit only after the tasks are sent: if the broker is down the
+                # claim is rolled back and the rows are picked up again
+                self.tasks_sent += dispatch_validations(rows)
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+            raise
+
+        if rows:
+            self.dispatched += len(rows)
+            self.last_lag = (datetime.now(timezone.utc) - rows[-1][3]).total_seconds()
+            logger.info(f"Dispatched {len(rows)} due predictions (lag {self.last_lag:.1f}s)")
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                claimed = self.run_once()
+            except psycopg2.Error as e:
+                logger.error(f"Database error dispatching due predictions: {e}")
+                if self._conn is not None and self._conn.closed:
+                    self._conn = None
+                claimed = 0
+            except Exception as e:
+                logger.error(f"Error dispatching due predictions: {e}")
+                claimed = 0
+
+            # Keep draining while there is a backlog, otherwise wait for the next poll
+            if claimed < self.batch_size:
+                self._stop.wait(max(self.poll_interval - (time.monotonic() - started), 0))
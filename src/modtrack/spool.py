@@ -0,0 +1,367 @@
+"""
+Local write-ahead spool for ingestion during database outages.
+
+When Postgres can't be reached, a file's prediction rows are appended to a
+spool on local disk instead, and the file counts as handled. The
+SpoolReplayer drains the spool into Postgres in large batches once the
+database is back, recording each file in the ingestion ledger with its rows.
+
+The spool is a directory of numbered, append-only segment files. Every
+record is framed with its length and a CRC32 of its payload:
+
+    <u32 length> <u32 crc32> <payload: JSON>
+
+A record is either a chunk of rows for a file or the marker that the file
+is complete. A torn record at the end of a segment (a crash mid-write) ends
+that segment; after a restart, appends go to a new segment. A checksum
+mismatch means the rest of the segment can't be framed; the segment is set
+aside with a .corrupt suffix, and its files are ingested again from disk on
+a later scan. A batch that Postgres rejects (bad data rather than a lost
+connection) sets the rest of its segment aside the same way, with a .failed
+suffix, so replay moves on to later segments. Replay progress is
+checkpointed, and segments are deleted once fully replayed. Prediction ids
+are deterministic, so rows replayed twice after a crash are skipped.
+"""
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+import psycopg2
+from .config import Config
+from .db import insert_predictions
+from .ledger import FileKey, claim_file
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<II")
+_SUFFIX = ".seg"
+
+
+class CorruptSegment(Exception):
+    pass
+
+
+def _segment_name(seq: int) -> str:
+    return f"{seq:012d}{_SUFFIX}"
+
+
+def read_records(path: Path, offset: int = 0) -> Iterator[Tuple[int, dict]]:
+    """
+    Yield (end offset, record) for each complete record from 'offset' on.
+    Stops quietly at a torn tail; raises CorruptSegment on a bad checksum.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, crc = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if zlib.crc32(payload) != crc:
+                raise CorruptSegment(f"Checksum mismatch in {path.name} at offset {offset}")
+            offset += _HEADER.size + length
+            yield offset, json.loads(payload)
+
+
+def on_mounted_volume(path: Path) -> bool:
+    """Whether 'path' is on a different filesystem than /, e.g. a Docker volume."""
+    return os.stat(path).st_dev != os.stat("/").st_dev
+
+
+def _frame(record: dict) -> bytes:
+    payload = json.dumps(record, default=str).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class Spool:
+    """
+    Append side of the spool. Thread-safe: each file is first written to a
+    private .part file, and only appended to the active segment once it has
+    been read in full, so a file that fails to parse leaves nothing behind
+    and a file's records are never interleaved with another's.
+    """
+
+    def __init__(self, directory: Path = None, segment_bytes: int = None, fsync: bool = None,
+                 retry_seconds: float = None):
+        self.directory = Path(directory or Config.SPOOL_DIR).resolve()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not on_mounted_volume(self.directory):
+            logger.warning(
+                f"Spool directory {self.directory} is not on a mounted volume; spooled files "
+                f"are lost if the container is recreated during a database outage"
+            )
+        self.segment_bytes = segment_bytes or Config.SPOOL_SEGMENT_BYTES
+        self.fsync = Config.SPOOL_FSYNC if fsync is None else fsync
+        # After a database failure, spool straight away for this long rather
+        # than waiting on connection timeouts for every file
+        self.retry_seconds = Config.SPOOL_RETRY_SECONDS if retry_seconds is None else retry_seconds
+
+        # Left over from a crash while spooling a file; it was never appended
+        for part in self.directory.glob("*.part"):
+            part.unlink()
+
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_seq = max((seq for seq, _ in self._segments()), default=0) + 1
+        self._down_until = 0.0
+
+        self.spooled_files = 0
+        self.spooled_rows = 0
+
+    def _segments(self) -> List[Tuple[int, Path]]:
+        segments = []
+        for path in self.directory.glob(f"*{_SUFFIX}"):
+            try:
+                segments.append((int(path.stem), path))
+            except ValueError:
+                continue
+        return sorted(segments)
+
+    def sealed_segments(self) -> List[Path]:
+        """Segments no longer written to, oldest first."""
+        with self._lock:
+            return [path for seq, path in self._segments() if seq < self._active_seq]
+
+    def seal(self) -> None:
+        """Close the active segment, so the replayer can take it."""
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+                self._active_seq += 1
+
+    def backlog_bytes(self) -> int:
+        return sum(path.stat().st_size for _, path in self._segments())
+
+    def mark_db_down(self) -> None:
+        self._down_until = time.monotonic() + self.retry_seconds
+
+    def mark_db_up(self) -> None:
+        self._down_until = 0.0
+
+    def db_down(self) -> bool:
+        return time.monotonic() < self._down_until
+
+    def append_file(self, file_name: str, key: FileKey, digest, chunks: Iterator[list]) -> int:
+        """
+        Spool a file's rows (PREDICTION_COLUMNS order, JSON-serializable
+        after str() of timestamps), then the marker that it is complete.
+        'digest' is the file's content hash, or a hashlib object that is
+        complete once 'chunks' is exhausted. Returns the number of rows spooled.
+        """
+        rows_spooled = 0
+        part = self.directory / f"{uuid.uuid4().hex}.part"
+        try:
+            with open(part, "wb") as f:
+                for rows in chunks:
+                    f.write(_frame({"type": "rows", "file": file_name, "rows": rows}))
+                    rows_spooled += len(rows)
+                if not isinstance(digest, str):
+                    digest = digest.hexdigest()
+                f.write(_frame({"type": "file", "file": file_name, "key": list(key), "digest": digest}))
+
+            with self._lock, open(part, "rb") as f:
+                if self._active is None:
+                    self._active = open(self.directory / _segment_name(self._active_seq), "ab")
+                shutil.copyfileobj(f, self._active)
+                self._active.flush()
+                if self.fsync:
+                    os.fsync(self._active.fileno())
+                if self._active.tell() >= self.segment_bytes:
+                    self._active.close()
+                    self._active = None
+                    self._active_seq += 1
+        finally:
+            part.unlink(missing_ok=True)
+
+        self.spooled_files += 1
+        self.spooled_rows += rows_spooled
+        return rows_spooled
+
+    def close(self) -> None:
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+
+
+class SpoolReplayer:
+    """
+    Drains sealed spool segments into Postgres: rows are gathered into
+    batches of 'batch_rows' and each batch, with the ledger entries of the
+    files it completes, is one transaction.
+    """
+
+    CHECKPOINT = "checkpoint.json"
+
+    def __init__(self, spool: Spool, connect: Callable, batch_rows: int = None, poll_interval: float = None):
+        self.spool = spool
+        self.connect = connect
+        self.batch_rows = batch_rows or Config.SPOOL_REPLAY_BATCH_ROWS
+        self.poll_interval = Config.SPOOL_POLL_SECONDS if poll_interval is None else poll_interval
+
+        self._conn = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.replayed_rows = 0
+        self.replayed_files = 0
+        self.replayed_segments = 0
+        self.set_aside_segments = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._conn is not None:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "replayed_rows": self.replayed_rows,
+            "replayed_files": self.replayed_files,
+            "replayed_segments": self.replayed_segments,
+            "set_aside_segments": self.set_aside_segments,
+            "backlog_bytes": self.spool.backlog_bytes(),
+            "db_down": self.spool.db_down(),
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.drain()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logger.warning(f"Database unavailable for spool replay: {e}")
+                self.spool.mark_db_down()
+                if self._conn is not None and self._conn.closed:
+                    self._conn = None
+            except Exception as e:
+                logger.error(f"Error replaying spool: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def drain(self) -> int:
+        """Replay every record spooled so far; returns the number of rows inserted."""
+        self.spool.seal()
+        segments = self.spool.sealed_segments()
+        if not segments:
+            return 0
+
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connect()
+        started = time.perf_counter()
+        inserted = 0
+        for path in segments:
+            if self._stop.is_set():
+                break
+            inserted += self._replay_segment(path)
+        self.spool.mark_db_up()
+
+        if inserted:
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Replayed {inserted} spooled rows in {elapsed:.3f}s "
+                f"({inserted / elapsed if elapsed > 0 else 0:.0f} rows/s)"
+            )
+        return inserted
+
+    def _replay_segment(self, path: Path) -> int:
+        checkpoint = self._load_checkpoint()
+        offset = checkpoint[1] if checkpoint and checkpoint[0] == path.name else 0
+
+        rows, files, inserted = [], [], 0
+        try:
+            try:
+                for end, record in read_records(path, offset):
+                    if record["type"] == "rows":
+                        rows.extend(record["rows"])
+                    else:
+                        files.append(record)
+                    if len(rows) >= self.batch_rows:
+                        inserted += self._flush(rows, files)
+                        self._save_checkpoint(path.name, end)
+                        rows, files = [], []
+            except CorruptSegment as e:
+                logger.error(f"{e}; setting the rest of the segment aside")
+                inserted += self._flush(rows, files)
+                self._set_aside(path, ".corrupt")
+                return inserted
+
+            inserted += self._flush(rows, files)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            # Retrying won't help; its files are ingested again from disk
+            logger.error(f"Postgres rejected spooled rows from {path.name}: {e}; setting the rest aside")
+            self._set_aside(path, ".failed")
+            return inserted
+
+        path.unlink()
+        self._clear_checkpoint()
+        self.replayed_segments += 1
+        return inserted
+
+    def _set_aside(self, path: Path, suffix: str) -> None:
+        path.rename(path.with_name(path.name + suffix))
+        self._clear_checkpoint()
+        self.set_aside_segments += 1
+
+    def _flush(self, rows: list, files: list) -> int:
+        if not rows and not files:
+            return 0
+        conn = self._conn
+        try:
+            with conn.cursor() as cur:
+                inserted = insert_predictions(cur, rows, "copy", self.batch_rows) if rows else 0
+                for record in files:
+                    # Already claimed if it was ingested directly meanwhile
+                    claim_file(cur, tuple(record["key"]), record["digest"])
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+            raise
+        self.replayed_rows += inserted
+        self.replayed_files += len(files)
+        return inserted
+
+    def _checkpoint_path(self) -> Path:
+        return self.spool.directory / self.CHECKPOINT
+
+    def _load_checkpoint(self) -> Optional[Tuple[str, int]]:
+        try:
+            with open(self._checkpoint_path()) as f:
+                data = json.load(f)
+            return data["segment"], data["offset"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _save_checkpoint(self, segment: str, offset: int) -> None:
+        # Write then rename, so a crash leaves the old checkpoint or the new one
+        tmp = self._checkpoint_path().with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint_path())
+
+    def _clear_checkpoint(self) -> None:
+        try:
+            self._checkpoint_path().unlink()
+        except FileNotFoundError:
+            pass
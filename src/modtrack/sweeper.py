@@ -0,0 +1,141 @@
+import logging
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+import psycopg2
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class StaleSweeper:
+    """
+    Finds predictions that were dispatched for validation but never validated,
+    and sends them round again.
+
+    Each run walks the pending predictions in bounded chunks, keyset-paginated
+    on (validation_time, id) through a partial index that only covers rows
+    with validation_status 'pending'. Per chunk, in one short transaction:
+
+    - rows that have a validation are marked 'validated', so no sweep looks
+      at them again;
+    - rows dispatched more than 'stale_seconds' ago are re-queued by clearing
+      dispatched_at, which hands them back to the DueValidationScheduler;
+    - rows that have been dispatched 'max_attempts' times are marked 'failed'.
+
+    A run stops after 'max_chunks' chunks and the next one continues from
+    where it left off, so no run holds locks or scans for long.
+    """
+
+    def __init__(self, connect: Callable, chunk_size: int = None, max_chunks: int = None,
+                 stale_seconds: float = None, max_attempts: int = None):
+        self.connect = connect
+        self.chunk_size = chunk_size or Config.SWEEP_CHUNK_SIZE
+        self.max_chunks = max_chunks or Config.SWEEP_MAX_CHUNKS
+        self.stale_seconds = Config.SWEEP_STALE_SECONDS if stale_seconds is None else stale_seconds
+        self.max_attempts = max_attempts or Config.SWEEP_MAX_ATTEMPTS
+
+        self._conn = None
+        # Last (validation_time, id) swept; None starts from the oldest row
+        self._cursor: Optional[Tuple[datetime, str]] = None
+
+        self.totals = {"validated": 0, "requeued": 0, "failed": 0}
+
+    def run(self) -> dict:
+        """Sweep up to max_chunks chunks; returns the counts for this run."""
+        counts = {"validated": 0, "requeued": 0, "failed": 0}
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = self.connect()
+            for _ in range(self.max_chunks):
+                done = self._sweep_chunk(counts)
+                if done:
+                    # Reached the newest stale row; start over next time
+                    self._cursor = None
+                    break
+        except psycopg2.Error as e:
+            logger.error(f"Database error sweeping stale predictions: {e}")
+            try:
+                self._conn.rollback()
+            except (psycopg2.Error, AttributeError):
+                self._conn = None
+
+        for name, count in counts.items():
+            self.totals[name] += count
+        if any(counts.values()):
+            logger.info(
+                f"Stale sweep: {counts['validated']} marked validated, "
+                f"{counts['requeued']} re-queued, {counts['failed']} marked failed"
+            )
+        return counts
+
+    def _sweep_chunk(self, counts: dict) -> bool:
+        """Sweep one chunk; returns True once there is nothing left after it."""
+        conn = self._conn
+        with conn.cursor() as cur:
+            after_time, after_id = self._cursor or ("-infinity", "00000000-0000-0000-0000-000000000000")
+            cur.execute(
+                """
+                SELECT p.id, p.validation_time, p.validation_attempts,
+                       p.dispatched_at IS NOT NULL
+                           AND p.dispatched_at < now() - make_interval(secs => %(stale)s) AS stale,
+                       EXISTS (SELECT 1 FROM validations v WHERE v.prediction_id = p.id) AS validated
+                FROM predictions p
+                WHERE p.validation_status = 'pending'
+                  AND p.validation_time < now() - make_interval(secs => %(stale)s)
+                  AND (p.validation_time, p.id) > (%(after_time)s, %(after_id)s)
+                ORDER BY p.validation_time, p.id
+                LIMIT %(limit)s
+                FOR UPDATE OF p SKIP LOCKED
+                """,
+                {
+                    "stale": self.stale_seconds,
+                    "after_time": after_time,
+                    "after_id": after_id,
+                    "limit": self.chunk_size,
+                }
+            )
+            rows = cur.fetchall()
+
+            validated = [row[0] for row in rows if row[4]]
+            stale = [row for row in rows if not row[4] and row[3]]
+            failed = [row[0] for row in stale if row[2] + 1 >= self.max_attempts]
+            requeued = [row[0] for row in stale if row[2] + 1 < self.max_attempts]
+
+            if validated:
+                cur.execute(
+                    "UPDATE predictions SET validation_status = 'validated' WHERE id = ANY(%s::uuid[])",
+                    (validated,)
+                )
+            if requeued:
+                cur.execute(
+                    """
+                    UPDATE predictions
+                    SET dispatched_at = NULL, validation_attempts = validation_attempts + 1
+                    WHERE id = ANY(%s::uuid[])
+                    """,
+                    (requeued,)
+                )
+            if failed:
+                cur.execute(
+                    """
+                    UPDATE predictions
+                    SET validation_status = 'failed', validation_attempts = validation_attempts + 1
+                    WHERE id = ANY(%s::uuid[])
+                    """,
+                    (failed,)
+                )
+        conn.commit()
+
+        counts["validated"] += len(validated)
+        counts["requeued"] += len(requeued)
+        counts["failed"] += len(failed)
+        if rows:
+            self._cursor = (rows[-1][1], rows[-1][0])
+        return len(rows) < self.chunk_size
+
+    def stats(self) -> dict:
+        return dict(self.totals)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
@@ -0,0 +1,470 @@
+"""
+Shared client layer for the upstream water-level API.
+
+Every call goes through:
+
+- an AIMD concurrency limit: it starts low and grows by one per success
+  (doubling each round trip until the first overload, additively after
+  that), and is halved when the API throttles us (429/503) or times out;
+- jittered exponential retry of transient failures, waiting for exactly
+  Retry-After when the API sends one;
+- a circuit breaker that fails fast after repeated failures and lets a
+  single probe through once the reset period has passed.
+
+UpstreamUnavailable is raised when a call still fails after its retries or
+the circuit is open, so callers can tell "try again later" apart from a bad
+request. Request counts, latency and the current limit are kept in
+UpstreamMetrics; each process publishes a snapshot to Redis, and the
+dashboard serves them all at /metrics.
+"""
+import asyncio
+import email.utils
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import httpx
+import redis
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying, and the ones that mean "slow down"
+RETRY_STATUSES = {429, 502, 503, 504}
+OVERLOAD_STATUSES = {429, 503}
+
+METRICS_KEY_PREFIX = "modtrack:upstream"
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream API could not be reached, even after retries."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """The circuit breaker is open, so the call was not attempted."""
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """Parse Retry-After, which is either delay seconds or an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+    def __init__(self, attempts: int = None, base_seconds: float = None, max_seconds: float = None):
+        self.attempts = attempts or Config.UPSTREAM_RETRY_ATTEMPTS
+        self.base_seconds = Config.UPSTREAM_RETRY_BASE_SECONDS if base_seconds is None else base_seconds
+        # Also the longest Retry-After we are willing to wait for
+        self.max_seconds = Config.UPSTREAM_RETRY_MAX_SECONDS if max_seconds is None else max_seconds
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Seconds to wait before retry number 'attempt' (0-based)."""
+        if response is not None:
+            retry_after = retry_after_seconds(response)
+            if retry_after is not None:
+                return retry_after
+        # Full jitter, so throttled clients don't come back in lockstep
+        return random.uniform(0, min(self.max_seconds, self.base_seconds * 2 ** attempt))
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int = None, reset_seconds: float = None):
+        self.threshold = threshold or Config.UPSTREAM_BREAKER_THRESHOLD
+        self.reset_seconds = Config.UPSTREAM_BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[str]:
+        """
+        The state an attempt is admitted in: CLOSED, or HALF_OPEN for the one
+        probe. None if it is rejected.
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return self.CLOSED
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return self.HALF_OPEN
+            return None
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Upstream circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self, admitted: str) -> None:
+        """
+        End an attempt whatever its outcome, given what allow() returned for
+        it. A probe that recorded neither (cancelled, or an unexpected error)
+        would otherwise hold the circuit half-open forever. Attempts admitted
+        while the circuit was closed leave a later probe alone.
+        """
+        with self._lock:
+            if admitted == self.HALF_OPEN and self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Upstream circuit opened after {self.failures} failures")
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class _AIMD:
+    """Additive-increase/multiplicative-decrease concurrency limit."""
+
+    def __init__(self, initial: int = None, minimum: int = None, maximum: int = None,
+                 backoff: float = 0.5, cooldown: float = 1.0):
+        self.minimum = max(minimum or Config.UPSTREAM_CONCURRENCY_MIN, 1)
+        self.maximum = maximum or Config.UPSTREAM_CONCURRENCY_MAX
+        self.limit = float(min(max(initial or Config.UPSTREAM_CONCURRENCY_INITIAL, self.minimum), self.maximum))
+        self.backoff = backoff
+        # Requests that were in flight together all see the same overload;
+        # only decrease once for them
+        self.cooldown = cooldown
+        self.inflight = 0
+        self._slow_start = True
+        self._last_decrease = 0.0
+
+    def on_success(self) -> None:
+        step = 1.0 if self._slow_start else 1.0 / self.limit
+        self.limit = min(self.maximum, self.limit + step)
+
+    def on_overload(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+            self._last_decrease = now
+            self._slow_start = False
+
+    def _full(self) -> bool:
+        return self.inflight >= int(self.limit)
+
+    def _free(self) -> int:
+        return max(int(self.limit) - self.inflight, 1)
+
+
+class AdaptiveLimiter(_AIMD):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+
+    def on_success(self) -> None:
+        with self._cond:
+            super().on_success()
+
+    def on_overload(self) -> None:
+        with self._cond:
+            super().on_overload()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._full():
+                self._cond.wait()
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.inflight -= 1
+                # The limit may have grown meanwhile; wake enough waiters to fill it
+                self._cond.notify(self._free())
+
+
+class AsyncAdaptiveLimiter(_AIMD):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._full())
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.inflight -= 1
+                # The limit may have grown meanwhile; wake enough waiters to fill it
+                self._cond.notify(self._free())
+
+
+class UpstreamMetrics:
+    COUNTERS = ("requests", "successes", "failures", "throttled", "retries", "rejected")
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.latencies = deque(maxlen=1000)
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            snapshot = dict(self.counters)
+        elapsed = time.monotonic() - self.started
+        snapshot["requests_per_s"] = round(snapshot["requests"] / elapsed, 2) if elapsed > 0 else 0.0
+        for name, fraction in (("latency_p50_ms", 0.5), ("latency_p99_ms", 0.99)):
+            snapshot[name] = (
+                round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000, 1)
+                if latencies else None
+            )
+        return snapshot
+
+
+class MetricsPublisher:
+    """Writes a process's snapshot to Redis at most every 'interval' seconds."""
+
+    def __init__(self, client: redis.Redis, interval: float = None):
+        self.client = client
+        self.interval = Config.UPSTREAM_METRICS_INTERVAL if interval is None else interval
+        self.key = f"{METRICS_KEY_PREFIX}:{socket.gethostname()}:{os.getpid()}"
+        self._last = 0.0
+
+    @classmethod
+    def from_url(cls, url: str = None) -> "MetricsPublisher":
+        return cls(redis.Redis.from_url(url or Config.READING_CACHE_URL))
+
+    def maybe_publish(self, snapshot) -> None:
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        try:
+            # Expires once the process stops publishing
+            self.client.set(self.key, json.dumps(snapshot()), ex=int(self.interval * 4))
+        except redis.RedisError as e:
+            logger.warning(f"Failed to publish upstream metrics: {e}")
+
+
+def read_published_metrics(client: redis.Redis) -> Dict[str, dict]:
+    """Latest snapshot of every publishing process, by host:pid."""
+    keys = list(client.scan_iter(f"{METRICS_KEY_PREFIX}:*"))
+    values = client.mget(keys) if keys else []
+    return {
+        key.decode()[len(METRICS_KEY_PREFIX) + 1:]: json.loads(value)
+        for key, value in zip(keys, values) if value is not None
+    }
+
+
+def render_prometheus(snapshots: Dict[str, dict]) -> str:
+    """Prometheus text exposition of per-process snapshots."""
+    lines = []
+    for field in sorted({field for snapshot in snapshots.values() for field in snapshot}):
+        metric = f"modtrack_upstream_{field}" + ("_total" if field in UpstreamMetrics.COUNTERS else "")
+        lines.append(f"# TYPE {metric} {'counter' if field in UpstreamMetrics.COUNTERS else 'gauge'}")
+        for process, snapshot in sorted(snapshots.items()):
+            value = snapshot.get(field)
+            if isinstance(value, str):
+                # Circuit state as one series per state
+                lines.append(f'{metric}{{process="{process}",state="{value}"}} 1')
+            elif value is not None:
+                lines.append(f'{metric}{{process="{process}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class _UpstreamBase:
+    def __init__(self, limiter, breaker: CircuitBreaker = None, retry: RetryPolicy = None,
+                 metrics: UpstreamMetrics = None, publisher: MetricsPublisher = None):
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.retry = retry or RetryPolicy()
+        self.metrics = metrics or UpstreamMetrics()
+        self.publisher = publisher
+
+    def snapshot(self) -> dict:
+        snapshot = self.metrics.snapshot()
+        snapshot.update({
+            "concurrency_limit": round(self.limiter.limit, 1),
+            "inflight": self.limiter.inflight,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+        })
+        return snapshot
+
+    def _before_attempt(self, method: str, url: str) -> str:
+        """Admit an attempt through the breaker; returns what release() needs."""
+        admitted = self.breaker.allow()
+        if not admitted:
+            self.metrics.incr("rejected")
+            raise CircuitOpenError(f"{method} {url}: circuit open")
+        self.metrics.incr("requests")
+        return admitted
+
+    def _on_unexpected_error(self) -> None:
+        self.metrics.incr("failures")
+        self.breaker.record_failure()
+
+    def _on_transport_error(self, error: httpx.TransportError) -> None:
+        self.metrics.incr("failures")
+        self.breaker.record_failure()
+        if isinstance(error, httpx.TimeoutException):
+            self.limiter.on_overload()
+
+    def _on_response(self, response: httpx.Response, latency: float) -> bool:
+        """Record the outcome; True if the response should be retried."""
+        self.metrics.observe(latency)
+        status = response.status_code
+        if status in OVERLOAD_STATUSES:
+            self.metrics.incr("throttled")
+            self.limiter.on_overload()
+        if status in RETRY_STATUSES:
+            self.metrics.incr("failures")
+            # A 429 means the API is up but busy; that's for the limiter, not the breaker
+            if status == 429:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            return True
+        if status >= 500:
+            # Not worth retrying, but the API is failing all the same
+            self.metrics.incr("failures")
+            self.breaker.record_failure()
+            return False
+        if status >= 400:
+            # The API is up and answered; the request itself was bad
+            return False
+        self.metrics.incr("successes")
+        self.breaker.record_success()
+        self.limiter.on_success()
+        return False
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up."""
+        if attempt + 1 >= self.retry.attempts:
+            return None
+        delay = self.retry.delay(attempt, response)
+        if delay > self.retry.max_seconds:
+            return None
+        self.metrics.incr("retries")
+        return delay
+
+    def _publish(self) -> None:
+        if self.publisher is not None:
+            self.publisher.maybe_publish(self.snapshot)
+
+
+class UpstreamClient(_UpstreamBase):
+    def __init__(self, http: httpx.Client, limiter: AdaptiveLimiter = None, **kwargs):
+        super().__init__(limiter or AdaptiveLimiter(), **kwargs)
+        self.http = http
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a request with retries. Raises UpstreamUnavailable if it keeps
+        failing, and HTTPStatusError for other error statuses, which aren't
+        retried.
+        """
+        try:
+            for attempt in range(self.retry.attempts):
+                admitted = self._before_attempt(method, url)
+                response = None
+                try:
+                    with self.limiter.slot():
+                        # Latency of the call itself, not of waiting for a slot
+                        started = time.monotonic()
+                        response = self.http.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    self._on_transport_error(e)
+                    error = e
+                except Exception:
+                    self._on_unexpected_error()
+                    raise
+                else:
+                    if not self._on_response(response, time.monotonic() - started):
+                        response.raise_for_status()
+                        return response
+                    error = f"HTTP {response.status_code}"
+                finally:
+                    self.breaker.release(admitted)
+
+                delay = self._retry_delay(attempt, response)
+                if delay is None:
+                    break
+                time.sleep(delay)
+            raise UpstreamUnavailable(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+        finally:
+            self._publish()
+
+
+class AsyncUpstreamClient(_UpstreamBase):
+    def __init__(self, http: httpx.AsyncClient, limiter: AsyncAdaptiveLimiter = None, **kwargs):
+        super().__init__(limiter or AsyncAdaptiveLimiter(), **kwargs)
+        self.http = http
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        try:
+            for attempt in range(self.retry.attempts):
+                admitted = self._before_attempt(method, url)
+                response = None
+                try:
+                    async with self.limiter.slot():
+                        started = time.monotonic()
+                        response = await self.http.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    self._on_transport_error(e)
+                    error = e
+                except Exception:
+                    self._on_unexpected_error()
+                    raise
+                else:
+                    if not self._on_response(response, time.monotonic() - started):
+                        response.raise_for_status()
+                        return response
+                    error = f"HTTP {response.status_code}"
+                finally:
+                    self.breaker.release(admitted)
+
+                delay = self._retry_delay(attempt, response)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+            raise UpstreamUnavailable(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+        finally:
+            self._publish()
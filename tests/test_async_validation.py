@@ -0,0 +1,42 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from modtrack.async_validation import _EngineRunner
+
+
+class BarrierEngine:
+    """Each validate() waits until 'parties' of them are running at once."""
+
+    def __init__(self, parties: int):
+        self.parties = parties
+        self.running = 0
+        self.started = self.closed = False
+        self._all_in = None
+
+    async def start(self):
+        self.started = True
+        self._all_in = asyncio.Event()
+
+    async def close(self):
+        self.closed = True
+
+    async def validate(self, groups):
+        self.running += 1
+        if self.running == self.parties:
+            self._all_in.set()
+        await asyncio.wait_for(self._all_in.wait(), timeout=5)
+        return {"validated": len(groups), "retry": []}
+
+
+def test_runs_from_many_threads_share_the_loop():
+    engine = BarrierEngine(parties=8)
+    runner = _EngineRunner(engine)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(runner.run, [[["r", []]]] * 8))
+    finally:
+        runner.close()
+
+    # Serialised runs would have timed out waiting for each other
+    assert [result["validated"] for result in results] == [1] * 8
+    assert engine.started and engine.closed
+    assert runner.loop.is_closed()
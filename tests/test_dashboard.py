@@ -0,0 +1,93 @@
+import asyncio
+import base64
+import json
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+import asyncpg
+import httpx
+import pytest
+from modtrack.dashboard import routes
+from modtrack.dashboard.database import DatabaseBusy
+
+
+def _get(path: str) -> httpx.Response:
+    transport = httpx.ASGITransport(app=routes.router)
+
+    async def get():
+        async with httpx.AsyncClient(transport=transport, base_url="http://dashboard") as client:
+            return await client.get(path)
+
+    return asyncio.run(get())
+
+
+def _failing_fetch(exc: Exception):
+    async def fetch(query, *args, **kwargs):
+        raise exc
+    return fetch
+
+
+@pytest.mark.parametrize("path", ["/api/predictions", "/api/filter-predictions"])
+def test_busy_database_is_a_503(monkeypatch, path):
+    monkeypatch.setattr(routes.database, "fetch", _failing_fetch(DatabaseBusy("no connection")))
+    response = _get(path)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+@pytest.mark.parametrize("path", ["/api/predictions", "/api/filter-predictions"])
+def test_statement_timeout_is_a_503(monkeypatch, path):
+    monkeypatch.setattr(routes.database, "fetch", _failing_fetch(asyncpg.QueryCanceledError("timeout")))
+    assert _get(path).status_code == 503
+
+
+def test_other_errors_are_still_reported_in_the_body(monkeypatch):
+    monkeypatch.setattr(routes.database, "fetch", _failing_fetch(RuntimeError("boom")))
+    response = _get("/api/filter-predictions")
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_cursor_round_trip():
+    record = {
+        "prediction_timestamp": datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc),
+        "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+    }
+    token = routes._encode_cursor("prev", record)
+    assert "=" not in token
+    assert routes._decode_cursor(token) == ("prev", record["prediction_timestamp"], record["id"])
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "not base64!",
+    base64.urlsafe_b64encode(b"{}").decode(),
+    base64.urlsafe_b64encode(json.dumps(["up", "2024-01-01T00:00:00+00:00", str(uuid.uuid4())]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(["next", "yesterday", str(uuid.uuid4())]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(["next", "2024-01-01T00:00:00+00:00", "x"]).encode()).decode(),
+])
+def test_malformed_cursor_is_ignored(token):
+    assert routes._decode_cursor(token) is None
+
+
+def test_page_url():
+    assert routes._page_url("abc", 2, 20, True) == "?page=2&limit=20&cursor=abc&exact_count=true"
+    assert routes._page_url(None, 1, 20, False) == "?page=1&limit=20"
+
+
+def test_accuracy_series_rounds_band_and_line_alike(monkeypatch):
+    async def fetch(query, *args, **kwargs):
+        return [{
+            "reservoir_id": "r1",
+            "bucket_at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+            "deviation": Decimal("0.123456"),
+            "min_deviation": Decimal("-1.000049"),
+            "max_deviation": Decimal("2.718281"),
+            "validations": 3,
+        }]
+
+    monkeypatch.setattr(routes.database, "fetch", fetch)
+    series = _get("/api/accuracy-data").json()["r1"]
+    assert series["deviations"] == [0.123]
+    assert series["min_deviations"] == [-1.0]
+    assert series["max_deviations"] == [2.718]
@@ -0,0 +1,70 @@
+from pathlib import Path
+import pytest
+from modtrack.ingestion import IngestPipeline
+
+
+class InstantPool:
+    """Finishes every file before submit() returns, like a very fast worker."""
+
+    def __init__(self, accept=True, error=None):
+        self.on_done = None
+        self.accept = accept
+        self.error = error
+        self.submitted = []
+
+    def submit(self, file_path):
+        if self.error is not None:
+            raise self.error
+        if not self.accept:
+            return False
+        self.submitted.append(file_path)
+        self.on_done(file_path)
+        return True
+
+    def queue_depth(self):
+        return 0
+
+
+def test_file_finished_before_submit_returns_is_forgotten():
+    pool = InstantPool()
+    pipeline = IngestPipeline(pool, settle_seconds=0)
+    pipeline.notify(Path("prediction_001.txt"), ready=True)
+
+    pipeline._submit_settled()
+    assert pool.submitted == [Path("prediction_001.txt")]
+    assert pipeline.depth() == 0
+    assert pipeline.ingested == 1
+
+
+def test_rejected_submit_is_retried_on_the_next_pass():
+    pool = InstantPool(accept=False)
+    pipeline = IngestPipeline(pool, settle_seconds=0)
+    pipeline.notify(Path("prediction_001.txt"), ready=True)
+
+    pipeline._submit_settled()
+    assert pipeline.depth() == 1
+
+    pool.accept = True
+    pipeline._submit_settled()
+    assert pool.submitted == [Path("prediction_001.txt")]
+    assert pipeline.depth() == 0
+
+
+def test_failed_submit_is_retried_on_the_next_pass():
+    pool = InstantPool(error=RuntimeError("pool stopped"))
+    pipeline = IngestPipeline(pool, settle_seconds=0)
+    pipeline.notify(Path("prediction_001.txt"), ready=True)
+
+    with pytest.raises(RuntimeError):
+        pipeline._submit_settled()
+
+    pool.error = None
+    pipeline._submit_settled()
+    assert pipeline.depth() == 0
+
+
+def test_temporary_names_are_ignored():
+    pipeline = IngestPipeline(InstantPool(), settle_seconds=0)
+    pipeline.notify(Path(".prediction_001.txt"))
+    pipeline.notify(Path("prediction_001.txt.part"))
+    assert pipeline.depth() == 0
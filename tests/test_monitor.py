@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import psycopg2
+import pytest
+from modtrack import monitor
+from modtrack.monitor import ModelResultsHandler
+
+
+class FakeConnection:
+    def __init__(self):
+        self.calls = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+@pytest.fixture
+def handler():
+    # Skip __init__, which connects to the database and AWS
+    handler = ModelResultsHandler.__new__(ModelResultsHandler)
+    handler.logger = logging.getLogger("test_monitor")
+    handler.spool = None
+    handler.db_connection = FakeConnection()
+    return handler
+
+
+@pytest.fixture
+def prediction_file(tmp_path):
+    path = tmp_path / "prediction_1.txt"
+    path.write_text(json.dumps({
+        "timestamp": "2024-01-01T00:00:00Z",
+        "predictions": [{"reservoir_id": "r1", "predicted_level": 1.5, "validation_time": "2024-01-01T06:00:00Z"}],
+    }) + "\n")
+    return path
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    calls = {"claims": [], "failed": []}
+
+    def claim_file(cur, key, digest):
+        calls["claims"].append((key, digest))
+        return calls.get("claim_result", True)
+
+    def unexpected_hash(path):
+        raise AssertionError("the file was hashed in a separate pass")
+
+    monkeypatch.setattr(monitor, "claim_file", claim_file)
+    monkeypatch.setattr(monitor, "record_failed_file", lambda conn, key, digest, error: calls["failed"].append(key))
+    monkeypatch.setattr(monitor, "content_hash", unexpected_hash)
+    monkeypatch.setattr(monitor, "insert_predictions", lambda cur, rows, method, batch_size: len(list(rows)))
+    return calls
+
+
+def test_digest_is_taken_while_reading(handler, prediction_file, ledger):
+    handler.process_file(prediction_file)
+
+    [(key, digest)] = ledger["claims"]
+    assert key[0] == prediction_file.name
+    assert digest == hashlib.sha256(prediction_file.read_bytes()).hexdigest()
+    assert handler.db_connection.calls == ["commit"]
+
+
+def test_duplicate_keeps_only_the_ledger_entry(handler, prediction_file, ledger):
+    ledger["claim_result"] = False
+    handler.process_file(prediction_file)
+
+    assert len(ledger["claims"]) == 2
+    assert handler.db_connection.calls == ["rollback", "commit"]
+
+
+def test_rejected_rows_are_recorded_as_failed(handler, prediction_file, ledger, monkeypatch):
+    def insert_predictions(cur, rows, method, batch_size):
+        raise psycopg2.IntegrityError("violates check constraint")
+
+    monkeypatch.setattr(monitor, "insert_predictions", insert_predictions)
+    monkeypatch.setattr(monitor, "content_hash", lambda path: "digest")
+    handler.process_file(prediction_file)
+
+    assert [key[0] for key in ledger["failed"]] == [prediction_file.name]
+    assert ledger["claims"] == []
@@ -0,0 +1,77 @@
+from datetime import date, datetime, timedelta, timezone
+from modtrack import partitions
+from modtrack.partitions import PartitionMaintainer, _add_months, _month_start, _partition_month, partition_name
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append(" ".join(sql.split()))
+
+    def fetchone(self):
+        return (0,)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.commits = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits.append(len(self.statements))
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_add_months_across_years():
+    assert _add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert _add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert _add_months(date(2024, 12, 1), -12) == date(2023, 12, 1)
+
+
+def test_month_start_is_utc():
+    late_evening = datetime(2024, 1, 31, 23, 30, tzinfo=timezone(timedelta(hours=-2)))
+    assert _month_start(late_evening) == date(2024, 2, 1)
+
+
+def test_partition_names_round_trip():
+    name = partition_name("predictions", date(2024, 3, 1))
+    assert name == "predictions_y2024m03"
+    assert _partition_month(name) == date(2024, 3, 1)
+    assert _partition_month("predictions_default") is None
+
+
+def test_dropping_a_partition_refreshes_its_rollups_in_the_same_transaction(monkeypatch):
+    conn = FakeConnection()
+    old = partition_name("validations", date(2000, 1, 1))
+    monkeypatch.setattr(PartitionMaintainer, "_monthly_partitions", staticmethod(
+        lambda conn, table: [(old, date(2000, 1, 1))]
+    ))
+    monkeypatch.setattr(partitions, "_create_partition", lambda cur, table, month: False)
+
+    changes = {"created": [], "dropped": []}
+    PartitionMaintainer(lambda: conn, premake_months=0, retention_months=12)._maintain(conn, "validations", changes)
+
+    assert changes["dropped"] == [old]
+    drop = next(i for i, s in enumerate(conn.statements) if s == f"DROP TABLE {old}")
+    stage = next(i for i, s in enumerate(conn.statements) if "CREATE TEMP TABLE rollup_refresh" in s)
+    refresh = next(i for i, s in enumerate(conn.statements) if s.startswith("INSERT INTO accuracy_rollups"))
+    assert f"FROM {old} v JOIN predictions p" in conn.statements[stage]
+    assert stage < drop < refresh
+    # Nothing committed between taking the rows out and recomputing their buckets
+    assert not [c for c in conn.commits if stage < c <= refresh]
@@ -0,0 +1,146 @@
+"""
+The dashboard's queries reach predictions and validations through the
+indexes the migrations add. Needs a Postgres server, given as a libpq DSN in
+MODTRACK_TEST_DSN; the tables are built in a throwaway schema, so nothing
+else in the database is touched.
+"""
+import json
+import os
+import uuid
+import psycopg2
+import pytest
+from modtrack.migrations import MIGRATIONS, migrate
+
+pytestmark = pytest.mark.postgres
+
+PREDICTIONS = 100000
+RESERVOIRS = 50
+
+# name -> (query, relations that must be reached through an index)
+QUERIES = {
+    "recent_page": (
+        """
+        SELECT p.id, p.reservoir_id, p.predicted_level, v.actual_level, v.difference
+        FROM predictions p
+        LEFT JOIN validations v ON p.id = v.prediction_id
+        WHERE (p.prediction_timestamp, p.id) < (now() - INTERVAL '10 days', 'ffffffff-ffff-ffff-ffff-ffffffffffff')
+        ORDER BY p.prediction_timestamp DESC, p.id DESC
+        LIMIT 21
+        """,
+        ("predictions", "validations"),
+    ),
+    "reservoir_recent": (
+        """
+        SELECT p.id, p.predicted_level, v.actual_level
+        FROM predictions p
+        LEFT JOIN validations v ON p.id = v.prediction_id
+        WHERE p.reservoir_id = 'reservoir_7'
+          AND p.prediction_timestamp >= now() - INTERVAL '2 days'
+        ORDER BY p.prediction_timestamp DESC
+        """,
+        ("predictions", "validations"),
+    ),
+    "prediction_detail": (
+        """
+        SELECT p.id, v.actual_level, v.validated_at
+        FROM predictions p
+        LEFT JOIN validations v ON p.id = v.prediction_id
+        WHERE p.id = (SELECT id FROM predictions ORDER BY prediction_timestamp LIMIT 1)
+        """,
+        ("predictions", "validations"),
+    ),
+    "validations_since": (
+        """
+        SELECT v.validated_at, v.difference
+        FROM validations v
+        WHERE v.validated_at >= now() - INTERVAL '1 hour'
+        ORDER BY v.validated_at
+        """,
+        ("validations",),
+    ),
+}
+
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+
+def _seed(conn) -> None:
+    with conn.cursor() as cur:
+        # Predictions spread over 30 days; all but the newest day validated
+        cur.execute(
+            """
+            INSERT INTO predictions
+            (id, reservoir_id, predicted_level, prediction_timestamp, validation_time, file_name)
+            SELECT uuid_generate_v4(), 'reservoir_' || (i %% %(reservoirs)s + 1), 100 + i %% 250,
+                   now() - (i * INTERVAL '30 days' / %(predictions)s),
+                   now() - (i * INTERVAL '30 days' / %(predictions)s) + INTERVAL '1 day',
+                   'explain_' || (i / 1000) || '.csv'
+            FROM generate_series(1, %(predictions)s) AS i
+            """,
+            {"predictions": PREDICTIONS, "reservoirs": RESERVOIRS}
+        )
+        cur.execute(
+            """
+            INSERT INTO validations (id, prediction_id, actual_level, difference, validated_at)
+            SELECT uuid_generate_v4(), id, predicted_level + 1, 1, validation_time
+            FROM predictions
+            WHERE validation_time <= now()
+            """
+        )
+    conn.commit()
+
+
+def _scans(plan: dict) -> list:
+    """(node type, relation) for every scan in a plan tree."""
+    scans = []
+    if "Relation Name" in plan:
+        scans.append((plan["Node Type"], plan["Relation Name"]))
+    for child in plan.get("Plans", []):
+        scans.extend(_scans(child))
+    return scans
+
+
+@pytest.fixture(scope="module")
+def migrated():
+    dsn = os.getenv("MODTRACK_TEST_DSN")
+    if not dsn:
+        pytest.skip("MODTRACK_TEST_DSN is not set")
+
+    schema = f"test_plans_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"')
+
+    conn = psycopg2.connect(dsn, options=f"-c search_path={schema},public")
+    try:
+        # Seed at the baseline, so the later migrations build their indexes
+        # over existing rows as they would in production
+        migrate(conn, target=MIGRATIONS[0].version)
+        _seed(conn)
+        migrate(conn)
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE predictions")
+            cur.execute("ANALYZE validations")
+        conn.commit()
+        yield conn
+    finally:
+        conn.close()
+        with admin.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_query_uses_indexes(migrated, name):
+    query, relations = QUERIES[name]
+    with migrated.cursor() as cur:
+        cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+        plan = cur.fetchone()[0]
+    migrated.commit()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans = [(node, relation) for node, relation in _scans(plan[0]["Plan"]) if relation in relations]
+    assert {relation for _, relation in scans} == set(relations)
+    assert all(node in INDEX_NODES for node, _ in scans), scans
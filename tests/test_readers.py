@@ -0,0 +1,188 @@
+import hashlib
+import io
+import json
+from datetime import datetime, timezone
+import pytest
+from modtrack import readers
+from modtrack.readers import _JSONStream, iter_json_chunks, iter_prediction_chunks, register_reader
+
+TIMESTAMP = "2024-01-01T00:00:00Z"
+
+
+def _prediction(i: int) -> dict:
+    return {"reservoir_id": f"r{i}", "predicted_level": float(i), "validation_time": f"2024-01-02T{i:02d}:00:00Z"}
+
+
+def _rows(chunks) -> list:
+    return [(chunk.prediction_timestamp, list(chunk.reservoir_ids)) for chunk in chunks]
+
+
+def test_json_stream_decodes_across_small_windows():
+    text = json.dumps({"a": [1, 2.5, {"b": "c"}], "d": 12345678})
+    stream = _JSONStream(io.StringIO(text), read_size=3)
+    decoded = {}
+    for key in stream.object_keys():
+        decoded[key] = list(stream.array_items()) if key == "a" else stream.value()
+    assert decoded == {"a": [1, 2.5, {"b": "c"}], "d": 12345678}
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 4, 5])
+@pytest.mark.parametrize("numbers", [[2.5], [12, 300000.0], [-0.00125, 7]])
+def test_number_cut_off_by_the_read_window(read_size, numbers):
+    # Every window size splits some number in the middle, e.g. after "2."
+    stream = _JSONStream(io.StringIO(json.dumps(numbers)), read_size=read_size)
+    assert list(stream.array_items()) == numbers
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 5, 8, 64])
+def test_skip_value_matches_brackets_outside_strings(read_size):
+    text = json.dumps({"a": ["x]", 'q"[\\', {"b": [1, {}]}], "c": "}", "t": 5})
+    stream = _JSONStream(io.StringIO(text), read_size=read_size)
+    seen = {}
+    for key in stream.object_keys():
+        if key == "t":
+            seen[key] = stream.value()
+        else:
+            stream.skip_value()
+    assert seen == {"t": 5}
+
+
+def test_skip_value_of_a_truncated_array():
+    stream = _JSONStream(io.StringIO('[{"a": "]"'), read_size=4)
+    with pytest.raises(ValueError):
+        stream.skip_value()
+
+
+def test_json_file_with_timestamp_first_is_read_once(tmp_path, monkeypatch):
+    def second_pass(path):
+        raise AssertionError("the file was scanned for its timestamp separately")
+
+    monkeypatch.setattr(readers, "_read_file_timestamp", second_pass)
+    path = tmp_path / "prediction_1.json"
+    path.write_text(json.dumps({"timestamp": TIMESTAMP, "predictions": [_prediction(1)]}))
+    assert _rows(iter_json_chunks(path, 10)) == [(datetime(2024, 1, 1, tzinfo=timezone.utc), ["r1"])]
+
+
+@pytest.mark.parametrize("timestamp_first", [True, False])
+def test_json_file_in_chunks(tmp_path, timestamp_first):
+    predictions = [_prediction(i) for i in range(5)]
+    document = {"timestamp": TIMESTAMP, "predictions": predictions}
+    if not timestamp_first:
+        document = {"predictions": predictions, "timestamp": TIMESTAMP}
+    path = tmp_path / "prediction_1.json"
+    path.write_text(json.dumps(document))
+
+    chunks = list(iter_json_chunks(path, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0].prediction_timestamp == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert chunks[2].validation_times == [datetime(2024, 1, 2, 4, tzinfo=timezone.utc)]
+
+
+def test_json_file_without_predictions(tmp_path):
+    path = tmp_path / "prediction_1.json"
+    path.write_text(json.dumps({"timestamp": TIMESTAMP}))
+    with pytest.raises(KeyError):
+        list(iter_json_chunks(path, 10))
+
+
+def test_malformed_json_file(tmp_path):
+    path = tmp_path / "prediction_1.json"
+    prediction = json.dumps(_prediction(1))
+    path.write_text('{"timestamp": "%s", "predictions": [%s %s]}' % (TIMESTAMP, prediction, prediction))
+    with pytest.raises(ValueError):
+        list(iter_json_chunks(path, 10))
+
+
+def test_unknown_extension_is_read_as_json(tmp_path):
+    path = tmp_path / "prediction_1.out"
+    path.write_text(json.dumps({"timestamp": TIMESTAMP, "predictions": [_prediction(1)]}))
+    assert _rows(iter_prediction_chunks(path, 10)) == [(datetime(2024, 1, 1, tzinfo=timezone.utc), ["r1"])]
+
+
+def test_registered_reader_is_used_by_extension(tmp_path, monkeypatch):
+    monkeypatch.setattr(readers, "READERS", dict(readers.READERS))
+    register_reader(".CSV", lambda path, chunk_size: iter(["chunk"]))
+    assert list(iter_prediction_chunks(tmp_path / "prediction_1.csv", 10)) == ["chunk"]
+
+
+def test_ndjson_splits_chunks_on_timestamp(tmp_path):
+    lines = [
+        {"timestamp": TIMESTAMP},
+        _prediction(1),
+        _prediction(2),
+        {**_prediction(3), "timestamp": "2024-01-01T01:00:00Z"},
+        _prediction(4),
+    ]
+    path = tmp_path / "prediction_1.ndjson"
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\n\n")
+
+    first, second = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 1, 1, tzinfo=timezone.utc)
+    assert _rows(iter_prediction_chunks(path, 10)) == [(first, ["r1", "r2"]), (second, ["r3"]), (first, ["r4"])]
+
+
+def test_ndjson_prediction_without_timestamp(tmp_path):
+    path = tmp_path / "prediction_1.jsonl"
+    path.write_text(json.dumps(_prediction(1)) + "\n")
+    with pytest.raises(ValueError, match="prediction_1.jsonl:1"):
+        list(iter_prediction_chunks(path, 10))
+
+
+def _table(pa, with_timestamps: bool):
+    columns = {
+        "reservoir_id": ["r1", "r2", "r3"],
+        "predicted_level": [1, 2, 3],
+        "validation_time": pa.array([datetime(2024, 1, 2, h, tzinfo=timezone.utc) for h in range(3)],
+                                    pa.timestamp("us", tz="UTC")),
+    }
+    if with_timestamps:
+        columns["timestamp"] = pa.array(
+            [datetime(2024, 1, 1, h, tzinfo=timezone.utc) for h in (0, 0, 1)], pa.timestamp("us", tz="UTC")
+        )
+    table = pa.table(columns)
+    if not with_timestamps:
+        table = table.replace_schema_metadata({"timestamp": TIMESTAMP})
+    return table
+
+
+def test_arrow_file_with_metadata_timestamp(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.feather as feather
+
+    path = tmp_path / "prediction_1.arrow"
+    feather.write_feather(_table(pa, with_timestamps=False), path)
+
+    [chunk] = list(iter_prediction_chunks(path, 10))
+    assert chunk.prediction_timestamp == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert list(chunk.reservoir_ids) == ["r1", "r2", "r3"]
+    assert list(chunk.predicted_levels) == [1.0, 2.0, 3.0]
+    assert datetime.fromisoformat(str(chunk.validation_times[0])) == datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+
+def test_parquet_file_splits_on_timestamp_column(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    path = tmp_path / "prediction_1.parquet"
+    pq.write_table(_table(pa, with_timestamps=True), path)
+
+    assert _rows(iter_prediction_chunks(path, 2)) == [
+        (datetime(2024, 1, 1, tzinfo=timezone.utc), ["r1", "r2"]),
+        (datetime(2024, 1, 1, 1, tzinfo=timezone.utc), ["r3"]),
+    ]
+
+
+@pytest.mark.parametrize("suffix", [".json", ".ndjson", ".arrow"])
+def test_digest_covers_the_whole_file(tmp_path, suffix):
+    path = tmp_path / f"prediction_1{suffix}"
+    if suffix == ".json":
+        path.write_text(json.dumps({"timestamp": TIMESTAMP, "predictions": [_prediction(1)]}) + "\n\n")
+    elif suffix == ".ndjson":
+        path.write_text(json.dumps({**_prediction(1), "timestamp": TIMESTAMP}) + "\n")
+    else:
+        pa = pytest.importorskip("pyarrow")
+        import pyarrow.feather as feather
+        feather.write_feather(_table(pa, with_timestamps=False), path)
+
+    digest = hashlib.sha256()
+    list(iter_prediction_chunks(path, 10, digest))
+    assert digest.hexdigest() == hashlib.sha256(path.read_bytes()).hexdigest()
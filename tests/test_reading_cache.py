@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+import fakeredis.aioredis  # noqa: E402
+from modtrack.reading_cache import AsyncReadingCache, ReadingCache  # noqa: E402
+
+
+def _cache(client, cls=ReadingCache, **kwargs):
+    kwargs.setdefault("wait_seconds", 2)
+    return cls(client, ttl=60, bucket_seconds=60, lock_seconds=5, **kwargs)
+
+
+class FetchMany:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, reservoir_ids):
+        self.calls.append(sorted(reservoir_ids))
+        return {r: float(len(r)) for r in reservoir_ids}
+
+
+def test_misses_are_fetched_once_and_cached():
+    cache = _cache(fakeredis.FakeRedis())
+    fetch_many = FetchMany()
+
+    assert cache.get_many(["a", "bb"], fetch_many) == {"a": 1.0, "bb": 2.0}
+    assert cache.get_many(["a", "bb"], fetch_many) == {"a": 1.0, "bb": 2.0}
+    assert fetch_many.calls == [["a", "bb"]]
+    assert cache.stats()["hits"] == 2
+
+
+def test_waits_for_a_reading_another_worker_is_fetching():
+    client = fakeredis.FakeRedis()
+    cache = _cache(client)
+    # Another worker holds the lock for "a" and stores it shortly
+    client.set(f"{cache.key('a')}:lock", "theirs")
+    timer = threading.Timer(0.1, client.set, (cache.key("a"), 7.0))
+    timer.start()
+
+    fetch_many = FetchMany()
+    try:
+        assert cache.get_many(["a", "bb"], fetch_many) == {"a": 7.0, "bb": 2.0}
+    finally:
+        timer.cancel()
+    assert fetch_many.calls == [["bb"]]
+    assert cache.stats()["coalesced"] == 1
+
+
+def test_fetches_itself_when_the_lock_holder_is_too_slow():
+    client = fakeredis.FakeRedis()
+    cache = _cache(client, wait_seconds=0.05)
+    client.set(f"{cache.key('a')}:lock", "theirs")
+
+    fetch_many = FetchMany()
+    assert cache.get_many(["a"], fetch_many) == {"a": 1.0}
+    assert fetch_many.calls == [["a"]]
+
+
+def test_async_waits_for_a_reading_another_worker_is_fetching():
+    async def run():
+        client = fakeredis.aioredis.FakeRedis()
+        cache = _cache(client, AsyncReadingCache)
+        await client.set(f"{cache.key('a')}:lock", "theirs")
+        calls = []
+
+        async def fetch_many(reservoir_ids):
+            calls.append(sorted(reservoir_ids))
+            return {r: float(len(r)) for r in reservoir_ids}
+
+        async def store_later():
+            await asyncio.sleep(0.1)
+            await client.set(cache.key("a"), 7.0)
+
+        levels, _ = await asyncio.gather(cache.get_many(["a", "bb"], fetch_many), store_later())
+        return levels, calls, cache.stats()
+
+    levels, calls, stats = asyncio.run(run())
+    assert levels == {"a": 7.0, "bb": 2.0}
+    assert calls == [["bb"]]
+    assert stats["coalesced"] == 1
+
+
+def test_unavailable_redis_fetches_directly():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    cache = _cache(fakeredis.FakeRedis(server=server))
+
+    fetch_many = FetchMany()
+    assert cache.get_many(["a"], fetch_many) == {"a": 1.0}
+    assert cache.stats()["errors"] == 1
@@ -0,0 +1,64 @@
+import os
+from modtrack.scanner import IncrementalScanner
+
+
+def _touch(path, mtime_ns=None):
+    path.write_text("")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _bump(directory):
+    # Directory mtimes can be coarse; make sure the scanner sees a change
+    stat = os.stat(directory)
+    os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_new_prediction_files_are_found_incrementally(tmp_path):
+    _touch(tmp_path / "prediction_001.txt")
+    scanner = IncrementalScanner(tmp_path, full_scan_every=100)
+    assert [p.name for p in scanner.candidates()] == ["prediction_001.txt"]
+
+    _touch(tmp_path / "prediction_002.txt")
+    _bump(tmp_path)
+    assert [p.name for p in scanner.candidates()] == ["prediction_002.txt"]
+
+
+def test_unchanged_directory_is_skipped(tmp_path):
+    _touch(tmp_path / "prediction_001.txt")
+    scanner = IncrementalScanner(tmp_path, full_scan_every=100)
+    scanner.candidates()
+    assert scanner.candidates() == []
+
+
+def test_file_sorting_after_predictions_does_not_hide_new_ones(tmp_path):
+    for name in ("prediction_028.txt", "prediction_029.txt", "processed_files.csv", "results.txt"):
+        _touch(tmp_path / name)
+    scanner = IncrementalScanner(tmp_path, full_scan_every=100)
+    assert len(scanner.candidates()) == 4
+
+    _touch(tmp_path / "prediction_030.txt")
+    _bump(tmp_path)
+    names = sorted(p.name for p in scanner.candidates())
+    assert "prediction_030.txt" in names
+    assert "prediction_029.txt" not in names
+
+
+def test_full_scan_lists_everything(tmp_path):
+    _touch(tmp_path / "prediction_001.txt")
+    scanner = IncrementalScanner(tmp_path, full_scan_every=2)
+    scanner.candidates()
+    scanner.candidates()
+    assert [p.name for p in scanner.candidates()] == ["prediction_001.txt"]
+
+
+def test_recursive_scan_descends_into_unchanged_parents(tmp_path):
+    day = tmp_path / "2024" / "12" / "26"
+    day.mkdir(parents=True)
+    _touch(day / "prediction_001.txt")
+    scanner = IncrementalScanner(tmp_path, recursive=True, full_scan_every=100)
+    assert [p.name for p in scanner.candidates()] == ["prediction_001.txt"]
+
+    _touch(day / "prediction_002.txt")
+    _bump(day)
+    assert [p.name for p in scanner.candidates()] == ["prediction_002.txt"]
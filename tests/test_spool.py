@@ -0,0 +1,136 @@
+from pathlib import Path
+import psycopg2
+import pytest
+from modtrack import spool as spool_module
+from modtrack.spool import CorruptSegment, Spool, SpoolReplayer, _frame, on_mounted_volume, read_records
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(tmp_path, segment_bytes=1 << 20, fsync=False, retry_seconds=60)
+
+
+def _spool_file(spool, name, rows):
+    return spool.append_file(name, (name, 1, 1), "digest-" + name, iter([rows]))
+
+
+def test_records_round_trip(tmp_path):
+    path = tmp_path / "000000000001.seg"
+    path.write_bytes(_frame({"type": "rows", "rows": [[1, 2]]}) + _frame({"type": "file", "file": "a"}))
+    records = [record for _, record in read_records(path)]
+    assert records == [{"type": "rows", "rows": [[1, 2]]}, {"type": "file", "file": "a"}]
+
+
+def test_torn_tail_ends_segment_quietly(tmp_path):
+    path = tmp_path / "000000000001.seg"
+    whole = _frame({"type": "file", "file": "a"})
+    path.write_bytes(whole + _frame({"type": "file", "file": "b"})[:-3])
+    assert [record["file"] for _, record in read_records(path)] == ["a"]
+
+
+def test_checksum_mismatch_raises(tmp_path):
+    path = tmp_path / "000000000001.seg"
+    framed = bytearray(_frame({"type": "file", "file": "a"}))
+    framed[-2] ^= 0xFF
+    path.write_bytes(bytes(framed))
+    with pytest.raises(CorruptSegment):
+        list(read_records(path))
+
+
+def test_read_resumes_from_offset(tmp_path):
+    path = tmp_path / "000000000001.seg"
+    first = _frame({"type": "file", "file": "a"})
+    path.write_bytes(first + _frame({"type": "file", "file": "b"}))
+    assert [record["file"] for _, record in read_records(path, len(first))] == ["b"]
+
+
+def test_replay_inserts_rows_and_claims_files(spool, monkeypatch):
+    inserted, claimed = [], []
+    monkeypatch.setattr(spool_module, "insert_predictions", lambda cur, rows, *a: inserted.extend(rows) or len(rows))
+    monkeypatch.setattr(spool_module, "claim_file", lambda cur, key, digest: claimed.append(key))
+
+    _spool_file(spool, "a.txt", [["id-1"], ["id-2"]])
+    _spool_file(spool, "b.txt", [["id-3"]])
+    replayer = SpoolReplayer(spool, FakeConnection, batch_rows=2)
+
+    assert replayer.drain() == 3
+    assert inserted == [["id-1"], ["id-2"], ["id-3"]]
+    assert claimed == [("a.txt", 1, 1), ("b.txt", 1, 1)]
+    assert spool.sealed_segments() == []
+
+
+def test_rejected_batch_sets_segment_aside_and_moves_on(spool, monkeypatch):
+    def insert(cur, rows, *args):
+        if ["bad"] in rows:
+            raise psycopg2.DataError("invalid input")
+        return len(rows)
+
+    monkeypatch.setattr(spool_module, "insert_predictions", insert)
+    monkeypatch.setattr(spool_module, "claim_file", lambda cur, key, digest: True)
+
+    _spool_file(spool, "bad.txt", [["bad"]])
+    spool.seal()
+    _spool_file(spool, "good.txt", [["id-1"]])
+    replayer = SpoolReplayer(spool, FakeConnection, batch_rows=10)
+
+    assert replayer.drain() == 1
+    assert not spool.db_down()
+    assert replayer.set_aside_segments == 1
+    assert [p.suffix for p in spool.directory.iterdir() if p.name.endswith(".failed")] == [".failed"]
+    assert spool.sealed_segments() == []
+
+
+def test_lost_connection_marks_database_down(spool, monkeypatch):
+    def insert(cur, rows, *args):
+        raise psycopg2.OperationalError("server closed the connection")
+
+    monkeypatch.setattr(spool_module, "insert_predictions", insert)
+    _spool_file(spool, "a.txt", [["id-1"]])
+    replayer = SpoolReplayer(spool, FakeConnection, batch_rows=10, poll_interval=0)
+    replayer._stop.wait = lambda timeout: replayer._stop.set()
+
+    replayer._run()
+    assert spool.db_down()
+    # Kept for the next attempt
+    assert len(spool.sealed_segments()) == 1
+
+
+def test_append_leaves_nothing_when_file_fails(spool):
+    def chunks():
+        yield [["id-1"]]
+        raise ValueError("unparseable")
+
+    with pytest.raises(ValueError):
+        spool.append_file("a.txt", ("a.txt", 1, 1), "digest", chunks())
+    spool.seal()
+    assert spool.backlog_bytes() == 0
+
+
+def test_root_filesystem_is_not_a_mounted_volume():
+    assert not on_mounted_volume(Path("/"))
@@ -0,0 +1,131 @@
+import asyncio
+import httpx
+import pytest
+from modtrack.upstream import (
+    AdaptiveLimiter, AsyncAdaptiveLimiter, AsyncUpstreamClient, CircuitBreaker, CircuitOpenError,
+    RetryPolicy, UpstreamClient, UpstreamUnavailable,
+)
+
+
+def _client(handler, threshold=2):
+    http = httpx.Client(base_url="http://api", transport=httpx.MockTransport(handler))
+    return UpstreamClient(
+        http,
+        limiter=AdaptiveLimiter(initial=4, minimum=1, maximum=100),
+        breaker=CircuitBreaker(threshold=threshold, reset_seconds=60),
+        retry=RetryPolicy(attempts=1, base_seconds=0, max_seconds=0),
+    )
+
+
+def test_success_grows_limit_and_keeps_circuit_closed():
+    client = _client(lambda request: httpx.Response(200, json={}))
+    client.request("GET", "/water-level/r1")
+    assert client.limiter.limit > 4
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_server_error_counts_as_failure_and_opens_circuit():
+    client = _client(lambda request: httpx.Response(500))
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            client.request("GET", "/water-level/r1")
+    assert client.limiter.limit == 4
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.request("GET", "/water-level/r1")
+
+
+def test_client_error_is_neutral():
+    client = _client(lambda request: httpx.Response(404), threshold=1)
+    with pytest.raises(httpx.HTTPStatusError):
+        client.request("GET", "/water-level/unknown")
+    assert client.limiter.limit == 4
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert client.metrics.snapshot().get("successes", 0) == 0
+
+
+def test_overload_halves_limit_and_retries_are_exhausted():
+    client = _client(lambda request: httpx.Response(503), threshold=10)
+    with pytest.raises(UpstreamUnavailable):
+        client.request("GET", "/water-level/r1")
+    assert client.limiter.limit == 2
+
+
+def test_aimd_slow_start_then_additive_increase():
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=100, cooldown=0)
+    limiter.on_success()
+    assert limiter.limit == 3
+    limiter.on_overload()
+    assert limiter.limit == 1.5
+    limiter.on_success()
+    assert limiter.limit == pytest.approx(1.5 + 1 / 1.5)
+
+
+def test_breaker_lets_one_probe_through_after_reset():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_attempt_admitted_while_closed_leaves_the_probe_alone():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=0)
+    admitted = breaker.allow()
+    assert admitted == CircuitBreaker.CLOSED
+
+    # The circuit opens and its probe goes out while that attempt is in flight
+    breaker.record_failure()
+    assert breaker.allow() == CircuitBreaker.HALF_OPEN
+    breaker.release(admitted)
+    assert not breaker.allow()
+
+
+def _half_open_client(handler):
+    client = _client(handler, threshold=1)
+    client.breaker.reset_seconds = 0
+    client.breaker.record_failure()
+    return client
+
+
+def test_probe_answered_with_client_error_is_released():
+    client = _half_open_client(lambda request: httpx.Response(404))
+    with pytest.raises(httpx.HTTPStatusError):
+        client.request("GET", "/water-level/unknown")
+    assert client.breaker.allow()
+
+
+def test_probe_failing_unexpectedly_records_failure_and_is_released():
+    def handler(request):
+        raise RuntimeError("bug in a transport")
+
+    client = _half_open_client(handler)
+    with pytest.raises(RuntimeError):
+        client.request("GET", "/water-level/r1")
+    assert client.breaker.state == CircuitBreaker.OPEN
+    # reset_seconds is 0, so the next probe is let through
+    assert client.breaker.allow()
+
+
+def test_cancelled_async_probe_is_released():
+    async def handler(request):
+        await asyncio.sleep(10)
+
+    async def run():
+        http = httpx.AsyncClient(base_url="http://api", transport=httpx.MockTransport(handler))
+        breaker = CircuitBreaker(threshold=1, reset_seconds=0)
+        breaker.record_failure()
+        client = AsyncUpstreamClient(
+            http, limiter=AsyncAdaptiveLimiter(initial=4), breaker=breaker,
+            retry=RetryPolicy(attempts=1, base_seconds=0, max_seconds=0),
+        )
+        task = asyncio.create_task(client.request("GET", "/water-level/r1"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return breaker.allow()
+
+    assert asyncio.run(run())